@@ -1,44 +1,68 @@
 ## packages required for this module
-## pandas, numpy, matplotlib, statmodels, pandas_datareader, datetime, yfinance, sklearn, PyPortfolioOpt
+## pandas, numpy, matplotlib, pandas_datareader, datetime, yfinance, sklearn, PyPortfolioOpt, pyarrow
 
 ## lets first import all the packages we need
-import yfinance as yf
 import pandas as pd
 import numpy as np
-from statsmodels.regression.rolling import RollingOLS
-import statsmodels.api as sm
-import pandas_datareader.data as web
 import matplotlib.pyplot as plt
 import datetime as dt
-import pandas_ta
 import warnings
+## the market data source (yahoo, or the offline synthetic market)
+## the yahoo prices go through the local price store, so we don't download the same prices every run
+from marketData import get_source
+## the vectorized indicator engine
+from indicatorEngine import compute_indicators
+## and the batched rolling factor betas
+from rollingBetas import rolling_betas
+## and the vectorized backtest engine
+from backtestEngine import build_weights, run_backtest
+## and the parallel, cached weight optimizer
+from weightOptimizer import optimize_months, default_cache_path as optimization_cache_path
+## and the monthly KMeans clustering
+from monthlyClustering import cluster_months, default_segments
+## and the vectorized lagged returns
+from returnKernel import lagged_returns
+## and the (field, date, ticker) panel for the monthly aggregation
+from panelData import Panel, rank_rows
+## and the stage cache, so a rerun only computes
+## the stages whose inputs or parameters changed
+from stageCache import StageCache
+## and the stage profiler (off unless STAGE_PROFILE is set)
+from stageProfiler import profiled, stage
 warnings.filterwarnings('ignore')
 
+## the strategy is split into stages
+## download -> features -> monthly aggregation -> returns -> betas
+## -> clustering -> stock selection -> optimization -> backtest
+## each stage is a function of the previous stages' outputs and its parameters
+## and the pipeline at the bottom runs them through the stage cache
+## so changing e.g. the cluster targets reuses the cached features and betas
+
 ## next we want to get the list
 ## of the SP500 companies
 ## https://en.wikipedia.org/wiki/List_of_S%26P_500_companies
-sp500 = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')[0]
-## we only need the symbols
-## and we need to do some cleanings on that field
+## the source cleans the symbols up:
 ## replacing dots with dashes and
 ## getting rid of the spaces, and making sure they're all uppercased
-sp500['Symbol'] = sp500['Symbol'].str.replace('.','-').str.upper().str.strip()
-## and then getting all the unique values, as a list
-symbols_list = sp500['Symbol'].unique().tolist()
+## and returns the unique values, as a list
+def load_sp500_symbols():
+    return get_source().constituents()
+
+## lets get the SP500 stock prices
+## from the data source, with the yahoo source they come
+## from the local price store, which only downloads
+## the date ranges it doesn't have yet
+## and it's already stacked, with (date, ticker) as the index
+## so it'd be easier to work with the df
+@profiled('download')
+def download_prices(symbols_list, start_date, end_date):
+    data = get_source().prices(tickers = symbols_list,
+                               start = start_date,
+                               end = end_date)
+    ## makeing all the column names lower
+    data.columns = data.columns.str.lower()
+    return data
 
-## lets define our start and end dates
-## going back 8 years
-end_date = '2023-12-20'
-start_date = pd.to_datetime(end_date) - pd.DateOffset(365*8)
-## lets download the SP500 stock prices
-## we will use stack so it'd be easier to work with the df
-data = yf.download(tickers = symbols_list,
-                  start = start_date,
-                  end = end_date).stack()
-## we then want to assign names to each index
-data.index.names = ['date', 'ticker']
-## makeing all the column names lower
-data.columns = data.columns.str.lower()
 ## in the next step
 ## we want to start calculating the features and indicators for each stock
 ## 1. Garman-Klass Volatility
@@ -47,112 +71,128 @@ data.columns = data.columns.str.lower()
 ## 4. ATR
 ## 5. MACD
 ## 6. Dollar Volume
+@profiled('features')
+def compute_features(data):
+    data = data.copy()
+    ## German-Klass gives a measure over volatility of an asset
+    with stage('garman_klass'):
+        data['german_klass_vol'] = ((np.log(data['high'])-np.log(data['low']))**2)/2-(2*np.log(data['adj close'])-1)*(np.log(data['adj close'])-np.log(data['open']))**2
+    ## then for RSI, Bollinger Bands, ATR and MACD
+    ## we use the indicator engine
+    ## it works on the wide date x ticker matrix
+    ## and calculates all the tickers in one pass over the dates
+    ## instead of calling pandas_ta once per ticker
+    ## it gives the same values as pandas_ta
+    ## (indicatorEngine.parity_report(data) compares the two)
+    ## RSI with length 20,
+    ## low, mid, and high Bollinger Bands of the log1p prices, with length 20
+    ## ATR with length 14 and MACD, both normalized per stock
+    ## (sub mean and div by std)
+    with stage('indicators'):
+        data = data.join(compute_indicators(data,
+                                            rsi_length = 20,
+                                            bb_length = 20,
+                                            atr_length = 14))
+    ## for Dollar Volume
+    ## we have to divide by 1m
+    data['dollar_volume'] = (data['adj close']*data['volume'])/1e6
+    return data
 
-## German-Klass gives a measure over volatility of an asset
-data['german_klass_vol'] = ((np.log(data['high'])-np.log(data['low']))**2)/2-(2*np.log(data['adj close'])-1)*(np.log(data['adj close'])-np.log(data['open']))**2
-## then for RSI we use the pandas_ta library
-## we have to group the df by ticker and then apply the function
-data['rsi'] = data.groupby(level=1)['adj close'].transform(lambda x:pandas_ta.rsi(close=x, length = 20))
-## now for the Bollinger Bands
-## we will use pandas_ta
-## and get low, mid, and high values
-data['bb_low'] = data.groupby(level=1)['adj close'].transform(lambda x: pandas_ta.bbands(close=np.log1p(x), length = 20).iloc[:,0])
-data['bb_mid'] = data.groupby(level=1)['adj close'].transform(lambda x: pandas_ta.bbands(close=np.log1p(x), length = 20).iloc[:,1])
-data['bb_high'] = data.groupby(level=1)['adj close'].transform(lambda x: pandas_ta.bbands(close=np.log1p(x), length = 20).iloc[:,2])
-## for ATR
-## we need 3 columns, so we can't use transform and need to use apply
-## and we need to define a function to calculate the values
-def compute_atr(stock_data):
-    ## the atr fn takes 3 inputs
-    ## high, low, and close
-    atr = pandas_ta.atr(high = stock_data['high'],
-                   low = stock_data['low'],
-                   close = stock_data['close'],
-                   length = 14)
-    ## and we need to return a normalized df
-    ## so we sub mean and div by std
-    return atr.sub(atr.mean()).div(atr.std())
-## now we need to calculate the ATR
-data['atr'] = data.groupby(level=1, group_keys = False).apply(compute_atr)
-## for MACD
-## we need to define our own duction 
-def compute_macd(close):
-    macd = pandas_ta.macd(close = close, length=20).iloc[:,0]
-    return macd.sub(macd.mean()).div(macd.std())
-data['macd'] = data.groupby(level=1, group_keys = False)['adj close'].apply(compute_macd)
-## for Dollar Volume
-## we have to divide by 1m 
-data['dollar_volume'] = (data['adj close']*data['volume'])/1e6
 ## now for the next step
 ## we want to aggregate to monthly level
 ## and then get the top 150 most liquid stock for each month
 ## to reduce the training time and experiment w featurs & stategies
-## for the dollar volume, we only need to get the monthly mean for each stock
-## list of columns we want to operate on 
-skip_list = ['dollar_volume', 'volume', 'open','high','low', 'close']
-last_cols = [c for c in data.columns if c not in skip_list]
-monthly_data = pd.concat([data.unstack('ticker')[last_cols].resample('M').last().stack('ticker'),
-           data.unstack('ticker')['dollar_volume'].resample('M').mean().stack('ticker').to_frame('dollar_volume')], axis = 1).dropna()
-## now we want to calculate 5-year rolling average of dollar volume
-monthly_data['dollar_volume_5_yr'] = monthly_data.loc[:,'dollar_volume'].unstack('ticker').rolling(5*12, min_periods = 12).mean().stack('ticker')
-## then we want to rank the stock using the new metric
-monthly_data['dollar_volume_ranking'] = monthly_data.groupby(level=0)['dollar_volume_5_yr'].rank(ascending = False)
-## and only get the top 150 stockes
-monthly_data = monthly_data[monthly_data['dollar_volume_ranking']<=150].drop(['dollar_volume_ranking', 'dollar_volume_5_yr','dollar_volume'], axis=1)
+## the monthly steps work on the (field, date, ticker) panel
+## instead of unstacking and stacking the long df for each of them
+@profiled('monthly')
+def aggregate_monthly(data, top_n = 150):
+    ## for the dollar volume, we only need to get the monthly mean for each stock
+    ## list of columns we want to operate on
+    skip_list = ['dollar_volume', 'volume', 'open','high','low', 'close']
+    last_cols = [c for c in data.columns if c not in skip_list]
+    panel = Panel.from_long(data, fields = last_cols + ['dollar_volume'])
+    monthly = panel.resample('M', {**{c:'last' for c in last_cols}, 'dollar_volume':'mean'})
+    return select_liquid(monthly, last_cols, top_n = top_n)
+
+## the most liquid stocks of every month
+## monthly is the panel of the monthly values and the dollar volume means
+## (the incremental daily update builds the same panel from its saved months)
+def select_liquid(monthly, last_cols, top_n = 150):
+    ## only keeping the (month, stock) that have all the values
+    monthly = monthly.where(monthly.complete()).drop_empty_dates()
+    ## now we want to calculate 5-year rolling average of dollar volume
+    dollar_volume_5_yr = monthly.rolling_mean('dollar_volume', 5*12, min_periods = 12)
+    ## the rolling mean carries on after a stock stops trading (e.g. delisted)
+    ## so only the stocks with a row that month are ranked
+    dollar_volume_5_yr = np.where(monthly.complete(), dollar_volume_5_yr, np.nan)
+    ## then we want to rank the stock using the new metric
+    dollar_volume_ranking = rank_rows(dollar_volume_5_yr, ascending = False)
+    ## and only get the top 150 stockes
+    return monthly.to_long(fields = last_cols, mask = dollar_volume_ranking<=top_n)
+
 ## now the next step is to calculate the monthly returns for different periods
-## we need to define our own function
-def calculate_return(df):
-    lags = [1,2,3,6,9,12]
-    outlier_cutoff = 0.005
-    for lag in lags:
-        df[f'return_{lag}m'] = df['adj close'].pct_change(lag).pipe(lambda x:x.clip(lower = x.quantile(outlier_cutoff),upper = x.quantile(1-outlier_cutoff))).add(1).pow(1/lag).sub(1)
-    return df
-monthly_data = monthly_data.groupby(level=1, group_keys = False).apply(calculate_return).dropna()
+## with the return kernel, for all the lags and tickers at once
+## each lag's return is clipped to the ticker's own outlier quantiles
+## and then turned into a monthly return
+## it gives the same values as the per-ticker pct_change/quantile/clip
+## and the new columns are added in one go
+@profiled('returns')
+def add_returns(monthly_data, lags = [1,2,3,6,9,12], outlier_cutoff = 0.005):
+    return pd.concat([monthly_data,
+                      lagged_returns(monthly_data, lags = lags, outlier_cutoff = outlier_cutoff)], axis = 1).dropna()
 
 ## now we need to download Fama-French Factors
 ## and calculate rolling factor betas
 ## this step is used to estimate the exposure of assets
 ## to the common risk factors using linear regression
 ## the five factors are market risk, size, value, operating profitability, annd investment
-## we will use the pandas_datareader library for this
-## and get the monthly level data 
-factor_data = web.DataReader('F-F_Research_Data_5_Factors_2x3',
-              'famafrench',
-              start = '2010')[0].drop('RF', axis = 1)
-## need to fix the index first
-factor_data.index = factor_data.index.to_timestamp()
-## and then fix the date to be the end of the month
-## and getting the actual values instead of %
-factor_data = factor_data.resample('M').last().div(100)
-factor_data.index.name = 'date'
-## now we need to join our factors with the 
-## return_1m
-factor_data = factor_data.join(monthly_data['return_1m']).sort_index()
-## we want to remove the stocks with less than 10 months of data
-valid_stocks = factor_data.groupby(level =1).size()[factor_data.groupby(level =1).size() >=10].index
-## then using the valid stocks to filter out low data point tickers
-factor_data = factor_data[factor_data.index.get_level_values('ticker').isin(valid_stocks)]
-## now we're ready to calculate rolling factor betas
-## using the RollingOLS from statmodels
-## giving the return of 1m as endog and the rest of the df as exog
-## with the window of 24 or the no of rows available for that ticker
-## and then dropping the constant column
-betas = factor_data.groupby(level=1, group_keys = False).apply(lambda x:RollingOLS(endog = x['return_1m'],
-                                                                          exog=sm.add_constant(x.drop('return_1m', axis=1)),
-                                                                          window = min(24, x.shape[0]),
-                                                                          min_nobs = len(x.columns)+1).fit(params_only=True).params.drop('const', axis=1))
-## we need to shift the betas for one month for each stock
-## because these are the values we have at the begining of the month
-## for instance, we will have the beta for Oct in Nov
-## so before joining them with our main df 
-## we need to fix that
-monthly_data = monthly_data.join(betas.groupby(level=1).shift())
-## we will have many missing values in the df
-## and want to replace them with the mean value 
-factors = ['Mkt-RF','SMB','HML','RMW','CMA']
-monthly_data.loc[:, factors] = monthly_data.groupby(level=1, group_keys = False)[factors].apply(lambda x:x.fillna(x.mean()))
-## we no longer need the adj close at this point
-monthly_data.drop('adj close',axis=1, inplace = True)
+## from the data source (the yahoo source uses the pandas_datareader library for this)
+## and get the monthly level data
+## the source fixes the index to be the end of the month
+## and gives the actual values instead of %
+@profiled('factors')
+def download_factors():
+    return get_source().factors(start = '2010')
+
+@profiled('betas')
+def add_betas(monthly_data, factor_data, window = 24, min_months = 10):
+    ## now we need to join our factors with the
+    ## return_1m
+    factor_data = factor_data.join(monthly_data['return_1m']).sort_index()
+    ## we want to remove the stocks with less than 10 months of data
+    valid_stocks = factor_data.groupby(level =1).size()[factor_data.groupby(level =1).size() >=min_months].index
+    ## then using the valid stocks to filter out low data point tickers
+    factor_data = factor_data[factor_data.index.get_level_values('ticker').isin(valid_stocks)]
+    ## now we're ready to calculate rolling factor betas
+    ## using the batched rolling regression
+    ## giving the return of 1m as endog and the rest of the df as exog
+    ## with the window of 24 or the no of rows available for that ticker
+    ## it runs the regressions of all the tickers together
+    ## and returns the betas without the constant
+    with stage('rolling_regression') as s:
+        betas = s.output(rolling_betas(factor_data,
+                                       endog = 'return_1m',
+                                       window = window,
+                                       min_nobs = len(factor_data.columns)+1))
+    return join_betas(monthly_data, betas)
+
+## joining the betas of every (month, stock) to the monthly data
+## (the incremental daily update has its own running regressions, and joins them the same way)
+def join_betas(monthly_data, betas):
+    ## we need to shift the betas for one month for each stock
+    ## because these are the values we have at the begining of the month
+    ## for instance, we will have the beta for Oct in Nov
+    ## so before joining them with our main df
+    ## we need to fix that
+    monthly_data = monthly_data.join(betas.groupby(level=1).shift())
+    ## we will have many missing values in the df
+    ## and want to replace them with the mean value
+    factors = ['Mkt-RF','SMB','HML','RMW','CMA']
+    with stage('fill_betas'):
+        monthly_data.loc[:, factors] = monthly_data.groupby(level=1, group_keys = False)[factors].apply(lambda x:x.fillna(x.mean()))
+    ## we no longer need the adj close at this point
+    return monthly_data.drop('adj close',axis=1)
+
 ## now we're ready to apply ML to our df
 ## we have 18 main features
 ## and want to decide at each month
@@ -171,72 +211,71 @@ monthly_data.drop('adj close',axis=1, inplace = True)
 ## we can start with low numbers and take it from there
 ## to get the optimum number
 ## for this data, 4 seems to be a good number of clusters
-from sklearn.cluster import KMeans
-## we want to define a function
-## that can assign clusters
-def get_cluster(df):
-    ## it'll create a KMeans model
-    ## asking for 4 clusters
-    ## making sure the result is re-creatable
-    ## and telling it to use random initialization for our 1st model
-    df['cluster'] = KMeans(n_clusters = 4,
-                          random_state = 0,
-                          init='random').fit(df).labels_
-    return df
-## now we want to apply the clustering function
-clustered_data = monthly_data.dropna().groupby('date', group_keys = False).apply(get_cluster)
+## we will use the monthly clustering stage
+## that runs KMeans for each month, with the months split over the workers
+## asking for 4 clusters
+## making sure the result is re-creatable
+## and telling it to use random initialization for our 1st model
+## every month is independent here, so no warm starts
+def cluster_random(monthly_data, n_clusters = 4):
+    return cluster_months(monthly_data.dropna(),
+                          init = 'random',
+                          n_clusters = n_clusters,
+                          warm_start = False,
+                          random_state = 0)
+
 ## now we want to plot our clusters
 ## for better understanding
 ## we will define a function for that as well
 def plot_cluster(data):
     plt.style.use('ggplot')
+    colors = ['blue', 'green', 'black', 'red']
     ## separating the clusters
-    cluster_0 = data[data['cluster']==0]
-    cluster_1 = data[data['cluster']==1]
-    cluster_2 = data[data['cluster']==2]
-    cluster_3 = data[data['cluster']==3]
     ## and then plotting scatter plots with them
     ## we will use RSI here, because we didn't normalize that matric
-    plt.scatter(cluster_0.iloc[:,0],cluster_0.iloc[:,6], color = 'blue', label = 'Cluster 0')
-    plt.scatter(cluster_1.iloc[:,0],cluster_1.iloc[:,6], color = 'green', label = 'Cluster 1')
-    plt.scatter(cluster_2.iloc[:,0],cluster_2.iloc[:,6], color = 'black', label = 'Cluster 2')
-    plt.scatter(cluster_3.iloc[:,0],cluster_3.iloc[:,6], color = 'red', label = 'Cluster 3')
+    for cluster_id in sorted(data['cluster'].unique()):
+        cluster = data[data['cluster']==cluster_id]
+        plt.scatter(cluster['atr'], cluster['rsi'], color = colors[cluster_id % len(colors)], label = f'Cluster {cluster_id}')
     plt.legend()
     plt.show()
     return 0
+
 ## we want to plot for each month
-for i in clustered_data.index.get_level_values('date').unique().tolist():
-    g = clustered_data.xs(i)
-    plt.title(f'Date {i}')
-    ## uncomment if checking the graphs
-    # plot_cluster(g)
-## if we look at the plots, 
+def plot_clusters(clustered_data):
+    for i in clustered_data.index.get_level_values('date').unique().tolist():
+        g = clustered_data.xs(i)
+        plt.title(f'Date {i}')
+        plot_cluster(g)
+
+## if we look at the plots,
 ## we will notice that the clusters are assigned randomly
 ## and we want to change that
 ## the strategy would be to follow stock momentum
 ## in order to do that, we have to specify the centroids for our model
 ## and we'll be using the RSI values
-target_rsi_values = [30, 45, 55, 70]
-## we want the number of clusters, and number of features
-initial_centroids = np.zeros((len(target_rsi_values), 18))
-## and then use the target values in the RSI column of the array
-initial_centroids[:,6] = target_rsi_values
-## and use this centroid in our KMeans model
-## create a new function (or modify the old one)
-## to use the defined initial centroid
-def get_cluster_with_init(df):
-    df['cluster'] = KMeans(n_clusters = 4,
-                          random_state = 0,
-                          init=initial_centroids).fit(df).labels_
-    return df
-## and just apply the new function to the set
-clustered_data = monthly_data.dropna().groupby('date', group_keys = False).apply(get_cluster_with_init)
-## and then plot the new clusters
-for i in clustered_data.index.get_level_values('date').unique().tolist():
-    g = clustered_data.xs(i)
-    plt.title(f'Date {i}')
-    ## uncomment if checking the grapghs
-    # plot_cluster(g)
+@profiled('clustering')
+def cluster_stocks(monthly_data, target_rsi_values = [30, 45, 55, 70], n_segments = default_segments, max_workers = None):
+    features = monthly_data.dropna()
+    ## we want the number of clusters, and number of features
+    initial_centroids = np.zeros((len(target_rsi_values), features.shape[1]))
+    ## and then use the target values in the RSI column of the array
+    initial_centroids[:,features.columns.get_loc('rsi')] = target_rsi_values
+    ## and use this centroid in our KMeans model
+    ## the first month starts from these centroids
+    ## and every next month starts from the previous month's centroids
+    ## which converges in fewer iterations
+    ## and keeps the high RSI stocks in cluster 3
+    ## the months are split into a few chains that run in parallel
+    ## and each chain starts again from the initial centroids
+    ## (n_segments chains, however many workers run them)
+    ## cluster_stats has the inertia and the iterations of every month
+    return cluster_months(features,
+                          init = initial_centroids,
+                          warm_start = True,
+                          n_segments = n_segments,
+                          max_workers = max_workers,
+                          random_state = 0)
+
 ## now we know if the stocks with high RSI are in cluster 3
 ## we want our porfolio to be stocks that are in that cluster
 ## for the previous perids
@@ -246,139 +285,144 @@ for i in clustered_data.index.get_level_values('date').unique().tolist():
 ## and form a portfolio based on the Efficient Frontier max sharpe ratio optimization
 ## first we only get the stocks that are in a given cluster
 ## and if the momentum is persistent
-## then those stocks should continue to outperform 
+## then those stocks should continue to outperform
 ## in the following month
-## we will pick cluster 3, 
+## we will pick cluster 3,
 ## which seems to be having the stocks that we're interested
-filtered_data = clustered_data[clustered_data['cluster'] ==3].copy()
-## and then reset the index to have the tickers in the columns
-filtered_data = filtered_data.reset_index(level = 1)
-## then assign the 1st day of the next month,
-## to the previous month clusters
-filtered_data.index = filtered_data.index+pd.DateOffset(1)
-filtered_data = filtered_data.reset_index().set_index(['date', 'ticker'])
-## and now we want to create a dictionary
-## that as the month as the key
-## and the stocks as a list of vals for that key
-months = filtered_data.index.get_level_values('date').unique().tolist()
-stocks_dict = {}
-for month in months:
-    ## changing the ts to dt
-    stocks_dict[month.strftime('%Y-%m-%d')] = filtered_data.xs(month).index.unique().tolist()
-## the next step is to define the optimization function
-## we will define a weight optimizer function 
-## that'll be using PyPortfolioOpt and EfficientFrontier
-## to optimize for weights
-## we need to use the last year's prices 
-## apply the single stock weight bounds constraint for diversification
+## clusters is the (clustered_data, cluster_stats) of the clustering stage
+@profiled('selection')
+def select_stocks(clusters, cluster_id = 3):
+    clustered_data, _ = clusters
+    filtered_data = clustered_data[clustered_data['cluster'] ==cluster_id].copy()
+    ## and then reset the index to have the tickers in the columns
+    filtered_data = filtered_data.reset_index(level = 1)
+    ## then assign the 1st day of the next month,
+    ## to the previous month clusters
+    filtered_data.index = filtered_data.index+pd.DateOffset(1)
+    filtered_data = filtered_data.reset_index().set_index(['date', 'ticker'])
+    ## and now we want to create a dictionary
+    ## that as the month as the key
+    ## and the stocks as a list of vals for that key
+    months = filtered_data.index.get_level_values('date').unique().tolist()
+    stocks_dict = {}
+    for month in months:
+        ## changing the ts to dt
+        stocks_dict[month.strftime('%Y-%m-%d')] = filtered_data.xs(month).index.unique().tolist()
+    return stocks_dict
+
+## the next step is to optimize the weights
+## we will use PyPortfolioOpt and EfficientFrontier
+## through the weight optimizer
+## it uses the last year's prices for every month
+## and applies the single stock weight bounds constraint for diversification
 ## with min as half equaly weighed and max as 10% portfolio
-from pypfopt.efficient_frontier import EfficientFrontier
-from pypfopt import risk_models
-from pypfopt import expected_returns
-## and then create the func
-def optimize_weight(prices, lower_bound = 0):
-    ## for calculating the returns
-    ## we will use the expected returns
-    ## and use the prices and 252 as freq 
-    ## which is the # of date to trade in a year
-    returns = expected_returns.mean_historical_return(prices = prices,
-                              frequency = 252)
-    ## and for our covariance
-    ## we will use the risk models
-    ## and supply the same vals
-    cov = risk_models.sample_cov(prices = prices,
-                     frequency = 252)
-    ## and then we have to create the EF model
-    ## and input the created vals in the prior step
-    ## + the weight bounds and the solver
-    ef = EfficientFrontier(expected_returns=returns,
-                          cov_matrix=cov,
-                          weight_bounds=(lower_bound,.1),
-                          solver='SCS')
-    ## for weights
-    ## we will use max sharpe from EF
-    weights = ef.max_sharpe()
-    return ef.clean_weights()
+## the mean returns and covariance are updated as the year window rolls
+## the months are solved in parallel
+## and the results are cached, so a rerun doesn't solve them again
 ## we need at least one year prior to the current df
 ## so we should download a new set of data
 ## with that start date
-## we want to only get the stocks info 
+## we want to only get the stocks info
 ## for the ones that we have in our current set
-start_date = monthly_data.index.get_level_values('date').unique()[0]-pd.DateOffset(months=12)
-end_date = monthly_data.index.get_level_values('date').unique()[-1]
+@profiled('fresh_prices')
+def download_fresh_prices(monthly_data):
+    start_date = monthly_data.index.get_level_values('date').unique()[0]-pd.DateOffset(months=12)
+    end_date = monthly_data.index.get_level_values('date').unique()[-1]
+    stocks = monthly_data.index.get_level_values('ticker').unique().tolist()
+    ## most of these prices are already in the local store
+    ## so only the extra year at the start gets downloaded
+    fresh_data = get_source().prices(tickers = stocks, start = start_date, end = end_date).unstack('ticker')
+    ## keeping the same index and column names as yf.download
+    return fresh_data.rename_axis(index = 'Date', columns = [None, None])
 
-stocks = monthly_data.index.get_level_values('ticker').unique().tolist()
-fresh_data = yf.download(tickers = stocks, start = start_date, end = end_date)
 ## the next step will be
 ## to calculate the daily returns
 ## for each stock that could land in our pf
-## and then loop over each month
+## and then for each month
 ## select the stocks, and calculate the weight
 ## for the next month
 ## and if the maximum sharpe fails for a month
 ## then we will use the equally-weighed weights
-## and then calculate the daily returns
-returns_df = np.log(fresh_data['Adj Close']).diff()
-portfolio_df = pd.DataFrame()
-## loop through the dictionary
-for start_date in stocks_dict:
-    try:
-        ## end date will be the end of the current month
-        end_date = (pd.to_datetime(start_date)+pd.offsets.MonthEnd(0)).strftime('%Y-%m-%d')
-        ## and then we need to get the sctocks for that date
-        stocks_to_use = stocks_dict[start_date]
-        ## now we have to use our optimizer
-        ## to calculate the weights
-        optimization_start_date = (pd.to_datetime(start_date)-pd.DateOffset(months = 12)).strftime('%Y-%m-%d')
-        optimization_end_date = (pd.to_datetime(start_date)-pd.DateOffset(days = 1)).strftime('%Y-%m-%d')
-        ## and then create our optimization df
-        optimization_df = fresh_data[optimization_start_date:optimization_end_date]['Adj Close'][stocks_to_use]
-        ## supply the half of the equaly weighed stocks as lower bound
-        lower_bound = round((1/len(stocks_to_use)*.5),3)
-        ## for catching the cases that 
-        ## max sharpe won't work
-        ## we will just use the equal weights
-        try:
-            weights = optimize_weight(optimization_df,lower_bound=lower_bound)
-            ## and then convert the weights to df
-            ## so it'll be easy to merge with the returns df
-            weights = pd.DataFrame(weights, index=pd.Series(0))
-        except:
-            print(f'Max Sharpe failed for {start_date}, replacing with equal weights')
-            weights = pd.DataFrame({col:1/len(stocks_to_use) for col in stocks_to_use}, index = pd.Series(0))
-        ## current month returns
-        current_returns = returns_df[start_date:end_date]
-        ## then we have to merge it with our weights 
-        ## using the stocks ticker
-        current_returns = current_returns.stack().to_frame('returns').reset_index(level=0)\
-                            .merge(weights.stack().to_frame('weights').reset_index(level=0, drop=True),
-                                  left_index=True,
-                                  right_index=True)\
-                            .reset_index().set_index(['Date', 'index']).unstack().stack()
-        ## fixing the index names
-        current_returns.index.names = ['date', 'ticker']
-        ## and then calculating the daily weighted return for each stock
-        current_returns['weighted_return'] = current_returns['weights']*current_returns['returns']
-        ## and sum all of the returns to get the total daily return
-        current_returns = current_returns.groupby(level=0)['weighted_return'].sum().to_frame('Strategy Return')
-        ## and the last step would be to concat the returns df to the portfolio
-        portfolio_df = pd.concat([portfolio_df, current_returns], axis = 0)
-    except Exception as e:
-        print(e)
-portfolio_df.drop_duplicates(inplace = True)
+## we use the last 12 months (up to the day before)
+## and 252 as freq, which is the # of date to trade in a year
+## with the max sharpe from EF and the SCS solver
+## the outcome of every month (max sharpe, equal weights or skipped)
+## is in the optimization_outcomes table
+@profiled('optimize')
+def optimize_portfolio(fresh_data, stocks_dict, window_months = 12, lower_bound = None, upper_bound = .1,
+                       max_workers = None, cache_path = optimization_cache_path):
+    allocations, optimization_outcomes = optimize_months(fresh_data['Adj Close'],
+                                                         stocks_dict,
+                                                         window_months = window_months,
+                                                         lower_bound = lower_bound,
+                                                         upper_bound = upper_bound,
+                                                         frequency = 252,
+                                                         solver = 'SCS',
+                                                         max_workers = max_workers,
+                                                         cache_path = cache_path)
+    for start_date, outcome in optimization_outcomes[optimization_outcomes['status'] != 'max_sharpe'].iterrows():
+        print(f"{outcome['status']} for {start_date.strftime('%Y-%m-%d')}: {outcome['error']}")
+    return allocations, optimization_outcomes
+
+## optimized is the (allocations, optimization_outcomes) of the optimization stage
+@profiled('backtest')
+def backtest_portfolio(fresh_data, optimized, transaction_cost = 0):
+    allocations, _ = optimized
+    ## and then calculate the daily returns
+    returns_df = np.log(fresh_data['Adj Close']).diff()
+    ## the weights are held until the end of the month
+    hold_until = {start_date:(pd.to_datetime(start_date)+pd.offsets.MonthEnd(0)).strftime('%Y-%m-%d') for start_date in allocations}
+    ## now we build the daily weight matrix
+    ## with each month's weights held until the end of that month
+    ## and then the engine calculates the daily weighted return
+    ## and sums them to get the total daily return, for all the days in one go
+    weights_df = build_weights(allocations, returns_df.index, hold_until = hold_until)
+    backtest_df = run_backtest(weights_df, returns_df, transaction_cost = transaction_cost)
+    return backtest_df[['net_return']].rename(columns = {'net_return':'Strategy Return'})
+
 ## now we want to compare our returns with SP500
 ## we should download the SP500 stock
-spy = yf.download(tickers = 'SPY',
-                 start='2015-01-01',
-                 end=dt.date.today())
-spy_net = np.log(spy['Adj Close']).diff().to_frame().dropna().rename({'Adj Close':'SPY Buy&Hold'}, axis = 1)
-portfolio_df_w_spy = portfolio_df.merge(spy_net, left_index=True, right_index=True)
-## and calculate the cumulative return
-portfolio_cumulative_return = np.exp(np.log1p(portfolio_df_w_spy).cumsum())-1
-## and finally ploting the values
-plt.style.use('ggplot')
-portfolio_cumulative_return.plot(figsize=(20,10))
-plt.title('Unsupervised Strategy Returns Over Time')
-plt.show()
-## which shows significantly better performance
-## for stategy developed here
\ No newline at end of file
+def plot_against_spy(portfolio_df):
+    spy = get_source().prices(tickers = 'SPY',
+                              start='2015-01-01',
+                              end=dt.date.today()).xs('SPY', level = 'ticker')
+    spy_net = np.log(spy['Adj Close']).diff().to_frame().dropna().rename({'Adj Close':'SPY Buy&Hold'}, axis = 1)
+    portfolio_df_w_spy = portfolio_df.merge(spy_net, left_index=True, right_index=True)
+    ## and calculate the cumulative return
+    portfolio_cumulative_return = np.exp(np.log1p(portfolio_df_w_spy).cumsum())-1
+    ## and finally ploting the values
+    plt.style.use('ggplot')
+    portfolio_cumulative_return.plot(figsize=(20,10))
+    plt.title('Unsupervised Strategy Returns Over Time')
+    plt.show()
+    ## which shows significantly better performance
+    ## for stategy developed here
+
+if __name__ == '__main__':
+    ## every stage is saved under a hash of its code, its parameters
+    ## and its inputs, in data/stage_cache
+    ## the downloads are sources, hashed by their content
+    cache = StageCache()
+    ## lets define our start and end dates
+    ## going back 8 years
+    end_date = '2023-12-20'
+    start_date = pd.to_datetime(end_date) - pd.DateOffset(365*8)
+    symbols = cache.source('symbols', load_sp500_symbols())
+    data = cache.source('prices', download_prices(symbols.value, start_date, end_date))
+    features = cache.run('features', compute_features, data)
+    monthly_data = cache.run('monthly', aggregate_monthly, features, top_n = 150)
+    monthly_data = cache.run('returns', add_returns, monthly_data,
+                             lags = [1,2,3,6,9,12], outlier_cutoff = 0.005)
+    factor_data = cache.source('factors', download_factors())
+    monthly_data = cache.run('betas', add_betas, monthly_data, factor_data, window = 24)
+    ## uncomment if checking the graphs
+    ## of the random initialization
+    # plot_clusters(cache.run('random_clusters', cluster_random, monthly_data, n_clusters = 4).value[0])
+    clusters = cache.run('clusters', cluster_stocks, monthly_data, target_rsi_values = [30, 45, 55, 70])
+    ## uncomment if checking the grapghs
+    # plot_clusters(clusters.value[0])
+    stocks_dict = cache.run('selection', select_stocks, clusters, cluster_id = 3)
+    fresh_data = cache.source('fresh_prices', download_fresh_prices(monthly_data.value))
+    optimized = cache.run('optimization', optimize_portfolio, fresh_data, stocks_dict, upper_bound = .1)
+    portfolio_df = cache.run('backtest', backtest_portfolio, fresh_data, optimized, transaction_cost = 0)
+    plot_against_spy(portfolio_df.value)
@@ -0,0 +1,65 @@
+## Vectorized Portfolio Backtest Engine
+## instead of merging the weights with the returns month by month
+## and growing the portfolio df with pd.concat
+## we build one dense date x ticker weight matrix
+## (each rebalance's weights held until the next one)
+## and get the strategy returns from a single row-wise product
+## with the daily return matrix
+## it also keeps track of the turnover and the transaction costs
+## packages required for this module
+## pandas, numpy
+import numpy as np
+import pandas as pd
+
+## allocations is a dict of {rebalance date: {ticker: weight}}
+## dates are the trading days we want the weights for
+## and hold_until is an optional dict of {rebalance date: last date}
+## for when the weights should only be held for a while (e.g. a month)
+## without it, every rebalance is held until the next one
+## it only returns the days that are covered by some rebalance
+def build_weights(allocations, dates, tickers = None, hold_until = None):
+    rebalance_dates = pd.to_datetime(list(allocations))
+    order = np.argsort(rebalance_dates, kind = 'stable')
+    rebalance_dates = rebalance_dates[order]
+    keys = [list(allocations)[i] for i in order]
+    if tickers is None:
+        tickers = sorted({ticker for key in keys for ticker in allocations[key]})
+    tickers = pd.Index(tickers)
+    ## one row of weights for every rebalance
+    rebalance_weights = np.zeros((len(keys), len(tickers)))
+    for i, key in enumerate(keys):
+        weights = pd.Series(allocations[key], dtype = np.float64)
+        rebalance_weights[i] = weights.reindex(tickers).fillna(0).to_numpy()
+    ## the latest rebalance on or before each day
+    dates = pd.DatetimeIndex(dates)
+    latest = np.searchsorted(rebalance_dates.values, dates.values, side = 'right') - 1
+    active = latest >= 0
+    if hold_until is not None:
+        hold_end = pd.to_datetime([hold_until[key] for key in keys])
+        active &= dates.values <= hold_end.values[np.maximum(latest, 0)]
+    return pd.DataFrame(rebalance_weights[latest[active]],
+                        index = dates[active],
+                        columns = tickers)
+
+## weights is the dense date x ticker weight matrix
+## and returns the daily return matrix
+## missing returns count as zero
+## transaction_cost is the cost per unit of turnover
+## (e.g. 0.001 for 10 bps of the traded value)
+def run_backtest(weights, returns, transaction_cost = 0.0):
+    tickers = weights.columns
+    returns = returns.reindex(index = weights.index, columns = tickers)
+    w = weights.to_numpy(dtype = np.float64)
+    r = np.nan_to_num(returns.to_numpy(dtype = np.float64))
+    ## the weighted sum of the returns of every day
+    gross_return = np.einsum('ij,ij->i', w, r)
+    ## and how much of the portfolio is traded on each day
+    ## starting from cash
+    previous = np.vstack([np.zeros((1, w.shape[1])), w[:-1]])
+    turnover = np.abs(w - previous).sum(axis = 1)
+    cost = turnover * transaction_cost
+    return pd.DataFrame({'gross_return': gross_return,
+                         'turnover': turnover,
+                         'cost': cost,
+                         'net_return': gross_return - cost},
+                        index = weights.index)
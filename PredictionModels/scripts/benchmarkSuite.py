@@ -0,0 +1,312 @@
+## Pipeline Benchmark Suite
+## runs the trading scripts on synthetic data of growing sizes
+## and measures every stage: the wall time, the peak RSS of the process
+## and the peak (and net) memory allocated by python and numpy (tracemalloc)
+## algorithmicTrading.py is measured stage by stage (its stage functions)
+## and the other scripts, which run top to bottom, are measured as a whole
+## on generated input files (intraday bars, twitter data) of the given size
+## every (case, size) runs in its own process, so the sizes don't share memory
+## the results go to a JSON report, and can be compared with a baseline report
+## e.g.
+## python benchmarkSuite.py --cases algorithmic --preset small --output report.json
+## python benchmarkSuite.py --preset small --baseline baseline.json
+## packages required for this module
+## pandas, numpy, and the ones of the benchmarked scripts
+import os
+import sys
+import json
+import time
+import runpy
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import tracemalloc
+import subprocess
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_output_path = os.path.join(script_dir, '..', 'data', 'benchmarks', 'report.json')
+
+## the current resident memory of the process, in MB
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError):
+        ## without /proc we can only get the peak of the whole process
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+## sampling the RSS in a thread while a stage runs
+class PeakRSS:
+    def __init__(self, interval = .01):
+        self.interval = interval
+        self.peak = 0.
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target = self._sample, daemon = True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+## running fn and measuring it
+## it returns the result and the metrics
+def measure(fn, *args, trace_allocations = True, **kwargs):
+    if trace_allocations:
+        tracemalloc.start()
+    start_allocated = tracemalloc.get_traced_memory()[0] if trace_allocations else 0
+    try:
+        with PeakRSS() as rss:
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            wall = time.perf_counter() - start
+    finally:
+        if trace_allocations:
+            allocated, peak_allocated = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    metrics = {'wall_s': wall, 'peak_rss_mb': rss.peak}
+    if trace_allocations:
+        metrics.update({'alloc_peak_mb': (peak_allocated - start_allocated) / 1e6,
+                        'alloc_net_mb': (allocated - start_allocated) / 1e6})
+    return result, metrics
+
+## the cases
+## each one takes a size and yields (stage, function) pairs
+## which run one after the other (a stage can use the previous results)
+
+## algorithmicTrading.py stage by stage
+## size is {'tickers': n, 'years': y}, on the synthetic market
+def algorithmic_case(size):
+    os.environ['MARKET_DATA_SOURCE'] = 'synthetic'
+    os.environ['MARKET_DATA_TICKERS'] = str(size['tickers'])
+    import algorithmicTrading as at
+    end_date = '2023-12-20'
+    start_date = pd.to_datetime(end_date) - pd.DateOffset(365*size['years'])
+    state = {}
+    def stage(name, fn):
+        def run():
+            state[name] = fn()
+        return name, run
+    yield stage('download', lambda: at.download_prices(at.load_sp500_symbols(), start_date, end_date))
+    yield stage('features', lambda: at.compute_features(state['download']))
+    yield stage('monthly', lambda: at.aggregate_monthly(state.pop('features'), top_n = 150))
+    yield stage('returns', lambda: at.add_returns(state['monthly']))
+    yield stage('betas', lambda: at.add_betas(state['returns'], at.download_factors()))
+    yield stage('clustering', lambda: at.cluster_stocks(state['betas']))
+    yield stage('selection', lambda: at.select_stocks(state['clustering'], cluster_id = 3))
+    yield stage('fresh_prices', lambda: at.download_fresh_prices(state['betas']))
+    yield stage('optimization', lambda: at.optimize_portfolio(state['fresh_prices'], state['selection'],
+                                                              cache_path = None))
+    yield stage('backtest', lambda: at.backtest_portfolio(state['fresh_prices'], state['optimization']))
+
+## running a whole script in a temp folder
+## with the generated input files in ../data, where the scripts look for them
+def _run_script(script, files):
+    work_dir = tempfile.mkdtemp(prefix = 'benchmark_')
+    try:
+        os.makedirs(os.path.join(work_dir, 'scripts'))
+        os.makedirs(os.path.join(work_dir, 'data'))
+        for name, write in files.items():
+            write(os.path.join(work_dir, 'data', name))
+        cwd = os.getcwd()
+        os.chdir(os.path.join(work_dir, 'scripts'))
+        try:
+            runpy.run_path(os.path.join(script_dir, script), run_name = '__main__')
+        finally:
+            os.chdir(cwd)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+## writing a df like the csv files of the repo
+## (with the empty trailing column)
+def _write_csv(df, path, **kwargs):
+    df = df.copy()
+    df[''] = np.nan
+    df.to_csv(path, **kwargs)
+
+## intradayTrading.py on n 1-minute bars
+## and the daily bars from a year and a half before them
+def intraday_case(size):
+    from marketData import SyntheticSource
+    source = SyntheticSource()
+    bars = source.intraday('SIM', size['bars'], freq = '1min', bars_per_day = 390)
+    daily = source.prices('SIM', '2019-06-01', bars.index[-1].normalize() + pd.Timedelta(days = 1)).xs('SIM', level = 'ticker')
+    daily.index = daily.index.strftime('%m/%d/%Y')
+    daily.index.name = 'Date'
+    files = {'simulated_5min_data.csv': lambda path: _write_csv(bars, path),
+             'simulated_daily_data.csv': lambda path: _write_csv(daily, path)}
+    yield 'script', lambda: _run_script('intradayTrading.py', files)
+
+## sentimentTrading.py on n rows of twitter data, over the last two years
+def sentiment_case(size):
+    os.environ['MARKET_DATA_SOURCE'] = 'synthetic'
+    from marketData import SyntheticSource
+    end = pd.Timestamp(dt.date.today())
+    data = SyntheticSource().sentiment(size['rows'], end - pd.DateOffset(months = 24), end)
+    files = {'sentiment_data.csv': lambda path: _write_csv(data.set_index('date'), path)}
+    yield 'script', lambda: _run_script('sentimentTrading.py', files)
+
+## stockPredictionModel.py on the synthetic AAPL history
+def stock_prediction_case(size):
+    os.environ['MARKET_DATA_SOURCE'] = 'synthetic'
+    yield 'script', lambda: _run_script('stockPredictionModel.py', {})
+
+cases = {'algorithmic': algorithmic_case,
+         'intraday': intraday_case,
+         'sentiment': sentiment_case,
+         'stock_prediction': stock_prediction_case}
+
+## the sizes of every case
+## small is a quick check, full gives the scaling curves
+presets = {'small': {'algorithmic': [{'tickers': 100, 'years': 8}, {'tickers': 500, 'years': 8}],
+                     'intraday': [{'bars': 10_000}, {'bars': 100_000}],
+                     'sentiment': [{'rows': 10_000}, {'rows': 100_000}],
+                     'stock_prediction': [{}]},
+           'full': {'algorithmic': [{'tickers': n, 'years': 8} for n in [100, 500, 1000, 2500, 5000]]
+                                   + [{'tickers': 500, 'years': y} for y in [2, 5, 10, 20]],
+                    'intraday': [{'bars': n} for n in [10_000, 100_000, 1_000_000, 10_000_000]],
+                    'sentiment': [{'rows': n} for n in [10_000, 100_000, 1_000_000, 10_000_000]],
+                    'stock_prediction': [{}]}}
+
+## running one (case, size) in this process
+## it returns a result row for every stage
+## a failing stage is recorded, and the stages after it are skipped
+def run_case(case, size, trace_allocations = True):
+    import matplotlib
+    matplotlib.use('Agg')
+    import warnings
+    warnings.filterwarnings('ignore')
+    rows = []
+    for stage, fn in cases[case](size):
+        row = {'case': case, 'stage': stage, 'size': size}
+        try:
+            _, metrics = measure(fn, trace_allocations = trace_allocations)
+            row.update(metrics)
+            row['error'] = None
+        except Exception as e:
+            row['error'] = repr(e)
+        rows.append(row)
+        if row['error'] is not None:
+            break
+    return rows
+
+## running one (case, size) in a new process
+def run_isolated(case, size, trace_allocations = True, timeout = None):
+    command = [sys.executable, os.path.abspath(__file__), '--worker', case, json.dumps(size)]
+    if not trace_allocations:
+        command.append('--no-trace')
+    try:
+        done = subprocess.run(command, capture_output = True, text = True, timeout = timeout, cwd = script_dir)
+    except subprocess.TimeoutExpired:
+        return [{'case': case, 'stage': None, 'size': size, 'error': f'timed out after {timeout}s'}]
+    ## the worker prints its rows as the last line
+    lines = done.stdout.strip().splitlines()
+    if done.returncode != 0 or not lines:
+        return [{'case': case, 'stage': None, 'size': size,
+                 'error': f'worker failed ({done.returncode}): {done.stderr.strip()[-500:]}'}]
+    return json.loads(lines[-1])
+
+def run_suite(case_names = None, preset = 'small', trace_allocations = True, timeout = None):
+    case_names = case_names or list(cases)
+    results = []
+    for case in case_names:
+        for size in presets[preset][case]:
+            rows = run_isolated(case, size, trace_allocations = trace_allocations, timeout = timeout)
+            for row in rows:
+                print(format_row(row), flush = True)
+            results.extend(rows)
+    return {'created': dt.datetime.now().isoformat(timespec = 'seconds'),
+            'preset': preset,
+            'machine': {'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'cpus': os.cpu_count(),
+                        'numpy': np.__version__,
+                        'pandas': pd.__version__},
+            'results': results}
+
+def _size_label(size):
+    return ','.join(f'{k}={v}' for k, v in size.items()) or '-'
+
+def format_row(row):
+    if row.get('error'):
+        return f"{row['case']:<18}{str(row['stage']):<14}{_size_label(row['size']):<24}ERROR {row['error']}"
+    alloc = f"{row['alloc_peak_mb']:>10.1f}" if 'alloc_peak_mb' in row else f"{'-':>10}"
+    return (f"{row['case']:<18}{row['stage']:<14}{_size_label(row['size']):<24}"
+            f"{row['wall_s']:>10.3f}s{row['peak_rss_mb']:>10.1f}MB{alloc}MB")
+
+## comparing a report with a baseline report
+## a stage regressed if its time (or memory) grew by more than the tolerance
+## and by more than the floor (so tiny stages don't flag on noise)
+def compare(report, baseline, time_tolerance = .25, memory_tolerance = .25, time_floor = .05, memory_floor = 5.):
+    def key(row):
+        return (row['case'], row['stage'], json.dumps(row['size'], sort_keys = True))
+    baseline_rows = {key(row): row for row in baseline['results'] if not row.get('error')}
+    rows = []
+    for row in report['results']:
+        if row.get('error') or key(row) not in baseline_rows:
+            continue
+        base = baseline_rows[key(row)]
+        comparison = {'case': row['case'], 'stage': row['stage'], 'size': _size_label(row['size']),
+                      'wall_s': row['wall_s'], 'baseline_wall_s': base['wall_s'],
+                      'wall_ratio': row['wall_s'] / base['wall_s'] if base['wall_s'] > 0 else np.nan,
+                      'peak_rss_mb': row['peak_rss_mb'], 'baseline_peak_rss_mb': base['peak_rss_mb'],
+                      'rss_ratio': row['peak_rss_mb'] / base['peak_rss_mb'] if base['peak_rss_mb'] > 0 else np.nan}
+        comparison['regressed'] = bool(
+            (row['wall_s'] > base['wall_s'] * (1 + time_tolerance) and row['wall_s'] - base['wall_s'] > time_floor)
+            or (row['peak_rss_mb'] > base['peak_rss_mb'] * (1 + memory_tolerance)
+                and row['peak_rss_mb'] - base['peak_rss_mb'] > memory_floor))
+        rows.append(comparison)
+    return pd.DataFrame(rows)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'benchmark the trading scripts on synthetic data')
+    parser.add_argument('--cases', nargs = '*', choices = list(cases), help = 'the cases to run (all by default)')
+    parser.add_argument('--preset', default = 'small', choices = list(presets))
+    parser.add_argument('--output', default = default_output_path, help = 'where to write the JSON report')
+    parser.add_argument('--baseline', help = 'a previous report to compare with')
+    parser.add_argument('--tolerance', type = float, default = .25, help = 'the allowed slow down (and memory growth)')
+    parser.add_argument('--timeout', type = float, help = 'the max seconds of one (case, size)')
+    parser.add_argument('--no-trace', action = 'store_true', help = "don't trace the allocations (faster)")
+    parser.add_argument('--worker', nargs = 2, metavar = ('CASE', 'SIZE'), help = argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        case, size = args.worker
+        rows = run_case(case, json.loads(size), trace_allocations = not args.no_trace)
+        print(json.dumps(rows))
+        return 0
+
+    report = run_suite(args.cases, preset = args.preset, trace_allocations = not args.no_trace, timeout = args.timeout)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok = True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent = 1)
+    print(f'report written to {args.output}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparison = compare(report, baseline, time_tolerance = args.tolerance, memory_tolerance = args.tolerance)
+        if comparison.empty:
+            print('nothing to compare with the baseline')
+            return 0
+        print(comparison.to_string(index = False))
+        if comparison['regressed'].any():
+            print(f"{comparison['regressed'].sum()} stage(s) regressed")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
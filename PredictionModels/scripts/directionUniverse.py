@@ -0,0 +1,180 @@
+## Universe Direction Model
+## the random forest of stockPredictionModel.py (will the close be up tomorrow)
+## on a whole list of tickers, to rank them every morning
+## 1. the features: the Target and the ratio/trend features of every ticker
+##    stacked into one table, with a date and a (categorical) ticker column
+##    the features are float32, and they're written straight into one preallocated matrix
+## 2. the training: one pooled model on the rows of every ticker
+##    or one model per ticker, fitted in the worker pool
+##    (the workers get the stacked matrix once, when the pool starts
+##     and every task is a ticker, so a worker only fits one ticker at a time)
+## 3. the predictions: the rows of the latest day of the universe
+##    (a ticker without a row that day, e.g. delisted or halted, isn't ranked)
+##    scored in one predict_proba call with the pooled model (one per model with per-ticker models)
+##    and ranked by the probability of an up day
+## the Target of the last day of a ticker isn't known yet (there's no tomorrow)
+## so it's NaN, and that row is only used for the prediction
+## e.g.
+## python directionUniverse.py --top 500 (the first 500 SP500 symbols, pooled)
+## python directionUniverse.py AAPL MSFT NVDA --per-ticker --workers 4
+## packages required for this module
+## pandas, numpy, sklearn, and the ones of marketData.py
+import os
+import argparse
+import datetime as dt
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from marketData import get_source
+from workerPool import process_pool
+from horizonFeatures import feature_names, horizon_features, horizons as default_horizons
+
+## the features of every ticker of the stacked (date, ticker) prices
+## they're computed on the whole history, and start drops the rows before it
+## it returns a table with a row per (ticker, date): date, ticker, the features and the Target
+def build_universe(prices, horizons = default_horizons, start = "2013-01-01"):
+    ## the prices should be split/dividend adjusted, like the single ticker model
+    close = (prices["Close"] * (prices["Adj Close"] / prices["Close"])).dropna()
+    names = feature_names(horizons)
+    start = pd.Timestamp(start)
+    columns = []
+    for ticker, series in close.groupby(level = "ticker", sort = True):
+        series = series.droplevel("ticker").sort_index()
+        values = series.to_numpy()
+        ## then add if tomorrow's close is up or down
+        target = np.full(len(values), np.nan, dtype = np.float32)
+        target[:-1] = values[:-1] < values[1:]
+        keep = series.index >= start
+        columns.append((ticker, series.index[keep], values, target, keep))
+    tickers = [ticker for ticker, *_ in columns]
+    n_rows = sum(int(keep.sum()) for *_, keep in columns)
+    ## one preallocated float32 matrix for the features of every ticker
+    features = np.empty((n_rows, len(names)), dtype = np.float32)
+    targets = np.empty(n_rows, dtype = np.float32)
+    dates = np.empty(n_rows, dtype = 'datetime64[ns]')
+    codes = np.empty(n_rows, dtype = np.int32)
+    row = 0
+    for code, (ticker, index, values, target, keep) in enumerate(columns):
+        n = int(keep.sum())
+        features[row:row + n] = horizon_features(values, target, horizons)[keep]
+        targets[row:row + n] = target[keep]
+        dates[row:row + n] = index.to_numpy()
+        codes[row:row + n] = code
+        row += n
+    universe = pd.DataFrame(features, columns = names)
+    universe.insert(0, "ticker", pd.Categorical.from_codes(codes, categories = tickers))
+    universe.insert(0, "date", dates)
+    universe["Target"] = targets
+    return universe
+
+## the rows a model can be trained on: a known Target and all the features
+def _trainable(universe, predictors):
+    return (universe["Target"].notna() & universe[predictors].notna().all(axis = 1)).to_numpy()
+
+## one pooled model, on the rows of every ticker
+def train_pooled(universe, model, predictors):
+    rows = _trainable(universe, predictors)
+    model = clone(model)
+    model.fit(universe.loc[rows, predictors].to_numpy(), universe.loc[rows, "Target"].to_numpy().astype(np.int8))
+    return model
+
+## the matrix of the workers, handed over once when the pool starts
+_universe = {}
+
+def _init_worker(X, y, codes):
+    _universe.update(X = X, y = y, codes = codes)
+
+def _fit_ticker(model, code):
+    rows = _universe["codes"] == code
+    y = _universe["y"][rows]
+    if len(np.unique(y)) < 2:
+        return code, None
+    model.fit(_universe["X"][rows], y)
+    return code, model
+
+## one model per ticker, fitted in the worker pool
+## max_workers = None uses all the cores
+## a ticker without both up and down days (or without any trainable row) gets no model
+## it returns a dict of {ticker: model}
+def train_per_ticker(universe, model, predictors, max_workers = None):
+    rows = _trainable(universe, predictors)
+    X = universe.loc[rows, predictors].to_numpy()
+    y = universe.loc[rows, "Target"].to_numpy().astype(np.int8)
+    codes = universe["ticker"].cat.codes.to_numpy()[rows]
+    tickers = universe["ticker"].cat.categories
+    tasks = np.unique(codes)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers == 1 or len(tasks) <= 1:
+        _init_worker(X, y, codes)
+        results = [_fit_ticker(clone(model), code) for code in tasks]
+    else:
+        with process_pool(max_workers = max_workers, initializer = _init_worker, initargs = (X, y, codes)) as pool:
+            results = list(pool.map(_fit_ticker, [clone(model) for _ in tasks], tasks))
+    return {tickers[code]: fitted for code, fitted in results if fitted is not None}
+
+## the probability of the up class (1)
+def _up_probability(model, X):
+    proba = model.predict_proba(X)
+    classes = list(model.classes_)
+    return proba[:, classes.index(1)] if 1 in classes else np.zeros(len(X))
+
+## the prediction table of one day (the latest day of the universe, by default)
+## only the tickers with a row (and all the features) on that day are in it
+## models is a pooled model, or the {ticker: model} dict of train_per_ticker
+## it returns a row per ticker with its date, the up probability, the signal (probability >= threshold)
+## and its rank (1 is the most likely to be up)
+def predict_universe(universe, models, predictors, date = None, threshold = 0.6):
+    date = universe["date"].max() if date is None else pd.Timestamp(date)
+    rows = universe["date"] == date
+    latest = universe.loc[rows & universe[predictors].notna().all(axis = 1), ["date", "ticker"] + predictors]
+    X = latest[predictors].to_numpy()
+    probability = np.full(len(latest), np.nan)
+    if isinstance(models, dict):
+        tickers = latest["ticker"].to_numpy()
+        for ticker, model in models.items():
+            mask = tickers == ticker
+            if mask.any():
+                probability[mask] = _up_probability(model, X[mask])
+    elif len(latest):
+        ## the whole universe in one call
+        probability = _up_probability(models, X)
+    table = pd.DataFrame({"date": latest["date"].to_numpy(),
+                          "ticker": latest["ticker"].astype(str).to_numpy(),
+                          "probability": probability})
+    table = table.dropna(subset = ["probability"])
+    table["signal"] = (table["probability"] >= threshold).astype(int)
+    table = table.sort_values(["probability", "ticker"], ascending = [False, True], ignore_index = True)
+    table["rank"] = np.arange(1, len(table) + 1)
+    return table
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "the direction model on a universe of tickers")
+    parser.add_argument("tickers", nargs = "*", help = "the tickers (the SP500 symbols by default)")
+    parser.add_argument("--top", type = int, default = None, help = "only the first n of the tickers")
+    parser.add_argument("--per-ticker", action = "store_true", help = "a model per ticker instead of a pooled one")
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--threshold", type = float, default = 0.6)
+    parser.add_argument("--output", default = None, help = "a csv for the prediction table")
+    args = parser.parse_args()
+    source = get_source()
+    tickers = args.tickers or source.constituents()
+    tickers = tickers[:args.top] if args.top else tickers
+    prices = source.prices(tickers, "1980-01-01", dt.date.today() + pd.DateOffset(days = 1))
+    universe = build_universe(prices)
+    predictors = feature_names(default_horizons)
+    print(f"{universe['ticker'].nunique()} tickers, {len(universe)} rows, {universe.memory_usage(deep = True).sum() / 1e6:.0f}MB")
+    ## all the cores by default, like the per-ticker models
+    model = RandomForestClassifier(n_estimators = 500, min_samples_split = 200, random_state = 1, n_jobs = args.workers or -1)
+    if args.per_ticker:
+        models = train_per_ticker(universe, model.set_params(n_jobs = 1), predictors, max_workers = args.workers)
+    else:
+        models = train_pooled(universe, model, predictors)
+    table = predict_universe(universe, models, predictors, threshold = args.threshold)
+    missing = universe["ticker"].nunique() - len(table)
+    if missing:
+        print(f"{missing} tickers without a prediction on {universe['date'].max():%Y-%m-%d} (no row that day, or no model)")
+    print(table.head(20))
+    if args.output:
+        table.to_csv(args.output, index = False)
@@ -0,0 +1,148 @@
+## Rolling GARCH Forecaster
+## the one day ahead variance forecast of intradayTrading.py
+## a GARCH model fitted on every rolling window of the daily log returns
+## instead of a cold fit of every window in rolling().apply:
+## 1. warm starts, every fit starts the optimizer from the previous window's parameters
+##    (the windows only differ by a day, so it converges in fewer iterations)
+## 2. a refit schedule, the parameters are only re-estimated every refit_every windows
+##    and the windows in between run the variance recursion with the fixed parameters
+## 3. the windows are split into contiguous segments that run in the worker pool
+##    (each segment starts with a cold fit, and there's a fixed number of them, default_segments
+##     so the forecasts are the same on any machine and with any number of workers)
+## warm starts and the refit schedule move the forecasts away from the full refit path a bit
+## drift_report measures how far, against cold fits of (a sample of) the same windows
+## packages required for this module
+## pandas, numpy, arch
+import os
+import time
+import numpy as np
+import pandas as pd
+from workerPool import process_pool
+
+## the number of segments of the windows, whatever the number of workers
+default_segments = 8
+
+## a GARCH(p, q) with a constant mean, like arch_model(y=x, p=p, q=q)
+def _model(x, p, q):
+    from arch import arch_model
+    return arch_model(y = x, p = p, q = q)
+
+def _fit(model, starting_values = None):
+    return model.fit(starting_values = starting_values, update_freq = 5, disp = 'off')
+
+## a copy of values at the given memory alignment (the address mod 16)
+## numpy's vectorized sums depend on it in the last digit
+## and the GARCH optimizer can turn that into a visibly different fit
+## so the workers see the series exactly like the main process does
+def _realign(values, alignment):
+    if alignment is None or values.ctypes.data % 16 == alignment:
+        return values
+    buffer = np.empty(len(values) + 1)
+    shift = 0 if buffer.ctypes.data % 16 == alignment else 1
+    aligned = buffer[shift:shift + len(values)]
+    aligned[:] = values
+    return aligned
+
+## the forecasts of the windows of one segment, in order
+## the windows end at the positions in ends of the values array
+## and are views of it, like in rolling().apply
+## it runs in the workers, so it only gets numpy arrays
+## it returns the forecasts and a row of stats per window
+def forecast_segment(values, ends, window, p = 1, q = 3, refit_every = 1, warm_start = True, alignment = None):
+    values = _realign(values, alignment)
+    forecasts = []
+    stats = []
+    params = None
+    for i, end in enumerate(ends):
+        model = _model(values[end - window + 1:end + 1], p, q)
+        if params is None or i % refit_every == 0:
+            result = _fit(model, starting_values = params if warm_start else None)
+            start = 'previous' if warm_start and params is not None else 'cold'
+            if result.convergence_flag != 0 and start == 'previous':
+                ## the previous parameters didn't work out for this window
+                ## so it starts over from the default starting values
+                result = _fit(model)
+                start = 'cold'
+            params = result.params.to_numpy()
+            stats.append({'refit': True, 'start': start, 'converged': result.convergence_flag == 0,
+                          'iterations': result.optimization_result.nit})
+        else:
+            ## filtering the window with the last estimated parameters
+            result = model.fix(params)
+            stats.append({'refit': False, 'start': None, 'converged': True, 'iterations': 0})
+        ## one day ahead, and we only want the variance
+        forecasts.append(result.forecast(horizon = 1).variance.iloc[-1, 0])
+    return forecasts, stats
+
+## the end positions of the windows rolling(window).apply would compute
+## (the full windows without a missing value)
+def window_ends(values, window):
+    valid = ~np.isnan(values)
+    counts = np.convolve(valid, np.ones(window, dtype = np.int64), mode = 'full')[:len(values)]
+    return np.nonzero(counts == window)[0]
+
+## splitting the windows into contiguous segments
+def _segments(ends, n_segments):
+    return [segment for segment in np.array_split(ends, n_segments) if len(segment)]
+
+## the segments of the windows ending at ends, in the worker pool
+def _run_segments(values, ends, window, p, q, refit_every, warm_start, max_workers = None, segments = default_segments):
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    tasks = _segments(ends, segments)
+    if max_workers == 1 or len(tasks) <= 1:
+        return [forecast_segment(values, segment, window, p, q, refit_every, warm_start) for segment in tasks]
+    n = len(tasks)
+    with process_pool(max_workers = max_workers) as pool:
+        return list(pool.map(forecast_segment, [values] * n, tasks, [window] * n,
+                             [p] * n, [q] * n, [refit_every] * n, [warm_start] * n,
+                             [values.ctypes.data % 16] * n))
+
+## the rolling one day ahead variance forecasts of the returns series
+## the same as returns.rolling(window).apply(<fit GARCH(p, q), forecast 1 day>)
+## with warm_start = False, refit_every = 1 and max_workers = 1
+## max_workers = None uses all the cores, and segments is the number of segments
+## (more segments means more cold fits, and max_workers only sets how many run at the same time)
+## it returns the forecasts and the stats of every window
+## (if it was refit, how the optimizer started, if it converged and its iterations)
+def rolling_garch(returns, window = 180, p = 1, q = 3, refit_every = 1, warm_start = True,
+                  max_workers = None, segments = default_segments):
+    values = returns.to_numpy(dtype = np.float64)
+    ends = window_ends(values, window)
+    results = _run_segments(values, ends, window, p, q, refit_every, warm_start, max_workers, segments)
+    forecasts = pd.Series(np.nan, index = returns.index)
+    forecasts.iloc[ends] = [f for segment, _ in results for f in segment]
+    stats = pd.DataFrame([s for _, segment in results for s in segment], index = returns.index[ends])
+    return forecasts, stats
+
+## how far the forecasts of a configuration drift from the full refit path
+## (cold fits of every window, the original rolling().apply)
+## the full refit path is only computed on every sample_every-th window, to keep it cheap
+## config is passed to rolling_garch, e.g. refit_every = 5
+## it returns the forecast differences and the run times
+def drift_report(returns, window = 180, p = 1, q = 3, sample_every = 1, max_workers = None, **config):
+    start = time.perf_counter()
+    forecasts, stats = rolling_garch(returns, window = window, p = p, q = q, max_workers = max_workers, **config)
+    run_time = time.perf_counter() - start
+    values = returns.to_numpy(dtype = np.float64)
+    sample = window_ends(values, window)[::sample_every]
+    ## every window of the reference is a cold fit, so they can be sampled
+    start = time.perf_counter()
+    results = _run_segments(values, sample, window, p, q, 1, False, max_workers)
+    reference = pd.Series(np.nan, index = returns.index)
+    reference.iloc[sample] = [f for segment, _ in results for f in segment]
+    reference_time = (time.perf_counter() - start) * sample_every
+    a = forecasts.iloc[sample].to_numpy()
+    b = reference.iloc[sample].to_numpy()
+    relative = np.abs(a - b) / np.abs(b)
+    return {'windows': len(forecasts.dropna()),
+            'compared': len(sample),
+            'max_abs_diff': np.nanmax(np.abs(a - b)),
+            'max_rel_diff': np.nanmax(relative),
+            'mean_rel_diff': np.nanmean(relative),
+            'correlation': np.corrcoef(a, b)[0, 1],
+            'refits': int(stats['refit'].sum()),
+            'not_converged': int((~stats['converged']).sum()),
+            'run_time_s': run_time,
+            ## scaled up to all the windows, when the reference is sampled
+            'full_refit_time_s': reference_time}
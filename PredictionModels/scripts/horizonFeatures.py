@@ -0,0 +1,65 @@
+## Multi-Horizon Features
+## the ratio and trend predictors of stockPredictionModel.py
+## Close_Ratio_h: the close over its h-day rolling average
+## Trend_h: the number of up days (Target) in the h days before the row
+## instead of a rolling(h) over the whole df for every horizon
+## (which averages every column, and shift(1) copies the whole df for the trend)
+## every horizon comes from one cumulative sum of the close and one of the target:
+## the sum of a window is the difference of two cumulative sums
+## the close is centered on its first value before the sum
+## so the sums stay small and the averages keep their precision
+## (they can differ from rolling().mean() in the last digits of a float64,
+##  which the float32 features, like the forest itself, don't keep)
+## the trends are counts, so they're exact
+## the output is a float32 (rows, features) matrix, for any ticker
+## packages required for this module
+## pandas, numpy
+import numpy as np
+import pandas as pd
+
+horizons = [2, 5, 30, 60, 90, 250, 500, 750, 1000]
+
+## the names of the columns, ratio and trend of every horizon
+def feature_names(horizons = horizons):
+    return [name for h in horizons for name in (f"Close_Ratio_{h}", f"Trend_{h}")]
+
+## the window sums of x from a cumulative sum with a leading 0
+## the sum of x[i - h + 1:i + 1] for every row i (NaN while there are less than h rows)
+def _window_sums(cumulative, h):
+    sums = np.full(len(cumulative) - 1, np.nan)
+    sums[h - 1:] = cumulative[h:] - cumulative[:-h]
+    return sums
+
+## the features of one ticker
+## close and target are the columns of the rows (arrays or Series)
+## the rolling average needs h closes in the window, like rolling(h).mean()
+## and the trend the h targets before the row, like shift(1).rolling(h).sum()
+def horizon_features(close, target, horizons = horizons, dtype = np.float32):
+    close = np.asarray(close, dtype = np.float64)
+    target = np.asarray(target, dtype = np.float64)
+    n = len(close)
+    valid = close == close
+    origin = close[valid][0] if valid.any() else 0.
+    close_sums = np.concatenate([[0.], np.cumsum(np.where(valid, close - origin, 0.))])
+    close_counts = np.concatenate([[0], np.cumsum(valid)])
+    ## the target shifted by one row, the first one is missing
+    shifted = np.concatenate([[np.nan], target[:-1]])
+    target_sums = np.concatenate([[0.], np.cumsum(np.nan_to_num(shifted))])
+    target_counts = np.concatenate([[0], np.cumsum(shifted == shifted)])
+    features = np.empty((n, 2 * len(horizons)), dtype = dtype)
+    for j, h in enumerate(horizons):
+        if h > n:
+            features[:, 2 * j:2 * j + 2] = np.nan
+            continue
+        average = _window_sums(close_sums, h) / h + origin
+        average[_window_sums(close_counts, h) < h] = np.nan
+        features[:, 2 * j] = close / average
+        trend = _window_sums(target_sums, h)
+        trend[_window_sums(target_counts, h) < h] = np.nan
+        features[:, 2 * j + 1] = trend
+    return features
+
+## the features of a df with a Close and a Target column, as a df with the same index
+def horizon_frame(df, horizons = horizons, dtype = np.float32):
+    return pd.DataFrame(horizon_features(df["Close"], df["Target"], horizons, dtype = dtype),
+                        index = df.index, columns = feature_names(horizons))
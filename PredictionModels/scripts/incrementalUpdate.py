@@ -0,0 +1,554 @@
+## Incremental Daily Update
+## the daily part of algorithmicTrading.py (the features and the monthly aggregation)
+## one new day at a time, from a saved state
+## instead of recomputing 8 years of indicators for every new day
+## the state keeps, for every ticker:
+## the Wilder smoothing of the RSI and the ATR, the two emas of the MACD
+## the last 20 log prices of the Bollinger Bands (with the rolling sums)
+## the running mean and variance of the raw ATR and MACD (for the per-stock normalization)
+## and the current month so far: the last value of every field
+## and the sum and count of the dollar volume
+## the finished months are kept as a small (month, field, ticker) history
+## so the monthly panel (with the 5-year dollar volume ranking) is rebuilt from it in milliseconds
+## the updates are the indicator engine's kernels, one row at a time
+## so replaying the history gives the same values as compute_features
+## except for two whole-history steps of the batch version:
+## the ATR/MACD normalization uses a running (Welford) mean and std
+## instead of the two-pass sums, and the epsilon pandas_ta adds to the ranges
+## of a stock that ever had a zero range only applies from that day on
+## the monthly stages after that (returns, clustering, optimization)
+## depend on the whole monthly history (e.g. the outlier quantiles of every stock)
+## and they're cheap on the monthly panel, so they run from it when a month is ready
+## the factor betas have their own running regression sums in the state (add_betas)
+## and only the new months are added to them
+## the days are only added once they're complete: today's bar is still moving
+## so the daily run downloads up to yesterday, and today goes in tomorrow
+## e.g.
+## python incrementalUpdate.py (builds the state once, then only downloads and adds the new days)
+## packages required for this module
+## pandas, numpy, and the ones of algorithmicTrading.py
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from indicatorEngine import _head_mean
+from panelData import Panel
+from stageProfiler import profiled
+from algorithmicTrading import select_liquid, join_betas
+
+default_state_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'incremental_state', 'state.pkl')
+
+## the price columns, as download_prices gives them
+price_columns = ['open', 'high', 'low', 'close', 'adj close', 'volume']
+## the feature columns, in the order compute_features adds them
+feature_columns = ['german_klass_vol', 'rsi', 'bb_low', 'bb_mid', 'bb_high', 'atr', 'macd', 'dollar_volume']
+## the monthly fields that take the month's last value (the rest is skipped, like aggregate_monthly)
+skip_list = ['dollar_volume', 'volume', 'open', 'high', 'low', 'close']
+last_cols = [c for c in price_columns + feature_columns if c not in skip_list]
+
+## the kernels
+## a state is a dict of per-ticker arrays (the ticker is the last axis)
+## and a step takes the state and the day's values of every ticker
+## and returns the new state and the output
+## the tickers without a row that day keep their old state (see _commit)
+
+## Series.ewm(com=com, adjust=adjust, min_periods=min_periods).mean()
+## the same update as indicatorEngine.ewm_mean
+def ewm_state(n):
+    return {'weighted': np.full(n, np.nan), 'old_wt': np.ones(n), 'nobs': np.zeros(n, dtype = np.int64)}
+
+def ewm_step(state, cur, com, adjust = True, min_periods = 0):
+    alpha = 1. / (1. + com)
+    old_wt_factor = 1. - alpha
+    new_wt = 1. if adjust else alpha
+    min_periods = max(min_periods, 1)
+    weighted, old_wt = state['weighted'], state['old_wt']
+    is_observation = cur == cur
+    nobs = state['nobs'] + is_observation
+    started = weighted == weighted
+    old_wt = np.where(started, old_wt * old_wt_factor, old_wt)
+    update = started & is_observation
+    new_weighted = (old_wt * weighted + new_wt * cur) / (old_wt + new_wt)
+    weighted = np.where(update & (weighted != cur), new_weighted, weighted)
+    if adjust:
+        old_wt = np.where(update, old_wt + new_wt, old_wt)
+    else:
+        old_wt = np.where(update, 1., old_wt)
+    weighted = np.where(~started & is_observation, cur, weighted)
+    return {'weighted': weighted, 'old_wt': old_wt, 'nobs': nobs}, np.where(nobs >= min_periods, weighted, np.nan)
+
+## Wilder's moving average, like indicatorEngine.rma
+def rma_step(state, cur, length):
+    alpha = 1.0 / length
+    return ewm_step(state, cur, com = 1 / alpha - 1, adjust = True, min_periods = length)
+
+## the last `length` values of every ticker, for the rolling windows
+## seen is the number of the ticker's rows so far
+def window_state(n, length):
+    return {'buffer': np.full((length, n), np.nan), 'seen': np.zeros(n, dtype = np.int64)}
+
+## the value leaving the window (NaN while the window isn't full yet)
+def window_leaving(state):
+    length, n = state['buffer'].shape
+    return np.where(state['seen'] >= length, state['buffer'][state['seen'] % length, np.arange(n)], np.nan)
+
+## the rolling mean, the same Kahan add/remove as indicatorEngine.rolling_mean
+def rolling_mean_state(n):
+    return {'sum_x': np.zeros(n), 'compensation_add': np.zeros(n), 'compensation_remove': np.zeros(n),
+            'nobs': np.zeros(n, dtype = np.int64), 'neg_ct': np.zeros(n, dtype = np.int64),
+            'same_count': np.zeros(n, dtype = np.int64), 'prev_value': np.full(n, np.nan)}
+
+def rolling_mean_step(state, leaving, val, min_periods):
+    sum_x = state['sum_x']
+    ## the value leaving the window
+    obs = leaving == leaving
+    nobs = state['nobs'] - obs
+    y = -leaving - state['compensation_remove']
+    t = sum_x + y
+    compensation_remove = np.where(obs, t - sum_x - y, state['compensation_remove'])
+    sum_x = np.where(obs, t, sum_x)
+    neg_ct = state['neg_ct'] - (obs & np.signbit(leaving))
+    ## and the one coming in
+    obs = val == val
+    nobs = nobs + obs
+    y = val - state['compensation_add']
+    t = sum_x + y
+    compensation_add = np.where(obs, t - sum_x - y, state['compensation_add'])
+    sum_x = np.where(obs, t, sum_x)
+    neg_ct = neg_ct + (obs & np.signbit(val))
+    same_count = np.where(obs, np.where(val == state['prev_value'], state['same_count'] + 1, 1), state['same_count'])
+    prev_value = np.where(obs, val, state['prev_value'])
+    result = sum_x / nobs
+    result = np.where(same_count >= nobs, prev_value,
+                      np.where((neg_ct == 0) & (result < 0), 0.,
+                               np.where((neg_ct == nobs) & (result > 0), 0., result)))
+    new_state = {'sum_x': sum_x, 'compensation_add': compensation_add, 'compensation_remove': compensation_remove,
+                 'nobs': nobs, 'neg_ct': neg_ct, 'same_count': same_count, 'prev_value': prev_value}
+    return new_state, np.where((nobs >= min_periods) & (nobs > 0), result, np.nan)
+
+## the rolling variance, the same Welford/Kahan updates as indicatorEngine.rolling_var
+def rolling_var_state(n):
+    return {'mean_x': np.zeros(n), 'ssqdm_x': np.zeros(n), 'compensation_add': np.zeros(n),
+            'compensation_remove': np.zeros(n), 'nobs': np.zeros(n),
+            'same_count': np.zeros(n, dtype = np.int64), 'prev_value': np.full(n, np.nan)}
+
+def rolling_var_step(state, leaving, val, min_periods, ddof = 1):
+    mean_x, ssqdm_x = state['mean_x'], state['ssqdm_x']
+    compensation_remove = state['compensation_remove']
+    obs = leaving == leaving
+    nobs = state['nobs'] - obs
+    prev_mean = mean_x - compensation_remove
+    y = leaving - compensation_remove
+    t = y - mean_x
+    new_mean = mean_x - t / nobs
+    new_ssqdm = ssqdm_x - (leaving - prev_mean) * (leaving - new_mean)
+    empty = obs & (nobs == 0)
+    update = obs & (nobs != 0)
+    compensation_remove = np.where(update, t + mean_x - y, compensation_remove)
+    mean_x = np.where(update, new_mean, np.where(empty, 0., mean_x))
+    ssqdm_x = np.where(update, new_ssqdm, np.where(empty, 0., ssqdm_x))
+
+    obs = val == val
+    nobs = nobs + obs
+    same_count = np.where(obs, np.where(val == state['prev_value'], state['same_count'] + 1, 1), state['same_count'])
+    prev_value = np.where(obs, val, state['prev_value'])
+    prev_mean = mean_x - state['compensation_add']
+    y = val - state['compensation_add']
+    t = y - mean_x
+    new_mean = mean_x + t / nobs
+    new_ssqdm = ssqdm_x + (val - prev_mean) * (val - new_mean)
+    compensation_add = np.where(obs, t + mean_x - y, state['compensation_add'])
+    mean_x = np.where(obs, new_mean, mean_x)
+    ssqdm_x = np.where(obs, new_ssqdm, ssqdm_x)
+    result = np.where((nobs == 1) | (same_count >= nobs), 0., ssqdm_x / (nobs - ddof))
+    new_state = {'mean_x': mean_x, 'ssqdm_x': ssqdm_x, 'compensation_add': compensation_add,
+                 'compensation_remove': compensation_remove, 'nobs': nobs,
+                 'same_count': same_count, 'prev_value': prev_value}
+    return new_state, np.where((nobs >= min_periods) & (nobs > ddof), result, np.nan)
+
+## pandas_ta's ema: the first `length` values are kept
+## and their mean seeds the ewm(span=length, adjust=False)
+def ema_state(n, length):
+    return {'head': np.full((length, n), np.nan), 'seen': np.zeros(n, dtype = np.int64), 'ewm': ewm_state(n)}
+
+def ema_step(state, cur, length):
+    seen = state['seen']
+    head = state['head'].copy()
+    filling = seen < length
+    head[np.minimum(seen, length - 1)[filling], np.nonzero(filling)[0]] = cur[filling]
+    seeding = seen == length - 1
+    value = np.where(seen < length - 1, np.nan, cur)
+    if seeding.any():
+        value[seeding] = _head_mean(head[:, seeding], length)
+    ewm, out = ewm_step(state['ewm'], value, com = (length - 1) / 2, adjust = False)
+    return {'head': head, 'seen': seen + 1, 'ewm': ewm}, out
+
+## the running mean and variance of the raw ATR and MACD
+## for the normalization of every stock with its own mean and std
+def moments_state(n):
+    return {'count': np.zeros(n), 'mean': np.zeros(n), 'm2': np.zeros(n)}
+
+def moments_step(state, x):
+    valid = x == x
+    count = state['count'] + valid
+    delta = np.where(valid, x - state['mean'], 0.)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = state['mean'] + np.where(valid, delta / count, 0.)
+    m2 = state['m2'] + np.where(valid, delta * (x - mean), 0.)
+    return {'count': count, 'mean': mean, 'm2': m2}
+
+def zscore(x, moments):
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return (x - moments['mean']) / np.sqrt(moments['m2'] / (moments['count'] - 1))
+
+## the rolling regression of the factor betas, like rollingBetas.rolling_betas
+## the last `window` rows of every ticker (X with the constant, and y)
+## and the running sums of X'X and X'y over them
+## a new row is added to the sums, and the row leaving the window taken out
+## (the empty slots of a window that isn't full yet are zeros, so they take nothing out)
+def regression_state(n, k, window):
+    return {'X': np.zeros((window, k, n)), 'y': np.zeros((window, n)), 'valid': np.zeros((window, n), dtype = bool),
+            'seen': np.zeros(n, dtype = np.int64), 'nobs': np.zeros(n, dtype = np.int64),
+            'xpx': np.zeros((k, k, n)), 'xpy': np.zeros((k, n))}
+
+## X is (param, ticker) and y (ticker)
+## it returns the new state and the params of every ticker (NaN with less than min_nobs rows)
+def regression_step(state, X, y, min_nobs):
+    window, k, n = state['X'].shape
+    cols = np.arange(n)
+    ## a missing row adds nothing to the sums
+    valid = (y == y) & (X == X).all(axis = 0)
+    X = np.where(valid, X, 0.)
+    y = np.where(valid, y, 0.)
+    position = state['seen'] % window
+    leaving_X = state['X'][position, :, cols].T
+    leaving_y = state['y'][position, cols]
+    xpx = state['xpx'] - leaving_X[:, None, :] * leaving_X[None, :, :] + X[:, None, :] * X[None, :, :]
+    xpy = state['xpy'] - leaving_X * leaving_y + X * y
+    nobs = state['nobs'] - state['valid'][position, cols] + valid
+    buffer_X, buffer_y, buffer_valid = state['X'].copy(), state['y'].copy(), state['valid'].copy()
+    buffer_X[position, :, cols] = X.T
+    buffer_y[position, cols] = y
+    buffer_valid[position, cols] = valid
+    ## the stacked solve of the tickers with enough rows
+    params = np.full((k, n), np.nan)
+    ready = nobs >= min_nobs
+    if ready.any():
+        xpx_ready = np.moveaxis(xpx[:, :, ready], -1, 0)
+        xpy_ready = xpy[:, ready].T[:, :, None]
+        try:
+            params[:, ready] = np.linalg.solve(xpx_ready, xpy_ready)[:, :, 0].T
+        except np.linalg.LinAlgError:
+            params[:, ready] = (np.linalg.pinv(xpx_ready) @ xpy_ready)[:, :, 0].T
+    new_state = {'X': buffer_X, 'y': buffer_y, 'valid': buffer_valid, 'seen': state['seen'] + 1, 'nobs': nobs,
+                 'xpx': xpx, 'xpy': xpy}
+    return new_state, params
+
+## keeping the new state only for the tickers with a row that day
+def _commit(old, new, active):
+    if isinstance(old, dict):
+        return {k: _commit(old[k], new[k], active) for k in old}
+    return np.where(active, new, old)
+
+## adding columns (new tickers) to every array of a state
+def _extend(state, fresh):
+    if isinstance(state, dict):
+        return {k: _extend(state[k], fresh[k]) for k in state}
+    return np.concatenate([state, fresh], axis = -1)
+
+class IncrementalStrategy:
+    def __init__(self, rsi_length = 20, bb_length = 20, atr_length = 14, macd_fast = 12, macd_slow = 26):
+        self.rsi_length = rsi_length
+        self.bb_length = bb_length
+        self.atr_length = atr_length
+        self.macd_fast = macd_fast
+        self.macd_slow = macd_slow
+        self.tickers = pd.Index([], name = 'ticker')
+        self.state = self._new_state(0)
+        self.last_date = None
+        ## the current month: its month end, and its last values so far
+        self.month = None
+        self.month_state = self._new_month(0)
+        ## the finished months, one (field, ticker) array each
+        ## the ATR and MACD are kept raw, and normalized when the panel is built
+        self.months = []
+        self.history = []
+        self.last_ready = None
+        ## the running regressions of the betas, the last month added to them
+        ## and the betas of every month so far
+        self.regression = None
+        self.beta_month = None
+        self.betas = []
+
+    def _new_state(self, n):
+        return {'rsi_prev_close': np.full(n, np.nan),
+                'rsi_positive': ewm_state(n),
+                'rsi_negative': ewm_state(n),
+                'bb_window': window_state(n, self.bb_length),
+                'bb_mean': rolling_mean_state(n),
+                'bb_var': rolling_var_state(n),
+                'atr_prev_close': np.full(n, np.nan),
+                'atr_seen': np.zeros(n, dtype = np.int64),
+                'atr_has_zero': np.zeros(n, dtype = bool),
+                'atr': ewm_state(n),
+                'atr_moments': moments_state(n),
+                'macd_fast': ema_state(n, self.macd_fast),
+                'macd_slow': ema_state(n, self.macd_slow),
+                'macd_moments': moments_state(n)}
+
+    def _new_month(self, n):
+        return {'last': np.full((len(last_cols), n), np.nan),
+                ## the dollar volumes are summed as float32 values, like the panel's monthly mean
+                'dollar_volume_sum': np.zeros(n),
+                'dollar_volume_count': np.zeros(n, dtype = np.int64)}
+
+    def _add_tickers(self, tickers):
+        new = pd.Index(tickers).difference(self.tickers)
+        if len(new):
+            self.state = _extend(self.state, self._new_state(len(new)))
+            self.month_state = _extend(self.month_state, self._new_month(len(new)))
+            if self.regression is not None:
+                window, k, _ = self.regression['X'].shape
+                self.regression = _extend(self.regression, regression_state(len(new), k, window))
+            self.tickers = self.tickers.append(pd.Index(new, name = 'ticker'))
+
+    ## the features of one day, for every ticker (x is {column: values})
+    ## it returns the new state and the raw features
+    def _features(self, x):
+        s = self.state
+        new = {}
+        ## RSI, from the close to close changes
+        negative = x['adj close'] - s['rsi_prev_close']
+        positive = np.where(negative < 0, 0, negative)
+        negative = np.where(negative > 0, 0, negative)
+        new['rsi_prev_close'] = x['adj close']
+        new['rsi_positive'], positive_avg = rma_step(s['rsi_positive'], positive, self.rsi_length)
+        new['rsi_negative'], negative_avg = rma_step(s['rsi_negative'], negative, self.rsi_length)
+        rsi = 100 * positive_avg / (positive_avg + np.abs(negative_avg))
+        ## the Bollinger Bands of the log1p prices
+        log_price = np.log1p(x['adj close'])
+        leaving = window_leaving(s['bb_window'])
+        new['bb_mean'], mid = rolling_mean_step(s['bb_mean'], leaving, log_price, self.bb_length)
+        new['bb_var'], var = rolling_var_step(s['bb_var'], leaving, log_price, self.bb_length, ddof = 0)
+        deviations = 2.0 * np.sqrt(var)
+        ## ATR
+        high_low_range = x['high'] - x['low']
+        has_zero = s['atr_has_zero'] | (high_low_range == 0)
+        high_low_range = np.where(has_zero, high_low_range + np.finfo(float).eps, high_low_range)
+        prev_close = s['atr_prev_close']
+        true_range = np.fmax(np.fmax(np.abs(high_low_range), np.abs(x['high'] - prev_close)), np.abs(prev_close - x['low']))
+        true_range = np.where(s['atr_seen'] == 0, np.nan, true_range)
+        new['atr_prev_close'] = x['close']
+        new['atr_seen'] = s['atr_seen'] + 1
+        new['atr_has_zero'] = has_zero
+        new['atr'], atr = rma_step(s['atr'], true_range, self.atr_length)
+        new['atr_moments'] = moments_step(s['atr_moments'], atr)
+        ## MACD
+        new['macd_fast'], fast = ema_step(s['macd_fast'], x['adj close'], self.macd_fast)
+        new['macd_slow'], slow = ema_step(s['macd_slow'], x['adj close'], self.macd_slow)
+        macd = fast - slow
+        new['macd_moments'] = moments_step(s['macd_moments'], macd)
+        ## the window buffer is updated in place, only for the tickers with a row
+        new['bb_window'] = s['bb_window']
+        features = {'german_klass_vol': ((np.log(x['high'])-np.log(x['low']))**2)/2-(2*np.log(x['adj close'])-1)*(np.log(x['adj close'])-np.log(x['open']))**2,
+                    'rsi': rsi,
+                    'bb_low': mid - deviations,
+                    'bb_mid': mid,
+                    'bb_high': mid + deviations,
+                    'atr': atr,
+                    'macd': macd,
+                    'dollar_volume': (x['adj close']*x['volume'])/1e6}
+        return new, features
+
+    ## closing the current month
+    def _finish_month(self):
+        if self.month is not None:
+            self.months.append(self.month)
+            self.history.append(self.month_state)
+        self.month_state = self._new_month(len(self.tickers))
+
+    ## adding one day, rows is the long df of that day
+    def _add_day(self, date, rows):
+        self._add_tickers(rows.index.get_level_values('ticker'))
+        n = len(self.tickers)
+        idx = self.tickers.get_indexer(rows.index.get_level_values('ticker'))
+        active = np.zeros(n, dtype = bool)
+        active[idx] = True
+        x = {}
+        for column in price_columns:
+            x[column] = np.full(n, np.nan)
+            x[column][idx] = rows[column].to_numpy(dtype = np.float64)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            new, features = self._features(x)
+        self.state = _commit(self.state, new, active)
+        window = self.state['bb_window']
+        position = window['seen'][idx] % self.bb_length
+        window['buffer'][position, idx] = np.log1p(x['adj close'][idx])
+        window['seen'][idx] += 1
+
+        month = pd.Timestamp(date).to_period('M').to_timestamp(how = 'end').normalize()
+        if month != self.month:
+            self._finish_month()
+            self.month = month
+        values = {**x, **features}
+        last = self.month_state['last']
+        for i, column in enumerate(last_cols):
+            ## the last value of the month that isn't missing
+            found = active & (values[column] == values[column])
+            last[i] = np.where(found, values[column], last[i])
+        dollar_volume = values['dollar_volume'].astype(np.float32).astype(np.float64)
+        found = active & (dollar_volume == dollar_volume)
+        self.month_state['dollar_volume_sum'] = np.where(found, self.month_state['dollar_volume_sum'] + dollar_volume,
+                                                         self.month_state['dollar_volume_sum'])
+        self.month_state['dollar_volume_count'] += found
+        self.last_date = pd.Timestamp(date)
+
+    ## adding the new days, data is the long (date, ticker) df of download_prices
+    ## the days up to the last one already in the state are skipped
+    ## it returns the month ends whose month is complete, i.e. the rebalances that are ready
+    ## (a month is complete on its last business day, or when the next month starts)
+    @profiled('incremental_update')
+    def update(self, data):
+        dates = data.index.get_level_values('date')
+        if self.last_date is not None:
+            data = data[dates > self.last_date]
+            dates = data.index.get_level_values('date')
+        codes, unique_dates = pd.factorize(dates, sort = True)
+        order = np.argsort(codes, kind = 'stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(unique_dates) + 1))
+        ready = []
+        for i, date in enumerate(unique_dates):
+            previous_month = self.month
+            self._add_day(date, data.iloc[order[bounds[i]:bounds[i + 1]]])
+            if previous_month is not None and previous_month != self.month and previous_month != self.last_ready:
+                ready.append(previous_month)
+                self.last_ready = previous_month
+        if self.last_date is not None and self.last_date + pd.offsets.BDay(1) > self.month and self.month != self.last_ready:
+            ready.append(self.month)
+            self.last_ready = self.month
+        return ready
+
+    ## the monthly panel, the finished months and the current one
+    ## the same as the panel aggregate_monthly builds, before its liquidity filter
+    ## until is the last month end to keep (e.g. the month of a rebalance)
+    def monthly_panel(self, until = None):
+        n = len(self.tickers)
+        states = self.history + ([self.month_state] if self.month is not None else [])
+        months = self.months + ([self.month] if self.month is not None else [])
+        if until is not None:
+            keep = sum(month <= pd.Timestamp(until) for month in months)
+            states, months = states[:keep], months[:keep]
+        values = np.full((len(last_cols) + 1, len(months), n), np.nan)
+        for j, month_state in enumerate(states):
+            width = month_state['last'].shape[1]
+            values[:len(last_cols), j, :width] = month_state['last']
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                values[-1, j, :width] = np.where(month_state['dollar_volume_count'] > 0,
+                                                 month_state['dollar_volume_sum'] / month_state['dollar_volume_count'],
+                                                 np.nan)
+        ## normalizing the ATR and MACD with every stock's mean and std so far
+        for column, moments in [('atr', 'atr_moments'), ('macd', 'macd_moments')]:
+            i = last_cols.index(column)
+            values[i] = zscore(values[i], self.state[moments])
+        ## with the tickers sorted, like the panel of the long df
+        order = np.argsort(self.tickers)
+        return Panel(values[:, :, order].astype(np.float32), last_cols + ['dollar_volume'], months, self.tickers[order])
+
+    ## the monthly data of aggregate_monthly, the top_n most liquid stocks of every month
+    def monthly_data(self, top_n = 150, until = None):
+        return select_liquid(self.monthly_panel(until = until), last_cols, top_n = top_n)
+
+    ## the factor betas of the monthly data (with the return_1m of add_returns), like add_betas
+    ## the months after the last one in the regressions are added to the running sums
+    ## (in order, and only the ones the factors are out for, the others wait for the next run)
+    ## and the months already in them are kept as they were
+    ## so the betas are those of the returns at the time they were added
+    ## the differences with add_betas, which sees the whole history:
+    ## a stock with less than `window` months regresses on the months so far (add_betas: on all of them)
+    ## and it gets betas from its min_months-th month on (add_betas: only if it has min_months in the end)
+    ## it returns the monthly data with the betas, like add_betas
+    def add_betas(self, monthly_data, factor_data, window = 24, min_months = 10):
+        factors = list(factor_data.columns)
+        k = len(factors) + 1
+        if self.regression is None or self.regression['X'].shape[:2] != (window, k):
+            self.regression = regression_state(len(self.tickers), k, window)
+            self.beta_month = None
+            self.betas = []
+        returns = monthly_data['return_1m']
+        months = returns.index.get_level_values('date').unique().sort_values()
+        if self.beta_month is not None:
+            months = months[months > self.beta_month]
+        n = len(self.tickers)
+        for month in months:
+            if month not in factor_data.index:
+                break
+            rows = returns.xs(month, level = 'date')
+            idx = self.tickers.get_indexer(rows.index)
+            active = np.zeros(n, dtype = bool)
+            active[idx] = True
+            y = np.full(n, np.nan)
+            y[idx] = rows.to_numpy(dtype = np.float64)
+            X = np.ones((k, n))
+            X[1:] = factor_data.loc[month, factors].to_numpy(dtype = np.float64)[:, None]
+            new, params = regression_step(self.regression, X, y, min_nobs = k)
+            self.regression = _commit(self.regression, new, active)
+            params[:, self.regression['seen'] < min_months] = np.nan
+            self.betas.append(pd.DataFrame(params[1:, idx].T, columns = factors,
+                                           index = pd.MultiIndex.from_product([[month], rows.index], names = ['date', 'ticker'])))
+            self.beta_month = month
+        betas = pd.concat(self.betas) if self.betas else pd.DataFrame(columns = factors, index = returns.index[:0])
+        return join_betas(monthly_data, betas)
+
+    ## building the state from the prices history
+    @classmethod
+    def from_prices(cls, data, **params):
+        strategy = cls(**params)
+        strategy.update(data)
+        return strategy
+
+    def save(self, path = default_state_path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+        ## writing to a temp file first, so a crash never leaves a broken state
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path = default_state_path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+if __name__ == '__main__':
+    import datetime as dt
+    import algorithmicTrading as at
+    from stageCache import StageCache
+    ## the first run builds the state from the same 8 years as algorithmicTrading.py
+    ## and the next ones only download the days after the saved state
+    ## up to yesterday (the end is exclusive), today's bar isn't final yet
+    end_date = pd.Timestamp(dt.date.today())
+    if os.path.exists(default_state_path):
+        strategy = IncrementalStrategy.load()
+        new_data = at.download_prices(strategy.tickers.tolist(), strategy.last_date + pd.DateOffset(days = 1), end_date)
+        ready = strategy.update(new_data)
+    else:
+        data = at.download_prices(at.load_sp500_symbols(), end_date - pd.DateOffset(365*8), end_date)
+        strategy = IncrementalStrategy()
+        ready = strategy.update(data)[-1:]
+    strategy.save()
+    print(f"state updated to {strategy.last_date.strftime('%Y-%m-%d')}")
+    if ready:
+        ## the month is complete, so the rebalance runs on the monthly panel
+        ## through the stage cache, like the full pipeline
+        print(f"rebalance inputs ready for {', '.join(m.strftime('%Y-%m') for m in ready)}")
+        cache = StageCache()
+        monthly_data = cache.source('monthly', strategy.monthly_data(top_n = 150, until = ready[-1]))
+        monthly_data = cache.run('returns', at.add_returns, monthly_data, lags = [1,2,3,6,9,12], outlier_cutoff = 0.005)
+        factor_data = cache.source('factors', at.download_factors())
+        ## the betas only add the new months to the saved regressions
+        monthly_data = cache.source('betas', strategy.add_betas(monthly_data.value, factor_data.value, window = 24))
+        strategy.save()
+        clusters = cache.run('clusters', at.cluster_stocks, monthly_data, target_rsi_values = [30, 45, 55, 70])
+        stocks_dict = cache.run('selection', at.select_stocks, clusters, cluster_id = 3)
+        latest = max(stocks_dict.value)
+        print(f'stocks for the month starting {latest}: {stocks_dict.value[latest]}')
@@ -0,0 +1,290 @@
+## Vectorized Technical Indicator Engine
+## computes RSI, Bollinger Bands, ATR and MACD
+## for every ticker at once, on a wide date x ticker numpy matrix
+## instead of calling pandas_ta once per ticker in a groupby
+## the kernels walk the time axis once
+## and update all the tickers together on every step
+## they follow the same recursions as pandas_ta (0.3.14b)
+## and pandas' rolling/ewm code, operation by operation
+## so the outputs match the per-ticker version bit for bit
+## (see parity_report at the bottom)
+## packages required for this module
+## pandas, numpy
+import numpy as np
+import pandas as pd
+
+## in the long (date, ticker) df a ticker only has rows
+## for the days it actually traded
+## so instead of a plain date x ticker matrix (with NaNs for the other days)
+## we "pack" every column:
+## the ticker's rows go to the top, in date order
+## which gives every ticker the exact series the groupby would see
+## followed by NaN padding at the bottom
+## rows and cols are the date and ticker codes of the long rows
+def packed_positions(rows, cols, n_dates, n_tickers):
+    present = np.zeros((n_dates, n_tickers), dtype = bool)
+    present[rows, cols] = True
+    ## the packed row is the number of earlier dates of the same ticker
+    positions = (np.cumsum(present, axis = 0) - 1)[rows, cols]
+    return positions, present.sum(axis = 0)
+
+def pack(values, positions, cols, counts):
+    packed = np.full((counts.max(), len(counts)), np.nan)
+    packed[positions, cols] = values
+    return packed
+
+## and reading the results back on the long rows
+def unpack(packed, positions, cols):
+    return packed[positions, cols]
+
+## exponentially weighted mean, the same as
+## Series.ewm(com=com, adjust=adjust, min_periods=min_periods).mean()
+def ewm_mean(x, com, adjust = True, min_periods = 0):
+    alpha = 1. / (1. + com)
+    old_wt_factor = 1. - alpha
+    new_wt = 1. if adjust else alpha
+    min_periods = max(min_periods, 1)
+    out = np.empty_like(x)
+    weighted = x[0].copy()
+    nobs = (weighted == weighted).astype(np.int64)
+    old_wt = np.ones(x.shape[1])
+    out[0] = np.where(nobs >= min_periods, weighted, np.nan)
+    for i in range(1, len(x)):
+        cur = x[i]
+        is_observation = cur == cur
+        nobs += is_observation
+        started = weighted == weighted
+        ## the old weights decay on every step after the first value
+        old_wt = np.where(started, old_wt * old_wt_factor, old_wt)
+        update = started & is_observation
+        ## skipping the update when the value is the same
+        ## avoids numerical errors on constant series
+        new_weighted = (old_wt * weighted + new_wt * cur) / (old_wt + new_wt)
+        weighted = np.where(update & (weighted != cur), new_weighted, weighted)
+        if adjust:
+            old_wt = np.where(update, old_wt + new_wt, old_wt)
+        else:
+            old_wt = np.where(update, 1., old_wt)
+        ## the first value of a ticker starts its average
+        weighted = np.where(~started & is_observation, cur, weighted)
+        out[i] = np.where(nobs >= min_periods, weighted, np.nan)
+    return out
+
+## Wilder's moving average, alpha = 1/length
+def rma(x, length):
+    alpha = 1.0 / length
+    return ewm_mean(x, com = 1 / alpha - 1, adjust = True, min_periods = length)
+
+## rolling mean and variance
+## these are the online (Kahan compensated) add/remove updates
+## that pandas uses in Series.rolling(length).mean()/.var()
+## run for all the columns together
+def rolling_mean(x, length, min_periods = None):
+    min_periods = length if min_periods is None else min_periods
+    n_cols = x.shape[1]
+    out = np.empty_like(x)
+    sum_x = np.zeros(n_cols)
+    compensation_add = np.zeros(n_cols)
+    compensation_remove = np.zeros(n_cols)
+    nobs = np.zeros(n_cols, dtype = np.int64)
+    neg_ct = np.zeros(n_cols, dtype = np.int64)
+    same_count = np.zeros(n_cols, dtype = np.int64)
+    prev_value = x[0].copy()
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        for i in range(len(x)):
+            ## the value leaving the window
+            if i >= length:
+                val = x[i - length]
+                obs = val == val
+                nobs -= obs
+                y = -val - compensation_remove
+                t = sum_x + y
+                compensation_remove = np.where(obs, t - sum_x - y, compensation_remove)
+                sum_x = np.where(obs, t, sum_x)
+                neg_ct -= obs & np.signbit(val)
+            ## and the one coming in
+            val = x[i]
+            obs = val == val
+            nobs += obs
+            y = val - compensation_add
+            t = sum_x + y
+            compensation_add = np.where(obs, t - sum_x - y, compensation_add)
+            sum_x = np.where(obs, t, sum_x)
+            neg_ct += obs & np.signbit(val)
+            same_count = np.where(obs, np.where(val == prev_value, same_count + 1, 1), same_count)
+            prev_value = np.where(obs, val, prev_value)
+            result = sum_x / nobs
+            result = np.where(same_count >= nobs, prev_value,
+                              np.where((neg_ct == 0) & (result < 0), 0.,
+                                       np.where((neg_ct == nobs) & (result > 0), 0., result)))
+            out[i] = np.where((nobs >= min_periods) & (nobs > 0), result, np.nan)
+    return out
+
+def rolling_var(x, length, ddof = 1, min_periods = None):
+    min_periods = max(length if min_periods is None else min_periods, 1)
+    n_cols = x.shape[1]
+    out = np.empty_like(x)
+    mean_x = np.zeros(n_cols)
+    ssqdm_x = np.zeros(n_cols)
+    compensation_add = np.zeros(n_cols)
+    compensation_remove = np.zeros(n_cols)
+    nobs = np.zeros(n_cols)
+    same_count = np.zeros(n_cols, dtype = np.int64)
+    prev_value = x[0].copy()
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        for i in range(len(x)):
+            if i >= length:
+                val = x[i - length]
+                obs = val == val
+                nobs = nobs - obs
+                prev_mean = mean_x - compensation_remove
+                y = val - compensation_remove
+                t = y - mean_x
+                new_mean = mean_x - t / nobs
+                new_ssqdm = ssqdm_x - (val - prev_mean) * (val - new_mean)
+                ## the window went empty
+                empty = obs & (nobs == 0)
+                update = obs & (nobs != 0)
+                compensation_remove = np.where(update, t + mean_x - y, compensation_remove)
+                mean_x = np.where(update, new_mean, np.where(empty, 0., mean_x))
+                ssqdm_x = np.where(update, new_ssqdm, np.where(empty, 0., ssqdm_x))
+            val = x[i]
+            obs = val == val
+            nobs = nobs + obs
+            same_count = np.where(obs, np.where(val == prev_value, same_count + 1, 1), same_count)
+            prev_value = np.where(obs, val, prev_value)
+            ## Welford's update with Kahan summation
+            prev_mean = mean_x - compensation_add
+            y = val - compensation_add
+            t = y - mean_x
+            new_mean = mean_x + t / nobs
+            new_ssqdm = ssqdm_x + (val - prev_mean) * (val - new_mean)
+            compensation_add = np.where(obs, t + mean_x - y, compensation_add)
+            mean_x = np.where(obs, new_mean, mean_x)
+            ssqdm_x = np.where(obs, new_ssqdm, ssqdm_x)
+            result = np.where((nobs == 1) | (same_count >= nobs), 0., ssqdm_x / (nobs - ddof))
+            out[i] = np.where((nobs >= min_periods) & (nobs > ddof), result, np.nan)
+    return out
+
+## the mean of the first `length` values of every (packed) column
+## summed the same way Series.mean() does
+def _head_mean(x, length):
+    head = np.ascontiguousarray(x[:length].T)
+    valid = head == head
+    return np.where(valid, head, 0.).sum(axis = 1) / valid.sum(axis = 1).astype(np.float64)
+
+## pandas_ta's ema: seeded with the sma of the first `length` values
+## and then ewm(span=length, adjust=False)
+def ema(x, length):
+    seeded = x.copy()
+    seeded[length - 1] = _head_mean(x, length)
+    seeded[:length - 1] = np.nan
+    return ewm_mean(seeded, com = (length - 1) / 2, adjust = False)
+
+## the indicators themselves
+## every input is a packed (date, ticker) matrix
+def rsi(close, length = 14, scalar = 100):
+    negative = np.full_like(close, np.nan)
+    negative[1:] = close[1:] - close[:-1]
+    positive = negative.copy()
+    positive[positive < 0] = 0
+    negative[negative > 0] = 0
+    positive_avg = rma(positive, length)
+    negative_avg = rma(negative, length)
+    return scalar * positive_avg / (positive_avg + np.abs(negative_avg))
+
+## all three bands from the same rolling pass
+## returning (lower, mid, upper)
+def bbands(close, length = 5, std = 2.0, ddof = 0):
+    deviations = std * np.sqrt(rolling_var(close, length, ddof = ddof))
+    mid = rolling_mean(close, length)
+    return mid - deviations, mid, mid + deviations
+
+def atr(high, low, close, length = 14):
+    high_low_range = high - low
+    ## pandas_ta adds epsilon to the whole series
+    ## if any of the ranges is zero
+    has_zero = (high_low_range == 0).any(axis = 0)
+    high_low_range = np.where(has_zero, high_low_range + np.finfo(float).eps, high_low_range)
+    prev_close = np.full_like(close, np.nan)
+    prev_close[1:] = close[:-1]
+    true_range = np.fmax(np.fmax(np.abs(high_low_range), np.abs(high - prev_close)), np.abs(prev_close - low))
+    true_range[0] = np.nan
+    return rma(true_range, length)
+
+## the macd line, the difference of the fast and slow ema
+def macd(close, fast = 12, slow = 26):
+    return ema(close, fast) - ema(close, slow)
+
+## normalizing each ticker with its own mean and std
+## the same as x.sub(x.mean()).div(x.std())
+## the sums have to run over each ticker's own rows
+## to be summed in the same order as pandas does
+def zscore(x, counts):
+    out = np.full_like(x, np.nan)
+    for j, n in enumerate(counts):
+        col = np.ascontiguousarray(x[:n, j])
+        valid = col == col
+        filled = np.where(valid, col, 0.)
+        count = np.float64(valid.sum())
+        mean = filled.sum(dtype = np.float64) / count
+        sqr = (mean - filled) ** 2
+        sqr[~valid] = 0.
+        std = np.sqrt(sqr.sum(dtype = np.float64) / (count - 1))
+        out[:n, j] = (col - mean) / std
+    return out
+
+## the feature block of algorithmicTrading.py
+## it takes the long (date, ticker) price df
+## and returns the indicator columns on the same index
+def compute_indicators(data, rsi_length = 20, bb_length = 20, atr_length = 14, macd_fast = 12, macd_slow = 26):
+    ## the date and ticker codes of every row
+    ## straight from the index, without unstacking
+    rows, dates = pd.factorize(data.index.get_level_values('date'), sort = True)
+    cols, tickers = pd.factorize(data.index.get_level_values('ticker'), sort = True)
+    positions, counts = packed_positions(rows, cols, len(dates), len(tickers))
+
+    def packed_field(field):
+        return pack(data[field].to_numpy(dtype = np.float64), positions, cols, counts)
+
+    adj_close = packed_field('adj close')
+    bb_low, bb_mid, bb_high = bbands(np.log1p(adj_close), length = bb_length)
+    packed_results = {'rsi': rsi(adj_close, length = rsi_length),
+                      'bb_low': bb_low,
+                      'bb_mid': bb_mid,
+                      'bb_high': bb_high,
+                      'atr': zscore(atr(packed_field('high'), packed_field('low'), packed_field('close'),
+                                        length = atr_length), counts),
+                      'macd': zscore(macd(adj_close, fast = macd_fast, slow = macd_slow), counts)}
+    return pd.DataFrame(np.column_stack([unpack(values, positions, cols) for values in packed_results.values()]),
+                        index = data.index,
+                        columns = list(packed_results))
+
+## comparing the engine with the original per-ticker pandas_ta code
+## it returns the max absolute difference and
+## whether the values are exactly the same, for every indicator
+def parity_report(data):
+    import pandas_ta
+    def compute_atr(stock_data):
+        atr = pandas_ta.atr(high = stock_data['high'], low = stock_data['low'], close = stock_data['close'], length = 14)
+        return atr.sub(atr.mean()).div(atr.std())
+    def compute_macd(close):
+        macd = pandas_ta.macd(close = close, length = 20).iloc[:,0]
+        return macd.sub(macd.mean()).div(macd.std())
+    by_ticker = data.groupby(level = 1)['adj close']
+    expected = pd.DataFrame({'rsi': by_ticker.transform(lambda x: pandas_ta.rsi(close = x, length = 20)),
+                             'bb_low': by_ticker.transform(lambda x: pandas_ta.bbands(close = np.log1p(x), length = 20).iloc[:,0]),
+                             'bb_mid': by_ticker.transform(lambda x: pandas_ta.bbands(close = np.log1p(x), length = 20).iloc[:,1]),
+                             'bb_high': by_ticker.transform(lambda x: pandas_ta.bbands(close = np.log1p(x), length = 20).iloc[:,2]),
+                             'atr': data.groupby(level = 1, group_keys = False).apply(compute_atr),
+                             'macd': data.groupby(level = 1, group_keys = False)['adj close'].apply(compute_macd)})
+    result = compute_indicators(data)
+    report = {}
+    for col in result.columns:
+        a = result[col].to_numpy()
+        b = expected[col].reindex(result.index).to_numpy()
+        same_nans = np.array_equal(np.isnan(a), np.isnan(b))
+        both = ~np.isnan(a) & ~np.isnan(b)
+        report[col] = {'max_abs_diff': np.abs(a[both] - b[both]).max() if both.any() else 0.,
+                       'identical': same_nans and np.array_equal(a[both], b[both])}
+    return pd.DataFrame(report).T
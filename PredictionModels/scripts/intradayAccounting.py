@@ -0,0 +1,65 @@
+## Day-Segmented Intraday Accounting
+## the positions and the returns of intradayTrading.py
+## from the offsets of the day boundaries, in a few array passes
+## instead of a groupby(pd.Grouper(freq='D')) with a lambda for every day
+## the bars are in time order, so every day is a contiguous segment of them:
+## 1. the start of every bar's day, a np.maximum.accumulate of the day starts
+## 2. the last signal of the bar's day so far, a np.maximum.accumulate of the signal positions
+##    (held from the first signal of the day, like the ffill within the day)
+## 3. the forward return and the strategy return, a shift and a product
+## 4. the P&L of every day, a np.add.reduceat over the day segments
+## it also gives a record per trade: a day with a position, from its entry to the end of the day
+## (the strategy returns here are products of signs, so the day sums are exact,
+##  like the pandas sums they replace)
+## packages required for this module
+## pandas, numpy
+import numpy as np
+import pandas as pd
+
+## the day segments of a sorted datetime index
+## it returns the days, the offset of the first bar of every day
+## and the offset of the first bar of its day, for every bar
+def day_segments(index):
+    days = pd.DatetimeIndex(index).normalize()
+    values = days.asi8
+    is_start = np.ones(len(values), dtype = bool)
+    is_start[1:] = values[1:] != values[:-1]
+    offsets = np.nonzero(is_start)[0]
+    day_start = np.maximum.accumulate(np.where(is_start, np.arange(len(values)), 0))
+    return days[offsets], offsets, day_start
+
+## the position of every bar: the last signal of its day so far
+## (NaN before the first signal of the day)
+def hold_positions(return_sign, day_start):
+    positions = np.arange(len(return_sign))
+    last_signal = np.maximum.accumulate(np.where(return_sign == return_sign, positions, -1))
+    held = last_signal >= day_start
+    return np.where(held, return_sign[np.maximum(last_signal, 0)], np.nan), held
+
+## the accounting of the bars of final_df (indexed by datetime, with the return_sign)
+## it returns the bar columns (return, forward_return, strategy_return) as a dict of arrays
+## the daily returns (every calendar day, like the Grouper sum, 0 without a trade)
+## and the trades: entry and exit time, side, bars held and the day's P&L
+def account_days(final_df):
+    return_sign = final_df['return_sign'].to_numpy(dtype = np.float64)
+    days, offsets, day_start = day_segments(final_df.index)
+    position, held = hold_positions(return_sign, day_start)
+    forward_return = np.full(len(position), np.nan)
+    forward_return[:-1] = position[1:]
+    strategy_return = forward_return * return_sign
+    day_pnl = np.add.reduceat(np.nan_to_num(strategy_return), offsets) if len(offsets) else np.zeros(0)
+    ## every calendar day from the first to the last, like pd.Grouper(freq='D')
+    calendar = pd.date_range(days[0], days[-1], freq = 'D', name = final_df.index.name) if len(days) else days
+    daily_returns = pd.Series(0., index = calendar, name = 'strategy_return')
+    daily_returns.iloc[calendar.get_indexer(days)] = day_pnl
+    ## the trades, one per day with a position
+    entries = np.nonzero(held & (np.r_[True, ~held[:-1]] | (day_start == np.arange(len(held)))))[0]
+    day_of_entry = np.searchsorted(offsets, entries, side = 'right') - 1
+    day_end = np.r_[offsets[1:], len(position)] - 1
+    trades = pd.DataFrame({'entry_time': final_df.index[entries],
+                           'exit_time': final_df.index[day_end[day_of_entry]],
+                           'side': position[entries],
+                           'bars': day_end[day_of_entry] - entries + 1,
+                           'pnl': day_pnl[day_of_entry]})
+    columns = {'return': position, 'forward_return': forward_return, 'strategy_return': strategy_return}
+    return columns, daily_returns, trades
@@ -0,0 +1,145 @@
+## Intraday Bar Store
+## the 5-min bars of intradayTrading.py, read from the csv once
+## and kept as a columnar cache: one flat binary file per column
+## (the timestamps as int64 nanoseconds, float32 prices and int64 volume)
+## and a small json file with the dtypes, the number of rows
+## and the size and modification time of the csv it came from
+## the csv is read in chunks with explicit dtypes
+## so converting a file much larger than memory only holds one chunk at a time
+## the next runs memory map the columns, which opens them in milliseconds
+## and a date range only reads its own rows
+## (the timestamps are sorted, so the range is a binary search)
+## a changed csv is converted again
+## packages required for this module
+## pandas, numpy
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+bar_columns = ['open', 'high', 'low', 'close', 'volume']
+price_columns = ['open', 'high', 'low', 'close']
+meta_file = '_meta.json'
+cache_version = 1
+
+## the cache sits next to the csv
+## data/simulated_5min_data.csv -> data/simulated_5min_data_columns/
+def default_cache_path(csv_path):
+    return os.path.splitext(csv_path)[0] + '_columns'
+
+def _source(csv_path):
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+## converting the csv to the columnar cache
+## chunksize is the number of rows parsed at a time
+## and datetime_format the format of the timestamps (None infers it)
+def convert_csv(csv_path, cache_path = None, chunksize = 1_000_000, price_dtype = np.float32,
+                volume_dtype = np.int64, datetime_column = 'datetime', datetime_format = None):
+    cache_path = cache_path or default_cache_path(csv_path)
+    dtypes = {**{c: np.dtype(price_dtype) for c in price_columns}, 'volume': np.dtype(volume_dtype)}
+    ## writing to a temp folder first, so a crash never leaves a broken cache
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors = True)
+    os.makedirs(tmp_path)
+    files = {c: open(os.path.join(tmp_path, f'{c}.bin'), 'wb') for c in ['datetime'] + bar_columns}
+    n_rows = 0
+    is_sorted = True
+    last = None
+    tz = None
+    try:
+        for chunk in pd.read_csv(csv_path, usecols = [datetime_column] + bar_columns,
+                                 dtype = dtypes, chunksize = chunksize):
+            timestamps = pd.to_datetime(chunk[datetime_column], format = datetime_format)
+            ## timestamps with an offset are kept in UTC, and converted back when they're read
+            if timestamps.dt.tz is not None:
+                tz = str(timestamps.dt.tz)
+                timestamps = timestamps.dt.tz_convert('UTC').dt.tz_localize(None)
+            ns = timestamps.to_numpy(dtype = 'datetime64[ns]').view(np.int64)
+            if len(ns):
+                is_sorted = is_sorted and bool((ns[1:] >= ns[:-1]).all()) and bool(last is None or ns[0] >= last)
+                last = ns[-1]
+            files['datetime'].write(ns.tobytes())
+            for c in bar_columns:
+                files[c].write(chunk[c].to_numpy(dtype = dtypes[c]).tobytes())
+            n_rows += len(chunk)
+    finally:
+        for f in files.values():
+            f.close()
+    meta = {'version': cache_version,
+            'rows': n_rows,
+            'dtypes': {'datetime': 'int64', **{c: dtypes[c].str for c in bar_columns}},
+            'sorted': is_sorted,
+            'tz': tz,
+            'source': _source(csv_path)}
+    with open(os.path.join(tmp_path, meta_file), 'w') as f:
+        json.dump(meta, f, indent = 1)
+    shutil.rmtree(cache_path, ignore_errors = True)
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+## the memory mapped columns of a cache
+class IntradayStore:
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        with open(os.path.join(cache_path, meta_file)) as f:
+            self.meta = json.load(f)
+        n = self.meta['rows']
+        self.columns = {}
+        for c, dtype in self.meta['dtypes'].items():
+            path = os.path.join(cache_path, f'{c}.bin')
+            ## an empty file can't be memory mapped
+            self.columns[c] = np.memmap(path, dtype = dtype, mode = 'r', shape = (n,)) if n else np.empty(0, dtype = dtype)
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def _ns(self, x):
+        x = pd.Timestamp(x)
+        if self.meta['tz'] is not None:
+            x = (x.tz_localize(self.meta['tz']) if x.tz is None else x).tz_convert('UTC').tz_localize(None)
+        return x.as_unit('ns').value
+
+    ## the rows in [start, end)
+    def _rows(self, start = None, end = None):
+        ns = self.columns['datetime']
+        if self.meta['sorted']:
+            lo = 0 if start is None else int(np.searchsorted(ns, self._ns(start), side = 'left'))
+            hi = len(ns) if end is None else int(np.searchsorted(ns, self._ns(end), side = 'left'))
+            return slice(lo, max(lo, hi))
+        ## an unsorted file has to check every row
+        mask = np.ones(len(ns), dtype = bool)
+        if start is not None:
+            mask &= ns >= self._ns(start)
+        if end is not None:
+            mask &= ns < self._ns(end)
+        return np.nonzero(mask)[0]
+
+    ## the bars in [start, end), indexed by datetime
+    def read(self, start = None, end = None, columns = None):
+        rows = self._rows(start, end)
+        index = pd.DatetimeIndex(np.array(self.columns['datetime'][rows]).view('datetime64[ns]'), name = 'datetime')
+        if self.meta['tz'] is not None:
+            index = index.tz_localize('UTC').tz_convert(self.meta['tz'])
+        return pd.DataFrame({c: np.array(self.columns[c][rows]) for c in (columns or bar_columns)}, index = index)
+
+## if the cache was made from this csv, with these options
+def is_fresh(csv_path, cache_path, price_dtype = np.float32):
+    try:
+        with open(os.path.join(cache_path, meta_file)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (meta.get('version') == cache_version
+            and meta.get('source') == _source(csv_path)
+            and meta['dtypes']['close'] == np.dtype(price_dtype).str)
+
+## the bars of the csv in [start, end)
+## converting it to the cache first, if it isn't there yet (or the csv changed)
+## convert_options go to convert_csv (e.g. chunksize)
+def load_intraday(csv_path, start = None, end = None, cache_path = None, price_dtype = np.float32, **convert_options):
+    cache_path = cache_path or default_cache_path(csv_path)
+    if not is_fresh(csv_path, cache_path, price_dtype = price_dtype):
+        convert_csv(csv_path, cache_path, price_dtype = price_dtype, **convert_options)
+    return IntradayStore(cache_path).read(start, end)
@@ -9,123 +9,173 @@
 ## Merge with intraday data and calculate intraday indicators to form the intraday signal
 ## Generate the position entry and hold until the end of day
 ## Finally, calculate the final strategy returns
+## every step is a function of one instrument's data
+## so intradayUniverse.py can run the same strategy on many symbols
 ## first the imports
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mtick
-from arch import arch_model
 import pandas as pd
 import pandas_ta
 import numpy as np
+## the stage profiler (off unless STAGE_PROFILE is set)
+from stageProfiler import stage
+## and the rolling GARCH forecaster
+from garchForecaster import rolling_garch
+## and the vectorized signal rules
+from signalRules import SignalRules
+## and the columnar store of the intraday bars
+from intradayStore import load_intraday
+## and the day accounting of the positions
+from intradayAccounting import account_days
+
 ## then load the simulated daily and 5-min data
 min_data_path = '../data/simulated_5min_data.csv'
 daily_data_path = '../data/simulated_daily_data.csv'
-## loading the data
-daily_df = pd.read_csv(daily_data_path)
-## fixig the date 
-## and then set the index to be date
-daily_df['Date'] = pd.to_datetime(daily_df['Date'])
-daily_df = daily_df.set_index('Date')
-## calculating the log return
-daily_df['log_ret'] = np.log(daily_df['Adj Close']).diff()
-daily_df = daily_df.drop('Unnamed: 7', axis =1)
-intraday_5min_df = pd.read_csv(min_data_path)
-intraday_5min_df['datetime'] = pd.to_datetime(intraday_5min_df['datetime'])
-intraday_5min_df.drop('Unnamed: 6', axis= 1, inplace = True)
-intraday_5min_df = intraday_5min_df.set_index('datetime')
-intraday_5min_df['date'] = pd.to_datetime(intraday_5min_df.index.date)
-## now we want to define a func 
-## to fit the GARCH model 
-## and predict 1-day ahead volatility 
+
+## loading the daily data
+def load_daily(daily_data_path):
+    daily_df = pd.read_csv(daily_data_path)
+    ## fixig the date
+    ## and then set the index to be date
+    daily_df['Date'] = pd.to_datetime(daily_df['Date'])
+    daily_df = daily_df.set_index('Date')
+    ## calculating the log return
+    daily_df['log_ret'] = np.log(daily_df['Adj Close']).diff()
+    ## without the empty column
+    return daily_df.drop(columns = [c for c in daily_df.columns if c.startswith('Unnamed')])
+
+## the 5-min bars go through the intraday store
+## the first run reads the csv in chunks (float32 prices and int volume)
+## into a columnar cache next to it, and the next runs memory map the cache
+## it's already indexed by datetime, without the empty column
+def load_bars(min_data_path):
+    intraday_5min_df = load_intraday(min_data_path)
+    ## and the day of every bar
+    intraday_5min_df['date'] = intraday_5min_df.index.normalize()
+    return intraday_5min_df
+
+## now we want to define a func
+## to fit the GARCH model
+## and predict 1-day ahead volatility
 ## in a rolling window
 ## we will first calculate the 6-month
 ## rolling variance and then
 ## we are creating a function
-## in a 6-month rolling window to fit 
+## in a 6-month rolling window to fit
 ## a garch model and predict
 ## the next day variance
-## we need to test to find 
-## what orders would work best 
-## first, calculate the 6-month rolling variance
-daily_df['variance'] = daily_df['log_ret'].rolling(180).var()
-## for simplicity
-## we will only use 2020 forward
-daily_df = daily_df['2020-01-01':]
-## and lets define the function
-def predict_volatility(x):
-    ## p is auto regressive order
-    ## q is moving avg order
-    garch_model = arch_model(y=x, p=1, q=3).fit(update_freq = 5, disp = 'off')
-    ## then we want to forcast one day ahead
-    ## and it will generate mean and var
-    ## and we want to only get var
-    variance_forcast = garch_model.forecast(horizon=1).variance.iloc[-1,0]
-    return variance_forcast
-## now we want to get the predictions of the model
-daily_df['predictions'] = daily_df['log_ret'].rolling(180).apply(lambda x : predict_volatility(x))
-## now we want to calculate 
-## prediction premium
-## and form a signal from it
-## by calculating its 6-month
-## rolling standard deviation
-daily_df['prediction_premium'] = (daily_df['predictions']-daily_df['variance'])/daily_df['variance']
-daily_df['premium_std'] = daily_df['prediction_premium'].rolling(180).std()
-## and to get the daily signal
-daily_df['signal_daily'] = daily_df.apply(lambda x: 1 if (x['prediction_premium'] > x['premium_std'] *1.5)
-                                         else (-1 if  x['prediction_premium'] < x['premium_std'] *-1.5
-                                              else np.nan), axis=1)
-## we can plot a histogram
-## to see how many long (1) signals
-## and how many short (-1) signals 
-## we have in the set
-daily_df['signal_daily'].plot(kind = 'hist')
-## we will be using the current day signal
-## to predict the next day's values
-## so we need to shift the signal by one
-daily_df['signal_daily'] = daily_df['signal_daily'].shift(1)
-## next, we want to merge the new df
+## we need to test to find
+## what orders would work best
+## garch_workers is the number of workers of the GARCH fits (None uses all the cores)
+def daily_signals(daily_df, garch_workers = None):
+    daily_df = daily_df.copy()
+    ## first, calculate the 6-month rolling variance
+    daily_df['variance'] = daily_df['log_ret'].rolling(180).var()
+    ## for simplicity
+    ## we will only use 2020 forward
+    daily_df = daily_df['2020-01-01':]
+    ## and to get the predictions of the model
+    ## we use the rolling GARCH forecaster
+    ## p (the auto regressive order) is 1 and q (the moving avg order) is 3
+    ## and every window forecasts one day ahead, and we only get the variance
+    ## the windows are split over the worker pool
+    ## warm_start = True starts every fit from the previous window's parameters
+    ## and refit_every = n only re-estimates the model every n days
+    ## (the days in between use the last parameters)
+    ## both are much faster on long histories, but move the forecasts a bit
+    ## garchForecaster.drift_report shows how much
+    ## here every window is a full fit, like fitting each one on its own
+    with stage('garch'):
+        daily_df['predictions'], garch_stats = rolling_garch(daily_df['log_ret'],
+                                                             window = 180,
+                                                             p = 1,
+                                                             q = 3,
+                                                             warm_start = False,
+                                                             refit_every = 1,
+                                                             max_workers = garch_workers)
+    ## now we want to calculate
+    ## prediction premium
+    ## and form a signal from it
+    ## by calculating its 6-month
+    ## rolling standard deviation
+    daily_df['prediction_premium'] = (daily_df['predictions']-daily_df['variance'])/daily_df['variance']
+    daily_df['premium_std'] = daily_df['prediction_premium'].rolling(180).std()
+    ## and to get the daily signal
+    ## the signals are rules on the columns, the first one that holds gives the signal
+    ## and NaN if none of them does
+    daily_signal = SignalRules([('prediction_premium > premium_std * 1.5', 1),
+                                ('prediction_premium < premium_std * -1.5', -1)])
+    daily_df['signal_daily'] = daily_signal(daily_df)
+    return daily_df
+
+## next, we want to merge the daily signals
 ## with the intraday df
 ## and calculate the intraday indicators
 ## to form the intraday signals
-final_df = intraday_5min_df.reset_index().merge(daily_df[['signal_daily']].reset_index(),
-                                    left_on = 'date',
-                                    right_on = 'Date').set_index('datetime')
-final_df.drop(['date', 'Date'], axis = 1, inplace = True)
-## now we're ready to calculate the indicators
-## usig the pandas_ta
-final_df['rsi'] = pandas_ta.rsi(close = final_df['close'], length = 20)
-## lower bound
-final_df['lband'] = pandas_ta.bbands(close=final_df['close'], length = 20).iloc[:,0]
-## upper bound
-final_df['uband'] = pandas_ta.bbands(close = final_df['close'], length = 20).iloc[:,2]
-## now we're ready to calculate intraday signal
-## which we will define as
-## rsi > 70 and and close > uband
-final_df['signal_intraday'] = final_df.apply(lambda x: 1 if (x['rsi'] > 70 and x['close'] > x['uband'])
-                                            else (-1 if (x['rsi'] < 30 and x['close'] < x['lband']) 
-                                                 else np.nan),
-                                             axis = 1)
-## now we're ready to generate the position entry
-## and hold until the end of the day
-## the strategy is to short
-## when both daily and intraday signals 
-## are 1, and long when both are -1
-final_df['return_sign'] = final_df.apply(lambda x: -1 if (x['signal_daily'] == 1 and x['signal_intraday'] == 1)
-                                                        else (1 if (x['signal_daily'] == -1 and x['signal_intraday'] == -1)
-                                                                 else np.nan),
-                                        axis = 1)
+def intraday_positions(intraday_5min_df, daily_df):
+    daily_df = daily_df.copy()
+    ## we will be using the current day signal
+    ## to predict the next day's values
+    ## so we need to shift the signal by one
+    daily_df['signal_daily'] = daily_df['signal_daily'].shift(1)
+    final_df = intraday_5min_df.reset_index().merge(daily_df[['signal_daily']].reset_index(),
+                                        left_on = 'date',
+                                        right_on = 'Date').set_index('datetime')
+    final_df.drop(['date', 'Date'], axis = 1, inplace = True)
+    ## now we're ready to calculate the indicators
+    ## usig the pandas_ta
+    with stage('intraday_indicators'):
+        final_df['rsi'] = pandas_ta.rsi(close = final_df['close'], length = 20)
+        ## lower bound
+        final_df['lband'] = pandas_ta.bbands(close=final_df['close'], length = 20).iloc[:,0]
+        ## upper bound
+        final_df['uband'] = pandas_ta.bbands(close = final_df['close'], length = 20).iloc[:,2]
+    ## (for live trading, onlineIndicators.OnlineIntradayStrategy computes the same
+    ## indicators, signals and positions one bar at a time)
+    ## now we're ready to calculate intraday signal
+    ## which we will define as
+    ## rsi > 70 and and close > uband
+    intraday_signal = SignalRules([('rsi > 70 and close > uband', 1),
+                                   ('rsi < 30 and close < lband', -1)])
+    final_df['signal_intraday'] = intraday_signal(final_df)
+    ## now we're ready to generate the position entry
+    ## and hold until the end of the day
+    ## the strategy is to short
+    ## when both daily and intraday signals
+    ## are 1, and long when both are -1
+    position_signal = SignalRules([('signal_daily == 1 and signal_intraday == 1', -1),
+                                   ('signal_daily == -1 and signal_intraday == -1', 1)])
+    final_df['return_sign'] = position_signal(final_df)
+    return final_df
+
 ## we will go into the position
 ## in the first signal of the day
 ## and hold for the entire day
 ## and we can have the first signal
 ## filling the rest of the day
-final_df['return'] = final_df.groupby(pd.Grouper(freq='D'))['return_sign'].transform(lambda x : x.ffill())
-final_df['forward_return'] = final_df['return'].shift(-1)
-final_df['strategy_return'] = final_df['forward_return']*final_df['return_sign']
-## and finally, we can calculate the daily return
-daily_return_df = final_df.groupby(pd.Grouper(freq='D'))['strategy_return'].sum()
-strategy_cumulative_return = np.exp(np.log1p(daily_return_df).cumsum()).sub(1)
-## and plotting the strategy return
-strategy_cumulative_return.plot(figsize = (20,10))
-plt.title('Intraday Strategy Return')
-plt.gca().yaxis.set_major_formatter(mtick.PercentFormatter(1))
-plt.ylabel('Return')
\ No newline at end of file
+## the day accounting works on the offsets of the days in the bars
+## (the same as a groupby(pd.Grouper(freq='D')) ffill of the return_sign
+## and a daily sum of the strategy return, without a lambda for every day)
+## it returns the daily strategy return and the trades (one per day with a position)
+def strategy_returns(final_df):
+    columns, daily_return_df, trades = account_days(final_df)
+    for column, values in columns.items():
+        final_df[column] = values
+    return daily_return_df, trades
+
+if __name__ == '__main__':
+    daily_df = daily_signals(load_daily(daily_data_path))
+    ## we can plot a histogram
+    ## to see how many long (1) signals
+    ## and how many short (-1) signals
+    ## we have in the set
+    daily_df['signal_daily'].plot(kind = 'hist')
+    final_df = intraday_positions(load_bars(min_data_path), daily_df)
+    daily_return_df, trades = strategy_returns(final_df)
+    print(f'{len(trades)} trades, {(trades["pnl"] > 0).mean():.0%} of them with a positive day')
+    strategy_cumulative_return = np.exp(np.log1p(daily_return_df).cumsum()).sub(1)
+    ## and plotting the strategy return
+    strategy_cumulative_return.plot(figsize = (20,10))
+    plt.title('Intraday Strategy Return')
+    plt.gca().yaxis.set_major_formatter(mtick.PercentFormatter(1))
+    plt.ylabel('Return')
@@ -0,0 +1,122 @@
+## Intraday Universe Runner
+## the GARCH intraday strategy of intradayTrading.py on a whole folder of symbols
+## every symbol has its daily and its 5-min bars in the folder
+## <symbol>_daily_data.csv and <symbol>_5min_data.csv
+## (like simulated_daily_data.csv and simulated_5min_data.csv in data/)
+## the symbols run in the worker pool, one task per symbol
+## and a worker only sends back the symbol's daily strategy returns
+## so the memory stays bounded:
+## a worker holds one symbol at a time (its 5-min bars are memory mapped from the intraday store)
+## and the pool is replaced after tasks_per_worker symbols per worker, so nothing piles up over a long night
+## (a new pool, since max_tasks_per_child doesn't work with the forked workers of workerPool.py)
+## the GARCH fits of a symbol run in its worker
+## the portfolio holds the symbols with equal weights, rebalanced every day:
+## its daily return is the mean of the returns of the symbols that have data that day
+## a symbol that fails is reported and left out, instead of stopping the whole run
+## e.g.
+## python intradayUniverse.py ../data/universe --workers 8 --output ../data/universe_returns.csv
+## packages required for this module
+## pandas, numpy, and the ones of intradayTrading.py
+import os
+import argparse
+import traceback
+import pandas as pd
+from concurrent.futures import as_completed
+from workerPool import process_pool
+from intradayTrading import load_daily, load_bars, daily_signals, intraday_positions, strategy_returns
+
+daily_suffix = '_daily_data.csv'
+intraday_suffix = '_5min_data.csv'
+
+## the symbols of a folder, with their (daily, intraday) files
+## a symbol without both files is skipped
+def find_symbols(data_dir):
+    files = set(os.listdir(data_dir))
+    symbols = {}
+    for name in sorted(files):
+        if name.endswith(daily_suffix):
+            symbol = name[:-len(daily_suffix)]
+            if symbol + intraday_suffix in files:
+                symbols[symbol] = (os.path.join(data_dir, name), os.path.join(data_dir, symbol + intraday_suffix))
+    return symbols
+
+## the daily strategy returns of a symbol, on the days it has bars only
+## (the daily sum of the strategy has a 0 on every calendar day, weekends included)
+def symbol_returns(daily_path, intraday_path, garch_workers = 1):
+    daily_df = daily_signals(load_daily(daily_path), garch_workers = garch_workers)
+    final_df = intraday_positions(load_bars(intraday_path), daily_df)
+    daily_returns = strategy_returns(final_df)[0]
+    return daily_returns[daily_returns.index.isin(final_df.index.normalize())]
+
+## one symbol, in a worker
+## the error (with its traceback) comes back as a string
+def _run_symbol(symbol, daily_path, intraday_path):
+    try:
+        return symbol, symbol_returns(daily_path, intraday_path), None
+    except Exception:
+        return symbol, None, traceback.format_exc()
+
+## equal weights, rebalanced every day
+def portfolio_returns(symbol_returns):
+    return symbol_returns.mean(axis = 1).rename('portfolio')
+
+## running the strategy on every symbol of data_dir (or the given symbols)
+## a given symbol without its two files is an error
+## max_workers = None uses all the cores
+## it returns the portfolio's daily returns, the daily returns of every symbol (a column per symbol)
+## and the errors of the symbols that failed
+def run_universe(data_dir, symbols = None, max_workers = None, tasks_per_worker = 10, verbose = True):
+    files = find_symbols(data_dir)
+    if symbols is not None:
+        unknown = [symbol for symbol in symbols if symbol not in files]
+        if unknown:
+            raise ValueError(f'no {daily_suffix} and {intraday_suffix} files in {data_dir} for {", ".join(unknown)}')
+        files = {symbol: files[symbol] for symbol in symbols}
+    returns = {}
+    errors = {}
+    def collect(result):
+        symbol, daily_returns, error = result
+        if error is None:
+            returns[symbol] = daily_returns
+        else:
+            errors[symbol] = error
+        if verbose:
+            print(f'{symbol}: ' + ('done' if error is None else 'failed') + f' ({len(returns) + len(errors)}/{len(files)})')
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers == 1:
+        for symbol, (daily_path, intraday_path) in files.items():
+            collect(_run_symbol(symbol, daily_path, intraday_path))
+    else:
+        tasks = list(files.items())
+        batch_size = max_workers * tasks_per_worker
+        for start in range(0, len(tasks), batch_size):
+            with process_pool(max_workers = max_workers) as pool:
+                futures = [pool.submit(_run_symbol, symbol, daily_path, intraday_path)
+                           for symbol, (daily_path, intraday_path) in tasks[start:start + batch_size]]
+                for future in as_completed(futures):
+                    collect(future.result())
+    ## the days a symbol has no bars stay NaN, so it isn't held that day
+    ## (and the days without any bars, like the weekends, aren't in the table at all)
+    returns_df = pd.DataFrame({symbol: returns[symbol] for symbol in sorted(returns)}).sort_index()
+    return portfolio_returns(returns_df), returns_df, errors
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'the intraday strategy on a folder of symbols')
+    parser.add_argument('data_dir')
+    parser.add_argument('--symbols', nargs = '+', default = None)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--tasks-per-worker', type = int, default = 10)
+    parser.add_argument('--output', default = None, help = 'a csv for the portfolio and symbol returns')
+    args = parser.parse_args()
+    try:
+        portfolio, returns_df, errors = run_universe(args.data_dir, symbols = args.symbols,
+                                                     max_workers = args.workers,
+                                                     tasks_per_worker = args.tasks_per_worker)
+    except ValueError as e:
+        parser.error(str(e))
+    for symbol, error in errors.items():
+        print(f'{symbol} failed:\n{error}')
+    print(f'{returns_df.shape[1]} symbols, total return {(1 + portfolio).prod() - 1:.2%}')
+    if args.output:
+        pd.concat([portfolio, returns_df], axis = 1).to_csv(args.output)
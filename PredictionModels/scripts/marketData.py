@@ -0,0 +1,271 @@
+## Market Data Sources
+## the one place the trading scripts get their outside data from:
+## the stock universe, the daily prices and the Fama-French factors
+## the yahoo source goes to wikipedia, yahoo finance (through the price store)
+## and the Fama-French data library, like the scripts always did
+## and the synthetic source makes everything up locally, from a seed
+## (the universe from data/stocks.tsv, prices from a market factor model)
+## so the scripts can run, be profiled and be load tested without any network
+## at any universe size and history length
+## the source is picked with the MARKET_DATA_SOURCE environment variable
+## e.g. MARKET_DATA_SOURCE=synthetic MARKET_DATA_TICKERS=5000 python algorithmicTrading.py
+## packages required for this module
+## pandas, numpy (and pandas_datareader, yfinance, pyarrow for the yahoo source)
+import os
+import abc
+import zlib
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+default_stocks_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'stocks.tsv')
+## the price fields of every source, in the same order yfinance gives them
+price_fields = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+factor_fields = ['Mkt-RF', 'SMB', 'HML', 'RMW', 'CMA']
+
+## the interface of a source
+## constituents() is the list of symbols of the universe
+## prices(tickers, start, end) is the long (date, ticker) df of the price fields
+## with end exclusive, like yf.download
+## factors(start) is the monthly (month end) factor df, in decimals
+class DataSource(abc.ABC):
+    @abc.abstractmethod
+    def constituents(self):
+        pass
+
+    @abc.abstractmethod
+    def prices(self, tickers, start, end):
+        pass
+
+    @abc.abstractmethod
+    def factors(self, start = '2010'):
+        pass
+
+class YahooSource(DataSource):
+    ## the SP500 companies
+    ## https://en.wikipedia.org/wiki/List_of_S%26P_500_companies
+    def constituents(self):
+        sp500 = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')[0]
+        ## replacing dots with dashes and
+        ## getting rid of the spaces, and making sure they're all uppercased
+        sp500['Symbol'] = sp500['Symbol'].str.replace('.','-').str.upper().str.strip()
+        return sp500['Symbol'].unique().tolist()
+
+    ## from the local price store, which only downloads
+    ## the date ranges it doesn't have yet
+    def prices(self, tickers, start, end):
+        from priceStore import get_prices
+        return get_prices(tickers = tickers, start = start, end = end)
+
+    ## the five factors from the Fama-French data library
+    def factors(self, start = '2010'):
+        import pandas_datareader.data as web
+        factor_data = web.DataReader('F-F_Research_Data_5_Factors_2x3',
+                      'famafrench',
+                      start = start)[0].drop('RF', axis = 1)
+        ## fixing the date to be the end of the month
+        ## and getting the actual values instead of %
+        factor_data.index = factor_data.index.to_timestamp()
+        factor_data = factor_data.resample('M').last().div(100)
+        factor_data.index.name = 'date'
+        return factor_data
+
+## the synthetic market
+## every day has a market return, and every stock's daily return is
+## its own drift + its beta times the market return + its own noise
+## the open, high and low are spread around the closes
+## the volume grows with the size of the move
+## and the adj close has the stock's dividends taken out
+## some of the stocks are listed later than the others
+## everything is seeded by the source seed and the ticker alone
+## so a ticker has the same prices in any universe and for any date range
+class SyntheticSource(DataSource):
+    ## the prices go back to the epoch
+    ## and the dividends are discounted back from the anchor
+    ## (a fixed day, so the adj close doesn't depend on the date range)
+    epoch = pd.Timestamp('1990-01-01')
+    anchor = pd.Timestamp('2030-01-01')
+    ## the days of a block of the market returns
+    market_block = 63
+
+    def __init__(self, seed = 0, n_tickers = 500, stocks_path = default_stocks_path):
+        self.seed = seed
+        self.n_tickers = n_tickers
+        self.stocks_path = stocks_path
+        self._market = np.empty(0)
+
+    ## the largest n_tickers companies of data/stocks.tsv
+    ## and made up symbols after those, for bigger universes
+    def constituents(self):
+        stocks = pd.read_csv(self.stocks_path, sep = '\t')
+        units = stocks['MarketCap'].str[-1].map({'M': 1e6, 'B': 1e9, 'T': 1e12})
+        stocks['cap'] = pd.to_numeric(stocks['MarketCap'].str[:-1].str.replace(',', ''), errors = 'coerce') * units
+        stocks = stocks.sort_values('cap', ascending = False, kind = 'stable')
+        ## the same cleaning as the wikipedia symbols
+        symbols = stocks['Symbol'].str.replace('.','-').str.upper().str.strip().unique().tolist()
+        symbols += [f'SYN{i:05d}' for i in range(max(0, self.n_tickers - len(symbols)))]
+        return symbols[:self.n_tickers]
+
+    ## the market's daily log returns from the epoch
+    ## in blocks of a few months, each one drawn from its own seed
+    ## so a day's return doesn't depend on how long the history is
+    ## the blocks are drawn once and more are added when a longer history is asked for
+    def _market_returns(self, n_days):
+        block_days = self.market_block
+        n_blocks = -(-n_days // block_days)
+        blocks = [self._market]
+        for block in range(len(self._market) // block_days, n_blocks):
+            rng = np.random.default_rng([self.seed, 0, block])
+            ## a calm and a volatile regime, switching every few months
+            volatility = .02 if rng.random() < .2 else .009
+            blocks.append(.0002 + volatility * rng.standard_normal(block_days))
+        self._market = np.concatenate(blocks)
+        return self._market[:n_days]
+
+    ## the per ticker parameters and noise, from the ticker's own seed
+    def _ticker_draws(self, ticker, n_days):
+        rng = np.random.default_rng([self.seed, zlib.crc32(ticker.encode())])
+        volatility = rng.uniform(.006, .025)
+        params = {'price': np.exp(rng.uniform(np.log(5), np.log(500))),
+                  ## the log drift, without the volatility drag
+                  'drift': rng.normal(.0001, .0001) - volatility**2/2,
+                  'beta': rng.uniform(.5, 1.6),
+                  'volatility': volatility,
+                  'shares': np.exp(rng.uniform(np.log(2e5), np.log(2e7))),
+                  'dividend_yield': rng.choice([0., rng.uniform(.005, .04)]),
+                  'listed': self.epoch + pd.DateOffset(days = int(rng.uniform(0, 30*365)) if rng.random() < .3 else 0)}
+        return params, rng.standard_normal((n_days, 5))
+
+    def prices(self, tickers, start, end):
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        tickers = sorted(dict.fromkeys(tickers))
+        start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+        days = pd.bdate_range(self.epoch, end - pd.Timedelta(days = 1))
+        market = self._market_returns(len(days))
+        first = days.searchsorted(start)
+        dates = days[first:]
+        ## the dividends are paid continuously,
+        ## so the adj close is the close discounted back from the anchor
+        years_left = (self.anchor - days).days.to_numpy() / 365.25
+        ## every ticker's rows since its listing, one ticker after the other
+        pieces = {field: [] for field in price_fields}
+        date_codes, ticker_codes = [], []
+        for j, ticker in enumerate(tickers):
+            p, noise = self._ticker_draws(ticker, len(days))
+            sigma = p['volatility']
+            ## the prices start at the ticker's price on its listing day
+            listed = days.searchsorted(p['listed'])
+            log_returns = p['drift'] + p['beta'] * market + sigma * noise[:, 0]
+            log_close = np.cumsum(log_returns)
+            close = p['price'] * np.exp(log_close - log_close[min(listed, len(days) - 1)])
+            previous_close = np.concatenate([[close[0]], close[:-1]])
+            open_ = previous_close * np.exp(.3 * sigma * noise[:, 1])
+            fields = {'Open': open_,
+                      'High': np.maximum(open_, close) * np.exp(np.abs(.5 * sigma * noise[:, 2])),
+                      'Low': np.minimum(open_, close) * np.exp(-np.abs(.5 * sigma * noise[:, 3])),
+                      'Close': close,
+                      'Adj Close': close * np.exp(-p['dividend_yield'] * years_left),
+                      'Volume': np.round(p['shares'] * np.exp(.3 * noise[:, 4] + 10 * np.abs(log_returns)))}
+            ## only the days in the range, since the listing
+            lo = max(first, listed)
+            for field in price_fields:
+                pieces[field].append(fields[field][lo:])
+            date_codes.append(np.arange(lo - first, len(dates)))
+            ticker_codes.append(np.full(len(days) - lo, j))
+        ## and then sorted by date (and ticker), like the price store
+        date_codes = np.concatenate(date_codes) if tickers else np.empty(0, dtype = np.int64)
+        order = np.argsort(date_codes, kind = 'stable')
+        index = pd.MultiIndex(levels = [dates, pd.Index(tickers)],
+                              codes = [date_codes[order], np.concatenate(ticker_codes)[order] if tickers else []],
+                              names = ['date', 'ticker'])
+        data = {}
+        for field in price_fields:
+            data[field] = np.concatenate(pieces.pop(field))[order] if tickers else np.empty(0)
+        return pd.DataFrame(data, index = index)
+
+    ## the monthly factors up to the last full month
+    ## the market factor is the synthetic market's monthly return
+    ## and the others are independent monthly draws
+    def factors(self, start = '2010'):
+        days = pd.bdate_range(self.epoch, pd.Timestamp(dt.date.today()))
+        market = pd.Series(self._market_returns(len(days)), index = days)
+        factor_data = pd.DataFrame({'Mkt-RF': np.expm1(market.resample('M').sum()) - .002})
+        rng = np.random.default_rng([self.seed, 1])
+        for name, volatility in zip(factor_fields[1:], [.03, .03, .02, .02]):
+            factor_data[name] = volatility * rng.standard_normal(len(factor_data))
+        factor_data = factor_data.iloc[:-1]
+        factor_data = factor_data[factor_data.index >= pd.Timestamp(start)]
+        factor_data.index.name = 'date'
+        return factor_data
+
+    ## intraday bars of a ticker, n_bars of them from the start day on
+    ## the bars of a day go from the day's open to its close
+    ## (a brownian bridge between the two)
+    ## with the volume higher at the open and the close
+    def intraday(self, ticker, n_bars, start = '2021-01-04', freq = '5min', bars_per_day = 78):
+        n_days = -(-n_bars // bars_per_day)
+        days = pd.bdate_range(start, periods = n_days)
+        daily = self.prices(ticker, days[0], days[-1] + pd.Timedelta(days = 1)).xs(ticker, level = 'ticker').reindex(days)
+        daily = daily.ffill().bfill()
+        rng = np.random.default_rng([self.seed, zlib.crc32(ticker.encode()), 2])
+        day_open = daily['Open'].to_numpy()[:, None]
+        day_close = daily['Close'].to_numpy()[:, None]
+        sigma = np.log(daily['High'] / daily['Low']).to_numpy()[:, None] / np.sqrt(bars_per_day)
+        walk = np.cumsum(sigma * rng.standard_normal((n_days, bars_per_day)), axis = 1)
+        t = np.arange(1, bars_per_day + 1) / bars_per_day
+        log_close = walk - t * (walk[:, -1:] - np.log(day_close / day_open))
+        close = day_open * np.exp(log_close)
+        open_ = np.concatenate([day_open, close[:, :-1]], axis = 1)
+        high = np.maximum(open_, close) * np.exp(np.abs(.5 * sigma * rng.standard_normal(close.shape)))
+        low = np.minimum(open_, close) * np.exp(-np.abs(.5 * sigma * rng.standard_normal(close.shape)))
+        u_shape = 1 + 2 * (2 * t - 1)**2
+        volume = np.round(daily['Volume'].to_numpy()[:, None] * u_shape / u_shape.sum()
+                          * np.exp(.3 * rng.standard_normal(close.shape)))
+        session = pd.Timedelta(hours = 9, minutes = 30) + pd.to_timedelta(np.arange(bars_per_day) * pd.Timedelta(freq))
+        index = pd.DatetimeIndex((days.values[:, None] + session.values[None, :]).ravel(), name = 'datetime')
+        bars = pd.DataFrame({'open': open_.ravel(),
+                             'high': high.ravel(),
+                             'low': low.ravel(),
+                             'close': close.ravel(),
+                             'volume': volume.ravel()}, index = index)
+        return bars.iloc[:n_bars]
+
+    ## twitter activity of the universe, like data/sentiment_data.csv
+    ## n_rows of (date, symbol) rows between start and end
+    ## the popular symbols get more posts, and the comments and likes follow the posts
+    def sentiment(self, n_rows, start, end):
+        days = pd.bdate_range(start, end)
+        symbols = self.constituents()
+        per_day = min(len(symbols), -(-n_rows // len(days)))
+        symbols = symbols[:per_day]
+        rng = np.random.default_rng([self.seed, 3])
+        popularity = np.exp(rng.normal(5, 1.2, per_day))
+        shape = (len(days), per_day)
+        posts = np.round(popularity * np.exp(.5 * rng.standard_normal(shape))) + 21
+        comments = np.round(posts * np.exp(rng.normal(1.5, 1.5, shape)))
+        likes = np.round(comments * np.exp(rng.normal(1.5, 1, shape)))
+        impressions = np.round(posts * np.exp(rng.normal(8.5, 1, shape)))
+        sentiment = np.clip(rng.normal(.54, .07, shape), 0, 1)
+        data = pd.DataFrame({'date': np.repeat(days.strftime('%Y-%m-%d'), per_day),
+                             'symbol': np.tile(symbols, len(days)),
+                             'twitterPosts': posts.ravel(),
+                             'twitterComments': comments.ravel(),
+                             'twitterLikes': likes.ravel(),
+                             'twitterImpressions': impressions.ravel(),
+                             'twitterSentiment': sentiment.ravel()})
+        return data.iloc[:n_rows]
+
+sources = {'yahoo': YahooSource, 'synthetic': SyntheticSource}
+
+## the source the scripts use
+## from the MARKET_DATA_SOURCE environment variable (yahoo by default)
+## the synthetic source also reads MARKET_DATA_SEED and MARKET_DATA_TICKERS
+def get_source(name = None):
+    name = name or os.environ.get('MARKET_DATA_SOURCE', 'yahoo')
+    if name not in sources:
+        raise ValueError(f'unknown market data source {name}, use one of {list(sources)}')
+    if name == 'synthetic':
+        return SyntheticSource(seed = int(os.environ.get('MARKET_DATA_SEED', 0)),
+                               n_tickers = int(os.environ.get('MARKET_DATA_TICKERS', 500)))
+    return sources[name]()
@@ -0,0 +1,100 @@
+## Monthly KMeans Clustering
+## the per-month clustering of algorithmicTrading.py
+## with warm starts: every month can start from
+## the previous month's converged centroids
+## which needs fewer iterations and keeps the labels stable
+## (cluster 3 stays the high RSI cluster from month to month)
+## the months are split into contiguous segments
+## that run in parallel in the worker pool,
+## the first month of each segment starts from the initial centroids
+## and the rest carry the centroids over
+## the number of segments is fixed (default_segments), not the number of cores
+## so the labels are the same on any machine and with any number of workers
+## packages required for this module
+## pandas, numpy, sklearn
+import os
+import numpy as np
+import pandas as pd
+from workerPool import process_pool
+
+## the number of chains of months, whatever the number of workers
+default_segments = 8
+
+## fitting the months of one segment, in order
+## it runs in the workers, so it only gets numpy arrays
+## init is the initial centroids array (or 'random', 'k-means++')
+def fit_segment(months, init, n_clusters, warm_start = True, random_state = 0):
+    from sklearn.cluster import KMeans
+    results = []
+    centroids = None
+    for X in months:
+        if len(X) < n_clusters:
+            ## not enough stocks to form the clusters
+            results.append({'labels': None, 'inertia': np.nan, 'n_iter': 0, 'init': 'skipped'})
+            continue
+        if warm_start and centroids is not None:
+            seed, seed_name = centroids, 'previous'
+        else:
+            seed, seed_name = init, 'initial'
+        ## a given set of centroids is a single run
+        ## and the named inits keep sklearn's default number of runs
+        model = KMeans(n_clusters = n_clusters,
+                       random_state = random_state,
+                       init = seed,
+                       n_init = 'auto' if isinstance(seed, str) else 1).fit(X)
+        centroids = model.cluster_centers_
+        results.append({'labels': model.labels_,
+                        'inertia': model.inertia_,
+                        'n_iter': model.n_iter_,
+                        'init': seed_name})
+    return results
+
+## data is the (date, ticker) feature df, without missing values
+## init is the initial centroids (n_clusters x n_features)
+## or one of sklearn's init names
+## n_segments is how many independent chains of months to run
+## (one per month without warm starts)
+## and max_workers only how many of them run at the same time
+## it returns the data with the cluster column
+## and a per-month table of inertia and iteration counts
+def cluster_months(data, init, n_clusters = None, warm_start = True, n_segments = default_segments,
+                   max_workers = None, random_state = 0):
+    if n_clusters is None:
+        n_clusters = len(init)
+    dates, date_codes = np.unique(data.index.get_level_values('date'), return_inverse = True)
+    order = np.argsort(date_codes, kind = 'stable')
+    bounds = np.searchsorted(date_codes[order], np.arange(len(dates) + 1))
+    values = data.to_numpy(dtype = np.float64)[order]
+    months = [values[bounds[i]:bounds[i + 1]] for i in range(len(dates))]
+
+    ## without warm starts every month is independent
+    if not warm_start:
+        n_segments = len(months)
+    segments = [list(s) for s in np.array_split(np.arange(len(months)), min(n_segments, len(months))) if len(s)]
+    args = [([months[i] for i in segment], init, n_clusters, warm_start, random_state) for segment in segments]
+    if max_workers == 1 or len(segments) == 1:
+        fitted = [fit_segment(*a) for a in args]
+    else:
+        with process_pool(max_workers = max_workers) as pool:
+            fitted = list(pool.map(fit_segment, *zip(*args), chunksize = max(1, len(args) // (4 * (max_workers or os.cpu_count() or 1)))))
+
+    labels = np.full(len(values), -1)
+    stats = {}
+    for segment, results in zip(segments, fitted):
+        for i, result in zip(segment, results):
+            if result['labels'] is not None:
+                labels[bounds[i]:bounds[i + 1]] = result['labels']
+            stats[dates[i]] = {'n_stocks': len(months[i]),
+                               'inertia': result['inertia'],
+                               'n_iter': result['n_iter'],
+                               'init': result['init']}
+    ## putting the labels back in the original row order
+    clusters = np.empty_like(labels)
+    clusters[order] = labels
+    clustered = data.copy()
+    clustered['cluster'] = clusters
+    ## and dropping the months we couldn't cluster
+    clustered = clustered[clustered['cluster'] >= 0]
+    stats_df = pd.DataFrame.from_dict(stats, orient = 'index')
+    stats_df.index.name = 'date'
+    return clustered, stats_df
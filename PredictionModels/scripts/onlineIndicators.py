@@ -0,0 +1,130 @@
+## Online Intraday Indicators
+## the intraday part of intradayTrading.py (the RSI, the Bollinger Bands,
+## the intraday signal and the position of the day) one 5-min bar at a time
+## for live trading, instead of recomputing pandas_ta over the whole final_df for every bar
+## every indicator keeps a small state:
+## the RSI the Wilder smoothing of the gains and the losses (and the last close)
+## and the Bands the last `length` closes with the rolling sums of the mean and the variance
+## so a bar costs the same, however long the history is
+## the updates are the kernels of incrementalUpdate.py (the indicator engine's, one row at a time)
+## so replaying the bars gives exactly the values of the batch version
+## (the rolling sums are pandas' compensated add/remove updates, not a plain sum and sum of squares
+## which would drift from rolling().mean() and var() in the last digits)
+## the states are arrays, so one object can also follow n symbols that share the bar times
+## e.g.
+## strategy = OnlineIntradayStrategy()
+## for timestamp, bar in live_bars:
+##     out = strategy.update(timestamp, bar['close'], signal_daily)
+##     out['return'] is the position of the day so far (NaN when there's none)
+## packages required for this module
+## pandas, numpy
+import numpy as np
+import pandas as pd
+from incrementalUpdate import (ewm_state, rma_step, window_state, window_leaving,
+                               rolling_mean_state, rolling_mean_step, rolling_var_state, rolling_var_step)
+from signalRules import SignalRules
+
+## the rules of intradayTrading.py
+intraday_rules = [('rsi > 70 and close > uband', 1),
+                  ('rsi < 30 and close < lband', -1)]
+position_rules = [('signal_daily == 1 and signal_intraday == 1', -1),
+                  ('signal_daily == -1 and signal_intraday == -1', 1)]
+
+## the close of every symbol, as an array of n
+## (a float32 close stays float32, like in the column)
+def _closes(close, n):
+    close = np.asarray(close)
+    if close.dtype.kind != 'f':
+        close = close.astype(np.float64)
+    return np.broadcast_to(close, (n,))
+
+## pandas_ta.rsi(close, length)
+class OnlineRSI:
+    def __init__(self, length = 14, scalar = 100, n = 1):
+        self.length = length
+        self.scalar = scalar
+        self.n = n
+        self.prev_close = None
+        self.positive = ewm_state(n)
+        self.negative = ewm_state(n)
+
+    def update(self, close):
+        close = _closes(close, self.n)
+        prev_close = np.full_like(close, np.nan) if self.prev_close is None else self.prev_close
+        ## the change is computed in the dtype of the prices, like close.diff()
+        ## and the smoothing in float64, like ewm()
+        negative = (close - prev_close).astype(np.float64)
+        self.prev_close = close.copy()
+        positive = np.where(negative < 0, 0., negative)
+        negative = np.where(negative > 0, 0., negative)
+        self.positive, positive_avg = rma_step(self.positive, positive, self.length)
+        self.negative, negative_avg = rma_step(self.negative, negative, self.length)
+        return self.scalar * positive_avg / (positive_avg + np.abs(negative_avg))
+
+## pandas_ta.bbands(close, length, std), returning (lower, mid, upper)
+class OnlineBBands:
+    def __init__(self, length = 5, std = 2.0, ddof = 0, n = 1):
+        self.length = length
+        self.std = std
+        self.ddof = ddof
+        self.n = n
+        self.window = window_state(n, length)
+        self.mean = rolling_mean_state(n)
+        self.var = rolling_var_state(n)
+
+    def update(self, close):
+        close = _closes(close, self.n).astype(np.float64)
+        leaving = window_leaving(self.window)
+        self.mean, mid = rolling_mean_step(self.mean, leaving, close, self.length)
+        self.var, var = rolling_var_step(self.var, leaving, close, self.length, ddof = self.ddof)
+        ## the new close takes the place of the one leaving
+        self.window['buffer'][self.window['seen'] % self.length, np.arange(self.n)] = close
+        self.window['seen'] += 1
+        deviations = self.std * np.sqrt(var)
+        return mid - deviations, mid, mid + deviations
+
+## the intraday signal and the position of the day, bar by bar
+## signal_daily is the (already shifted) daily signal of the bar's day
+## the first position of a day is held for the rest of the day
+## like the groupby(pd.Grouper(freq='D')) ffill of intradayTrading.py
+class OnlineIntradayStrategy:
+    def __init__(self, rsi_length = 20, bb_length = 20, n = 1,
+                 intraday_signal = None, position_signal = None):
+        self.n = n
+        self.rsi = OnlineRSI(rsi_length, n = n)
+        self.bbands = OnlineBBands(bb_length, n = n)
+        self.intraday_signal = intraday_signal or SignalRules(intraday_rules)
+        self.position_signal = position_signal or SignalRules(position_rules)
+        self.day = None
+        self.position = np.full(n, np.nan)
+
+    ## a new bar (of every symbol)
+    ## it returns the bar's indicators, signals and position as arrays of n
+    def update(self, timestamp, close, signal_daily):
+        day = pd.Timestamp(timestamp).normalize()
+        if day != self.day:
+            self.day = day
+            self.position = np.full(self.n, np.nan)
+        bar = {'close': _closes(close, self.n),
+               'signal_daily': np.broadcast_to(np.asarray(signal_daily, dtype = np.float64), (self.n,))}
+        bar['rsi'] = self.rsi.update(bar['close'])
+        bar['lband'], _, bar['uband'] = self.bbands.update(bar['close'])
+        bar['signal_intraday'] = self.intraday_signal.values(bar)
+        bar['return_sign'] = self.position_signal.values(bar)
+        self.position = np.where(np.isnan(bar['return_sign']), self.position, bar['return_sign'])
+        bar['return'] = self.position.copy()
+        return bar
+
+## replaying the bars of a final_df (indexed by datetime, with close and signal_daily)
+## through the online strategy, one symbol
+## it returns the columns the batch version adds to it
+def replay(final_df, rsi_length = 20, bb_length = 20):
+    strategy = OnlineIntradayStrategy(rsi_length = rsi_length, bb_length = bb_length)
+    columns = ['rsi', 'lband', 'uband', 'signal_intraday', 'return_sign', 'return']
+    rows = np.empty((len(final_df), len(columns)))
+    closes = final_df['close'].to_numpy()
+    signals = final_df['signal_daily'].to_numpy()
+    for i, timestamp in enumerate(final_df.index):
+        bar = strategy.update(timestamp, closes[i:i + 1], signals[i])
+        rows[i] = [bar[c][0] for c in columns]
+    return pd.DataFrame(rows, index = final_df.index, columns = columns)
@@ -0,0 +1,167 @@
+## Compact 3-D Panel
+## the (date, ticker) data of algorithmicTrading.py as one
+## contiguous (field, date, ticker) float32 array
+## with the dates and the tickers as the axes
+## instead of a long MultiIndex df that gets unstacked and stacked
+## (and copied, and re-indexed) for every monthly or rolling step
+## resampling, rolling means and the cross-sectional ranks
+## work on the array directly
+## and the panel only goes back to pandas at the end
+## a missing (date, ticker) is NaN, like in the unstacked df
+## packages required for this module
+## pandas, numpy
+import numpy as np
+import pandas as pd
+from indicatorEngine import rolling_mean as _rolling_mean
+
+class Panel:
+    ## values is the (field, date, ticker) array
+    def __init__(self, values, fields, dates, tickers):
+        self.values = values
+        self.fields = pd.Index(fields)
+        self.dates = pd.DatetimeIndex(dates, name = 'date')
+        self.tickers = pd.Index(tickers, name = 'ticker')
+
+    ## from the long (date, ticker) df
+    ## the columns are copied one at a time
+    ## so only one wide column is ever in memory besides the panel
+    @classmethod
+    def from_long(cls, df, fields = None, dtype = np.float32):
+        fields = list(df.columns) if fields is None else list(fields)
+        date_codes, dates = pd.factorize(df.index.get_level_values('date'), sort = True)
+        ticker_codes, tickers = pd.factorize(df.index.get_level_values('ticker'), sort = True)
+        values = np.full((len(fields), len(dates), len(tickers)), np.nan, dtype = dtype)
+        for i, field in enumerate(fields):
+            values[i, date_codes, ticker_codes] = df[field].to_numpy(dtype = dtype)
+        return cls(values, fields, dates, tickers)
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    ## the date x ticker array of a field (a view)
+    def array(self, field):
+        return self.values[self.fields.get_loc(field)]
+
+    ## a panel with only some of the fields
+    def select(self, fields):
+        return Panel(self.values[self.fields.get_indexer(fields)], fields, self.dates, self.tickers)
+
+    ## a panel with the fields added (or replaced)
+    ## fields is {name: date x ticker array}
+    def assign(self, **fields):
+        new_fields = [f for f in fields if f not in self.fields]
+        values = np.empty((len(self.fields) + len(new_fields), len(self.dates), len(self.tickers)),
+                          dtype = self.values.dtype)
+        values[:len(self.fields)] = self.values
+        all_fields = self.fields.append(pd.Index(new_fields))
+        for name, array in fields.items():
+            values[all_fields.get_loc(name)] = array
+        return Panel(values, all_fields, self.dates, self.tickers)
+
+    ## keeping some of the dates and tickers
+    ## dates and tickers are boolean masks or positions
+    def take(self, dates = None, tickers = None):
+        values, new_dates, new_tickers = self.values, self.dates, self.tickers
+        if dates is not None:
+            values, new_dates = values[:, dates], new_dates[dates]
+        if tickers is not None:
+            values, new_tickers = values[:, :, tickers], new_tickers[tickers]
+        return Panel(np.ascontiguousarray(values), self.fields, new_dates, new_tickers)
+
+    ## setting every field of the (date, ticker) to NaN where mask is False
+    ## the same as dropping those rows from the long df
+    def where(self, mask):
+        return Panel(np.where(mask[None], self.values, np.nan).astype(self.values.dtype, copy = False),
+                     self.fields, self.dates, self.tickers)
+
+    ## the (date, ticker) cells where every field has a value
+    def complete(self):
+        return ~np.isnan(self.values).any(axis = 0)
+
+    ## resampling the dates, e.g. to the month end with rule 'M'
+    ## how is {field: 'last' or 'mean'}, and the other fields are dropped
+    ## like pandas, 'last' is the last value that isn't missing
+    ## and the means are summed in float64
+    def resample(self, rule, how):
+        counts = pd.Series(1, index = self.dates).resample(rule).count()
+        starts = np.concatenate([[0], np.cumsum(counts.to_numpy())[:-1]])
+        ends = starts + counts.to_numpy()
+        fields = list(how)
+        values = np.full((len(fields), len(counts), len(self.tickers)), np.nan, dtype = self.values.dtype)
+        non_empty = counts.to_numpy() > 0
+        for i, field in enumerate(fields):
+            x = self.array(field)
+            valid = ~np.isnan(x)
+            if how[field] == 'last':
+                ## the position of the latest value up to every date
+                latest = np.where(valid, np.arange(len(x))[:, None], -1)
+                np.maximum.accumulate(latest, axis = 0, out = latest)
+                last = latest[np.maximum(ends - 1, 0)]
+                found = (last >= starts[:, None]) & non_empty[:, None]
+                values[i][found] = x[last[found], np.nonzero(found)[1]]
+            elif how[field] == 'mean':
+                total = np.add.reduceat(np.where(valid, x, 0).astype(np.float64), starts[non_empty], axis = 0)
+                count = np.add.reduceat(valid.astype(np.int64), starts[non_empty], axis = 0)
+                with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                    values[i][non_empty] = np.where(count > 0, total / count, np.nan)
+            else:
+                raise ValueError(f'unknown aggregation {how[field]} for {field}')
+        return Panel(values, fields, counts.index, self.tickers)
+
+    ## the rolling mean of a field over the dates, for every ticker
+    ## the same as the unstacked df's rolling(window, min_periods).mean()
+    def rolling_mean(self, field, window, min_periods = None):
+        return _rolling_mean(self.array(field).astype(np.float64), window, min_periods = min_periods)
+
+    ## ranking the tickers of every date by a field
+    def rank(self, field, ascending = True):
+        return rank_rows(self.array(field), ascending = ascending)
+
+    ## dropping the dates without any value
+    def drop_empty_dates(self):
+        return self.take(dates = ~np.isnan(self.values).all(axis = (0, 2)))
+
+    ## the date x ticker df of a field
+    def to_wide(self, field):
+        return pd.DataFrame(self.array(field), index = self.dates, columns = self.tickers)
+
+    ## back to the long (date, ticker) df
+    ## with the (date, ticker) rows that have any value, like stack()
+    ## or only the ones in mask
+    def to_long(self, fields = None, mask = None):
+        fields = list(self.fields) if fields is None else list(fields)
+        idx = self.fields.get_indexer(fields)
+        if mask is None:
+            mask = ~np.isnan(self.values[idx]).all(axis = 0)
+        date_pos, ticker_pos = np.nonzero(mask)
+        index = pd.MultiIndex(levels = [self.dates, self.tickers],
+                              codes = [date_pos, ticker_pos],
+                              names = ['date', 'ticker'])
+        return pd.DataFrame({field: self.values[i][mask] for field, i in zip(fields, idx)}, index = index)
+
+## ranking the columns of every row of a date x ticker array
+## the same as groupby(level='date').rank(), average ranks for ties
+## and missing values are not ranked
+def rank_rows(x, ascending = True):
+    x = np.asarray(x, dtype = np.float64)
+    key = x if ascending else -x
+    ## NaNs sort to the end of every date
+    order = np.argsort(key, axis = 1, kind = 'stable')
+    s = np.take_along_axis(key, order, axis = 1)
+    n_dates, n_tickers = s.shape
+    ## the groups of equal values, they never cross dates
+    new_group = np.ones_like(s, dtype = bool)
+    new_group[:, 1:] = s[:, 1:] != s[:, :-1]
+    group = np.cumsum(new_group.ravel()) - 1
+    position = np.tile(np.arange(n_tickers), n_dates)
+    first = position[new_group.ravel()]
+    size = np.bincount(group)
+    sorted_ranks = (first[group] + (size[group] - 1) / 2 + 1).reshape(n_dates, n_tickers)
+    ranks = np.empty_like(sorted_ranks)
+    np.put_along_axis(ranks, order, sorted_ranks, axis = 1)
+    ranks[np.isnan(x)] = np.nan
+    return ranks
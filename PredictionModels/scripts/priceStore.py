@@ -0,0 +1,206 @@
+## Local Columnar Price Store
+## a small on-disk cache for the daily OHLCV prices
+## that the trading scripts keep downloading from yahoo finance
+## the prices are kept as parquet files
+## partitioned by ticker and year
+## store_path/<ticker>/<year>.parquet
+## and a coverage file that remembers which date ranges
+## we have already asked for, for every ticker
+## so a rerun only downloads the missing ranges
+## and reads everything else from the local files
+## (memory mapped, so a warm start is mostly disk reads)
+## packages required for this module
+## pandas, numpy, pyarrow, yfinance
+import os
+import json
+import datetime as dt
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+## default location of the store
+## next to the other data files of this project
+default_store_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'price_store')
+## the price fields we keep, in the same order yfinance gives them
+price_fields = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+coverage_file = '_coverage.json'
+## how many sessions back a range has to end before a ticker with no rows in it
+## is taken as having no prices there (and not as a late or failed download)
+settled_sessions = 5
+
+## the default fetcher, going to yahoo finance
+## it takes a list of tickers and a [start, end) range
+## and has to return a long df indexed by (date, ticker)
+## with the price fields as the columns
+def download_yahoo(tickers, start, end):
+    import yfinance as yf
+    raw = yf.download(tickers = list(tickers),
+                      start = start,
+                      end = end,
+                      auto_adjust = False,
+                      progress = False)
+    if raw.empty:
+        return pd.DataFrame(columns = price_fields)
+    ## a single ticker comes back with flat columns
+    ## so we add the ticker level ourselves
+    if not isinstance(raw.columns, pd.MultiIndex):
+        raw.columns = pd.MultiIndex.from_product([raw.columns, [list(tickers)[0]]])
+    data = raw.stack(dropna = False).dropna(how = 'all')
+    data.index.names = ['date', 'ticker']
+    return data
+
+## helpers to work with the [start, end) date ranges
+## all the ranges are kept as normalized timestamps
+def _to_day(x):
+    return pd.Timestamp(x).normalize()
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def _missing_ranges(covered, start, end):
+    ## walk through the covered ranges
+    ## and collect the gaps between start and end
+    missing = []
+    cursor = start
+    for c_start, c_end in covered:
+        if c_end <= cursor:
+            continue
+        if c_start >= end:
+            break
+        if c_start > cursor:
+            missing.append((cursor, min(c_start, end)))
+        cursor = max(cursor, c_end)
+        if cursor >= end:
+            break
+    if cursor < end:
+        missing.append((cursor, end))
+    return missing
+
+class PriceStore:
+    ## the store only needs a folder
+    ## and a function to fetch whatever is missing
+    def __init__(self, store_path = default_store_path, fetch = download_yahoo):
+        self.store_path = store_path
+        self.fetch = fetch
+        os.makedirs(self.store_path, exist_ok = True)
+        self.coverage = self._load_coverage()
+
+    def _load_coverage(self):
+        path = os.path.join(self.store_path, coverage_file)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            raw = json.load(f)
+        return {ticker: [[_to_day(s), _to_day(e)] for s, e in ranges] for ticker, ranges in raw.items()}
+
+    def _save_coverage(self):
+        raw = {ticker: [[s.strftime('%Y-%m-%d'), e.strftime('%Y-%m-%d')] for s, e in ranges]
+               for ticker, ranges in self.coverage.items()}
+        path = os.path.join(self.store_path, coverage_file)
+        ## write to a temp file first
+        ## so a crash never leaves a half written coverage file
+        with open(path + '.tmp', 'w') as f:
+            json.dump(raw, f)
+        os.replace(path + '.tmp', path)
+
+    def _partition_path(self, ticker, year):
+        return os.path.join(self.store_path, ticker, f'{year}.parquet')
+
+    def _write(self, data):
+        ## data is a long df indexed by (date, ticker)
+        ## and we merge it into the ticker/year files
+        if data.empty:
+            return
+        data = data.reindex(columns = price_fields).astype('float64')
+        for ticker, ticker_df in data.groupby(level = 'ticker'):
+            ticker_df = ticker_df.droplevel('ticker')
+            for year, year_df in ticker_df.groupby(ticker_df.index.year):
+                path = self._partition_path(ticker, year)
+                os.makedirs(os.path.dirname(path), exist_ok = True)
+                if os.path.exists(path):
+                    old_df = pq.read_table(path).to_pandas()
+                    year_df = pd.concat([old_df, year_df])
+                    year_df = year_df[~year_df.index.duplicated(keep = 'last')]
+                year_df = year_df.sort_index()
+                year_df.index.name = 'date'
+                pq.write_table(pa.Table.from_pandas(year_df), path + '.tmp')
+                os.replace(path + '.tmp', path)
+
+    def _read(self, ticker, start, end):
+        ## reading only the years we need
+        ## with memory mapping on
+        tables = []
+        for year in range(start.year, end.year + 1):
+            path = self._partition_path(ticker, year)
+            if os.path.exists(path):
+                tables.append(pq.read_table(path, memory_map = True))
+        if not tables:
+            return None
+        ticker_df = pa.concat_tables(tables).to_pandas()
+        ticker_df = ticker_df[(ticker_df.index >= start) & (ticker_df.index < end)]
+        ticker_df['ticker'] = ticker
+        return ticker_df
+
+    def refresh(self, tickers, start, end):
+        ## we only fetch what is not covered yet
+        ## and we group the tickers with the same gaps
+        ## so they can go in a single batched download
+        start, end = _to_day(start), _to_day(end)
+        ## there's nothing to fetch after today
+        ## and today's bar is still moving until the close
+        ## so it's fetched, but never marked as covered (a rerun fetches it again)
+        today = _to_day(dt.date.today())
+        end = min(end, today + pd.Timedelta(days = 1))
+        gaps = {}
+        for ticker in tickers:
+            for gap in _missing_ranges(self.coverage.get(ticker, []), start, end):
+                gaps.setdefault(gap, []).append(ticker)
+        for (gap_start, gap_end), gap_tickers in gaps.items():
+            data = self.fetch(gap_tickers, gap_start, gap_end)
+            self._write(data)
+            ## a ticker's range is covered only when the fetch worked for it:
+            ## it came back with rows for the ticker, or the batch came back with rows
+            ## and the range ended a few sessions ago (a ticker with no prices there,
+            ## like a listing that starts later), so a failed download is fetched again
+            covered_end = min(gap_end, today)
+            if gap_start >= covered_end:
+                continue
+            fetched = set() if data.empty else set(data.index.get_level_values('ticker'))
+            settled = not data.empty and gap_end <= today - pd.offsets.BDay(settled_sessions)
+            for ticker in gap_tickers:
+                if ticker not in fetched and not settled:
+                    continue
+                ranges = self.coverage.get(ticker, []) + [[gap_start, covered_end]]
+                self.coverage[ticker] = _merge_ranges(ranges)
+            self._save_coverage()
+        return self
+
+    def load(self, tickers, start, end):
+        start, end = _to_day(start), _to_day(end)
+        frames = [self._read(ticker, start, end) for ticker in tickers]
+        frames = [f for f in frames if f is not None and not f.empty]
+        if not frames:
+            empty_index = pd.MultiIndex.from_arrays([[], []], names = ['date', 'ticker'])
+            return pd.DataFrame(index = empty_index, columns = price_fields, dtype = 'float64')
+        data = pd.concat(frames).set_index('ticker', append = True)
+        data.index.names = ['date', 'ticker']
+        return data.sort_index()
+
+## the single call the scripts use
+## it returns a long df indexed by (date, ticker)
+## with the yfinance column names
+## like `yf.download(...).stack()` does
+## and end is exclusive, the same as yf.download
+def get_prices(tickers, start, end, store_path = default_store_path, fetch = download_yahoo):
+    if isinstance(tickers, str):
+        tickers = [tickers]
+    tickers = list(dict.fromkeys(tickers))
+    store = PriceStore(store_path = store_path, fetch = fetch)
+    store.refresh(tickers, start, end)
+    return store.load(tickers, start, end)
@@ -0,0 +1,73 @@
+## Vectorized Lagged Returns
+## the monthly return features of algorithmicTrading.py
+## for every lag and every ticker at once
+## instead of calculate_return running once per ticker in a groupby
+## the returns of all the lags go into one (lag, date, ticker) array
+## on the same packed layout as the indicator engine
+## the outlier quantiles of every (lag, ticker) come from one sort
+## of that array along the dates (the NaNs sort to the end)
+## and are interpolated the same way Series.quantile does
+## so the results match the per-ticker version
+## packages required for this module
+## pandas, numpy
+import numpy as np
+import pandas as pd
+from indicatorEngine import packed_positions, pack, unpack
+
+## the q quantile of every column of x along axis 1, skipping NaNs
+## x is sorted along axis 1 (NaNs at the end)
+## and n is the number of values in every column
+## the same 'linear' interpolation as np.percentile, which pandas uses
+def sorted_quantile(x, n, q):
+    ## pandas passes the quantile to np.percentile as a percentage
+    q = np.true_divide(np.asarray(q, dtype = np.float64) * 100.0, 100)
+    virtual = (n - 1) * q
+    previous = np.floor(virtual)
+    gamma = virtual - previous
+    previous = np.clip(previous, 0, np.maximum(n - 1, 0)).astype(np.intp)
+    following = np.minimum(previous + 1, np.maximum(n - 1, 0))
+    a = np.take_along_axis(x, previous[:, None], axis = 1)[:, 0]
+    b = np.take_along_axis(x, following[:, None], axis = 1)[:, 0]
+    diff_b_a = b - a
+    result = np.where(gamma >= 0.5, b - diff_b_a * (1 - gamma), a + diff_b_a * gamma)
+    return np.where(n > 0, result, np.nan)
+
+## data is the long (date, ticker) df
+## it returns the return_{lag}m columns on the same index:
+## the lag-month return of the column, clipped to the
+## [outlier_cutoff, 1 - outlier_cutoff] quantiles of each ticker
+## and then turned into a monthly (geometric average) return
+def lagged_returns(data, lags = [1,2,3,6,9,12], outlier_cutoff = 0.005, column = 'adj close'):
+    rows, dates = pd.factorize(data.index.get_level_values('date'), sort = True)
+    cols, tickers = pd.factorize(data.index.get_level_values('ticker'), sort = True)
+    positions, counts = packed_positions(rows, cols, len(dates), len(tickers))
+    prices = pack(data[column].to_numpy(dtype = np.float64), positions, cols, counts)
+    ## filling the missing prices with the ticker's previous one
+    ## like pct_change does (but not the padding below the ticker's rows)
+    n_rows = prices.shape[0]
+    latest = np.where(np.isnan(prices), 0, np.arange(n_rows)[:, None])
+    np.maximum.accumulate(latest, axis = 0, out = latest)
+    prices = np.where(np.arange(n_rows)[:, None] < counts[None, :],
+                      prices[latest, np.arange(len(tickers))[None, :]], np.nan)
+
+    returns = np.full((len(lags), n_rows, len(tickers)), np.nan)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        for i, lag in enumerate(lags):
+            returns[i, lag:] = prices[lag:] / prices[:-lag] - 1
+
+    ## the quantiles of every (lag, ticker)
+    flat = np.sort(returns.transpose(0, 2, 1).reshape(-1, n_rows), axis = 1)
+    n = (~np.isnan(flat)).sum(axis = 1)
+    lower = sorted_quantile(flat, n, outlier_cutoff).reshape(len(lags), 1, len(tickers))
+    upper = sorted_quantile(flat, n, 1-outlier_cutoff).reshape(len(lags), 1, len(tickers))
+    ## clipping, NaN bounds (a ticker without returns) don't clip
+    returns = np.where(returns < lower, lower, returns)
+    returns = np.where(returns > upper, upper, returns)
+    ## one lag at a time, with a scalar power like Series.pow
+    ## (numpy has exact fast paths for the 1 and 1/2 powers)
+    for i, lag in enumerate(lags):
+        returns[i] = (returns[i] + 1) ** (1/lag) - 1
+
+    return pd.DataFrame(np.column_stack([unpack(returns[i], positions, cols) for i in range(len(lags))]),
+                        index = data.index,
+                        columns = [f'return_{lag}m' for lag in lags])
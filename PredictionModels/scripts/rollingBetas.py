@@ -0,0 +1,79 @@
+## Batched Rolling Factor Betas
+## the rolling regression of every ticker's return
+## on the Fama-French factors, for all the tickers at once
+## instead of one statsmodels RollingOLS per ticker
+## we keep running sums of X'X and X'y along the time axis
+## take the window sums as differences of the running sums
+## and then solve all the small (factors + 1) x (factors + 1)
+## systems in a single stacked solve
+## packages required for this module
+## pandas, numpy
+import numpy as np
+import pandas as pd
+## using the same packed layout as the indicator engine
+from indicatorEngine import packed_positions, pack, unpack
+
+## data is the long (date, ticker) df
+## with the return column and the factor columns
+## window is the max window, and a ticker with fewer rows
+## uses all of its rows, the same as window = min(24, x.shape[0])
+## min_nobs is the least number of rows in a window to give a beta
+## (it defaults to the number of params, like RollingOLS)
+def rolling_betas(data, endog = 'return_1m', window = 24, min_nobs = None):
+    exog_cols = [c for c in data.columns if c != endog]
+    ## the constant plus the factors
+    k = len(exog_cols) + 1
+    min_nobs = k if min_nobs is None else min_nobs
+
+    rows, dates = pd.factorize(data.index.get_level_values('date'), sort = True)
+    cols, tickers = pd.factorize(data.index.get_level_values('ticker'), sort = True)
+    positions, counts = packed_positions(rows, cols, len(dates), len(tickers))
+    ## y is (date, ticker) and X is (date, ticker, param)
+    y = pack(data[endog].to_numpy(dtype = np.float64), positions, cols, counts)
+    X = np.ones(y.shape + (k,))
+    for i, col in enumerate(exog_cols):
+        X[:, :, i + 1] = pack(data[col].to_numpy(dtype = np.float64), positions, cols, counts)
+    ## the padding and any missing row add nothing to the sums
+    valid = ~np.isnan(y) & ~np.isnan(X).any(axis = 2)
+    y = np.where(valid, y, 0.)
+    X = np.where(valid[:, :, None], X, 0.)
+
+    ## running sums with a row of zeros on top
+    ## so the sum over rows [s, t] is sums[t + 1] - sums[s]
+    def running_sum(x):
+        out = np.zeros((x.shape[0] + 1,) + x.shape[1:])
+        np.cumsum(x, axis = 0, out = out[1:])
+        return out
+    xpx_sum = running_sum(X[:, :, :, None] * X[:, :, None, :])
+    xpy_sum = running_sum(X * y[:, :, None])
+    nobs_sum = running_sum(valid.astype(np.int64))
+
+    ## the window of every ticker
+    ## and where each window starts
+    windows = np.minimum(window, counts)
+    n_rows = y.shape[0]
+    end = np.broadcast_to(np.arange(n_rows)[:, None] + 1, (n_rows, len(tickers)))
+    start = end - windows[None, :]
+    ticker_index = np.broadcast_to(np.arange(len(tickers)), start.shape)
+    ## a beta needs a full window inside the ticker's own rows
+    ## with enough observations in it
+    ready = (start >= 0) & (end <= counts[None, :]) & (windows[None, :] >= min_nobs)
+    start = np.where(ready, start, 0)
+    nobs = nobs_sum[end, ticker_index] - nobs_sum[start, ticker_index]
+    ready &= nobs >= min_nobs
+
+    xpx = xpx_sum[end[ready], ticker_index[ready]] - xpx_sum[start[ready], ticker_index[ready]]
+    xpy = xpy_sum[end[ready], ticker_index[ready]] - xpy_sum[start[ready], ticker_index[ready]]
+    ## the stacked solve of all the windows
+    ## and the pseudo inverse if any of them is singular
+    try:
+        solved = np.linalg.solve(xpx, xpy[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        solved = (np.linalg.pinv(xpx) @ xpy[:, :, None])[:, :, 0]
+    params = np.full(y.shape + (k,), np.nan)
+    params[ready] = solved
+
+    ## dropping the constant and going back to the long index
+    return pd.DataFrame(np.column_stack([unpack(params[:, :, i + 1], positions, cols) for i in range(len(exog_cols))]),
+                        index = data.index,
+                        columns = exog_cols)
@@ -0,0 +1,67 @@
+## Streaming Sentiment Aggregation
+## the monthly engagement ratio of sentimentTrading.py
+## (the mean of comments / likes of every symbol and month, for the active rows only)
+## without loading the whole twitter dataset
+## the csv is read in chunks, with only the columns we need and their dtypes
+## the likes/comments filter is applied to every chunk as it's read
+## and the chunk is reduced to a sum and a count per (month, symbol)
+## which are added to running totals
+## so the memory depends on the number of months x symbols, not on the number of rows
+## (and there's no dense date x symbol frame, like the unstack and resample of the original)
+## the means are the same as the resample's, except maybe in the last digit
+## when a (month, symbol) spans two chunks (its sum is then added up in two parts)
+## packages required for this module
+## pandas, numpy
+import numpy as np
+import pandas as pd
+
+columns = {'date': str, 'symbol': str, 'twitterComments': np.float64, 'twitterLikes': np.float64}
+
+## the running sums and counts of the engagement ratio per (month, symbol)
+## rows with no more than min_likes likes or min_comments comments are left out
+class EngagementAccumulator:
+    def __init__(self, min_likes = 20, min_comments = 5):
+        self.min_likes = min_likes
+        self.min_comments = min_comments
+        self.totals = None
+        self.rows = 0
+        self.kept = 0
+
+    ## adding a chunk of rows (a df with the columns above)
+    def add(self, chunk):
+        likes = chunk['twitterLikes'].to_numpy(dtype = np.float64)
+        comments = chunk['twitterComments'].to_numpy(dtype = np.float64)
+        ## then we want to filter out
+        ## low likes/comments stocks
+        keep = (likes > self.min_likes) & (comments > self.min_comments)
+        self.rows += len(chunk)
+        self.kept += int(keep.sum())
+        if not keep.any():
+            return
+        months = pd.to_datetime(chunk['date'].to_numpy()[keep]).to_numpy().astype('datetime64[M]')
+        rows = pd.DataFrame({'month': months,
+                             'symbol': chunk['symbol'].to_numpy()[keep],
+                             ## the engagement ratio, comments by likes
+                             'engagement_ratio': comments[keep] / likes[keep]})
+        totals = rows.groupby(['month', 'symbol'], sort = False)['engagement_ratio'].agg(['sum', 'count'])
+        self.totals = totals if self.totals is None else self.totals.add(totals, fill_value = 0)
+
+    ## the monthly means, indexed by (month end, symbol) like resample('M').mean().stack()
+    def result(self):
+        if self.totals is None:
+            index = pd.MultiIndex.from_arrays([pd.DatetimeIndex([], name = 'date'), pd.Index([], dtype = object, name = 'symbol')])
+            return pd.DataFrame({'engagement_ratio': pd.Series([], dtype = np.float64)}, index = index)
+        totals = self.totals.sort_index()
+        months = totals.index.get_level_values('month').to_numpy().astype('datetime64[M]')
+        ## the label of a month is its last day
+        month_ends = pd.DatetimeIndex(((months + 1).astype('datetime64[D]') - np.timedelta64(1, 'D')).astype('datetime64[ns]'), name = 'date')
+        index = pd.MultiIndex.from_arrays([month_ends, totals.index.get_level_values('symbol')], names = ['date', 'symbol'])
+        return pd.DataFrame({'engagement_ratio': (totals['sum'] / totals['count']).to_numpy()}, index = index)
+
+## the monthly engagement ratios of a twitter sentiment csv
+## chunksize is the number of rows read at a time
+def monthly_engagement(data_path, chunksize = 1_000_000, min_likes = 20, min_comments = 5):
+    accumulator = EngagementAccumulator(min_likes = min_likes, min_comments = min_comments)
+    for chunk in pd.read_csv(data_path, usecols = list(columns), dtype = columns, chunksize = chunksize):
+        accumulator.add(chunk)
+    return accumulator.result()
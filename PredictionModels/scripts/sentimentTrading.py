@@ -7,25 +7,24 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import datetime as dt
-import yfinance as yf
 import os
+## the market data source (yahoo through the local price store, or the offline synthetic market)
+from marketData import get_source
+## the stage profiler (off unless STAGE_PROFILE is set)
+from stageProfiler import stage
+## and the streaming aggregation of the twitter data
+from sentimentAggregator import monthly_engagement
 plt.style.use('ggplot')
 ## path to the twitter data
 data_path = '../data/sentiment_data.csv'
-sentiment_data = pd.read_csv(data_path)
-sentiment_data['date'] = pd.to_datetime(sentiment_data['date'])
-sentiment_data = sentiment_data.set_index(['date', 'symbol'])
-## lets calculate the engagement ratio
-## by dividing the comments by likes
-## to have a way to filter
-## the bot activities
-sentiment_data['engagement_ratio'] = sentiment_data['twitterComments'].div(sentiment_data['twitterLikes'])
-## then we want to filter out
-## low likes/comments stocks
-sentiment_data = sentiment_data[(sentiment_data['twitterLikes'] > 20) & (sentiment_data['twitterComments']>5)]
-## now we want to get the monthly aggregate
-## and calculate the average sentiment for the month
-monthly_data = sentiment_data.unstack('symbol').resample('M')['engagement_ratio'].mean().stack('symbol').to_frame('engagement_ratio')
+## the monthly average of the engagement ratio (comments by likes,
+## a way to filter the bot activities) of every stock
+## leaving out the low likes/comments rows
+## the file is streamed in chunks, and every chunk is filtered
+## and added to the running monthly sums and counts of every symbol
+## so the whole dataset is never in memory
+with stage('monthly_sentiment'):
+    monthly_data = monthly_engagement(data_path, min_likes = 20, min_comments = 5)
 ## now we want to ranke the stocks based on this value
 monthly_data['rank'] = monthly_data.groupby(level=0)['engagement_ratio'].transform(lambda x:x.rank(ascending=False)) 
 ## now we want to select the top 5 stocks based on this ranking
@@ -44,7 +43,8 @@ stock_list = monthly_data.index.get_level_values('symbol').unique().tolist()
 ## get two year of data
 start_date = dt.date.today() - pd.DateOffset(months=24)
 end_date = dt.date.today()
-stock_price = yf.download(tickers = stock_list, start = start_date, end = end_date)
+with stage('download'):
+    stock_price = get_source().prices(tickers = stock_list, start = start_date, end = end_date).unstack('ticker')
 ## lets calculate the portfolio return
 returns_df = np.log(stock_price['Adj Close']).diff().dropna()
 portfolio_df = pd.DataFrame()
@@ -61,7 +61,7 @@ for day in stocks_dict:
 ## for the same timeframe
 start_date = dt.date.today() - pd.DateOffset(months=24)
 end_date = dt.date.today()
-qqq_df = yf.download(tickers = 'QQQ', start = start_date, end = end_date)
+qqq_df = get_source().prices(tickers = 'QQQ', start = start_date, end = end_date).xs('QQQ', level = 'ticker')
 ## and then calculate the NASDAQ returns
 qqq_returns = np.log(qqq_df['Adj Close']).diff().to_frame('qqq_returns').dropna()
 ## now we're ready to merge our portfolio return
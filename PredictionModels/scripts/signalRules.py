@@ -0,0 +1,81 @@
+## Declarative Signal Rules
+## the signals of intradayTrading.py as a list of rules
+## e.g. 'rsi > 70 and close > uband' -> 1, 'rsi < 30 and close < lband' -> -1
+## instead of a DataFrame.apply(lambda x: ..., axis = 1)
+## which builds a Series for every row (every 5-min bar)
+## every rule is compiled once, into comparisons of whole columns
+## and the rules are combined with np.select:
+## the first rule that holds gives the value, and no rule gives NaN
+## a comparison with a missing value doesn't hold, like in the lambdas
+## the conditions are terms joined with 'and'
+## a term is `operand op operand`, with op one of > < >= <= == !=
+## and an operand is a number, a column, or a product of them (premium_std * -1.5)
+## packages required for this module
+## pandas, numpy
+import re
+import numpy as np
+import pandas as pd
+
+_operators = {'>': np.greater, '<': np.less, '>=': np.greater_equal,
+              '<=': np.less_equal, '==': np.equal, '!=': np.not_equal}
+_term = re.compile(r'^(.+?)(>=|<=|==|!=|>|<)(.+)$')
+
+## a factor is a number, or else the name of a column
+def _factor(token):
+    token = token.strip()
+    try:
+        return float(token)
+    except ValueError:
+        if not token:
+            raise ValueError('empty operand')
+        return token
+
+def _operand(text):
+    return [_factor(token) for token in text.split('*')]
+
+def _evaluate(factors, df):
+    value = None
+    for factor in factors:
+        factor = np.asarray(df[factor]) if isinstance(factor, str) else factor
+        value = factor if value is None else value * factor
+    return value
+
+## compiling a condition into a function of a df
+## (or a dict of arrays, like the bars of onlineIndicators.py)
+## that returns the boolean mask of the rows where it holds
+def compile_condition(condition):
+    terms = []
+    for text in re.split(r'\s+and\s+', condition.strip()):
+        match = _term.match(text)
+        if match is None:
+            raise ValueError(f'cannot parse {text!r} in {condition!r}')
+        left, op, right = match.groups()
+        terms.append((_operand(left), _operators[op], _operand(right)))
+    def mask(df):
+        result = None
+        with np.errstate(invalid = 'ignore'):
+            for left, op, right in terms:
+                term = op(_evaluate(left, df), _evaluate(right, df))
+                result = term if result is None else result & term
+        return np.asarray(result, dtype = bool)
+    mask.condition = condition
+    return mask
+
+## a signal, rules is a list of (condition, value)
+## and the first condition that holds gives the signal of the row
+class SignalRules:
+    def __init__(self, rules, default = np.nan):
+        self.rules = [(compile_condition(condition), value) for condition, value in rules]
+        self.default = default
+
+    ## the signal as an array, df can also be a dict of arrays
+    def values(self, df):
+        return np.select([mask(df) for mask, _ in self.rules],
+                         [value for _, value in self.rules],
+                         default = self.default)
+
+    def __call__(self, df):
+        return pd.Series(self.values(df), index = df.index)
+
+    def __repr__(self):
+        return 'SignalRules(' + ', '.join(f'{mask.condition!r} -> {value}' for mask, value in self.rules) + ')'
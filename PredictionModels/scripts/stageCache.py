@@ -0,0 +1,195 @@
+## Content-Addressed Stage Cache
+## every stage of a pipeline is saved to disk
+## under a hash of what it was computed from:
+## the stage's name and code (its function, the helpers of the same file it calls
+## and the project modules they use), its parameters
+## and the hashes of the stages it takes as inputs
+## the raw inputs (e.g. the downloaded prices) are hashed by content
+## so changing one parameter only reruns the stages downstream of it
+## and everything upstream is read back from the cache
+## packages required for this module
+## pandas, numpy
+import os
+import ast
+import pickle
+import hashlib
+import inspect
+import numpy as np
+import pandas as pd
+from stageProfiler import stage
+
+project_path = os.path.dirname(os.path.abspath(__file__))
+default_cache_path = os.path.join(project_path, '..', 'data', 'stage_cache')
+
+## a value together with its hash
+class Artifact:
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+## hashing the content of a value
+## frames and arrays are hashed by their values
+## and everything else by its pickle
+def hash_value(value):
+    h = hashlib.sha256()
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        h.update(repr(type(value)).encode())
+        h.update(pd.util.hash_pandas_object(value, index = True).to_numpy().tobytes())
+        if isinstance(value, pd.DataFrame):
+            h.update(repr(list(value.columns)).encode())
+            h.update(repr(list(value.dtypes.astype(str))).encode())
+        h.update(repr(list(value.index.names)).encode())
+    elif isinstance(value, np.ndarray):
+        h.update(repr((value.dtype.str, value.shape)).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for k in sorted(value, key = repr):
+            h.update(repr(k).encode())
+            h.update(hash_value(value[k]).encode())
+    elif isinstance(value, (list, tuple)):
+        h.update(repr(type(value)).encode())
+        for v in value:
+            h.update(hash_value(v).encode())
+    else:
+        h.update(pickle.dumps(value, protocol = 4))
+    return h.hexdigest()
+
+## the modules of this project a file imports (anywhere in it, not only at the top)
+def _project_imports(path):
+    with open(path, 'rb') as f:
+        tree = ast.parse(f.read())
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+    return {name for name in names if os.path.exists(os.path.join(project_path, f'{name}.py'))}
+
+## the source of a file and of every project module it depends on (directly or not)
+## so a change in e.g. panelData.py or returnKernel.py invalidates the stages that use them
+def module_fingerprint(path):
+    h = hashlib.sha256()
+    seen = set()
+    pending = [os.path.abspath(path)]
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        pending.extend(os.path.join(project_path, f'{name}.py') for name in _project_imports(path))
+    for path in sorted(seen):
+        with open(path, 'rb') as f:
+            h.update(os.path.basename(path).encode())
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+## the global names a function uses, including the ones of its inner functions and lambdas
+def _code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _code_names(const)
+    return names
+
+## the code a stage depends on:
+## the sources of the stage and of the functions and classes of its own file it calls (directly or not)
+## and the files of the project modules they use
+## the rest of the stage's file (e.g. the parameters of the script's __main__ block) is left out
+## so changing a parameter only reruns the stages that take it
+def _stage_sources(fn):
+    fn = inspect.unwrap(fn)
+    own_file = os.path.abspath(inspect.getsourcefile(fn))
+    sources = {}
+    modules = set()
+    pending = [fn]
+    while pending:
+        obj = pending.pop()
+        if obj.__qualname__ in sources:
+            continue
+        sources[obj.__qualname__] = inspect.getsource(obj)
+        if inspect.isclass(obj):
+            members = [inspect.unwrap(m) for m in vars(obj).values() if inspect.isfunction(m)]
+            names = set().union(*[_code_names(m.__code__) for m in members]) if members else set()
+            scope = members[0].__globals__ if members else vars(inspect.getmodule(obj))
+        else:
+            names = _code_names(obj.__code__)
+            scope = obj.__globals__
+        for name in names:
+            value = scope.get(name)
+            if inspect.ismodule(value):
+                path = getattr(value, '__file__', None)
+            elif inspect.isfunction(value) or inspect.isclass(value):
+                value = inspect.unwrap(value)
+                try:
+                    path = inspect.getsourcefile(value)
+                except TypeError:
+                    path = None
+            else:
+                continue
+            if path is None:
+                continue
+            path = os.path.abspath(path)
+            if path == own_file and not inspect.ismodule(value):
+                pending.append(value)
+            elif os.path.dirname(path) == os.path.abspath(project_path):
+                modules.add(path)
+    return sources, modules
+
+## a change in the stage's code, or in the code it calls, should invalidate its cache too
+def function_fingerprint(fn):
+    try:
+        sources, modules = _stage_sources(fn)
+        source = ''.join(sources[name] for name in sorted(sources))
+        source += ''.join(module_fingerprint(path) for path in sorted(modules))
+    except (OSError, TypeError, SyntaxError):
+        source = repr(fn.__code__.co_code) + repr(fn.__code__.co_consts)
+    return hashlib.sha256(f'{fn.__module__}.{fn.__qualname__}\n{source}'.encode()).hexdigest()
+
+class StageCache:
+    def __init__(self, cache_path = default_cache_path, enabled = True, verbose = True):
+        self.cache_path = cache_path
+        self.enabled = enabled
+        self.verbose = verbose
+        if self.enabled:
+            os.makedirs(self.cache_path, exist_ok = True)
+
+    ## a raw input, hashed by its content
+    def source(self, name, value):
+        return Artifact(hashlib.sha256(f'{name}:{hash_value(value)}'.encode()).hexdigest(), value)
+
+    ## the key of a stage run
+    def stage_key(self, name, fn, inputs, params):
+        h = hashlib.sha256()
+        h.update(name.encode())
+        h.update(function_fingerprint(fn).encode())
+        for artifact in inputs:
+            h.update(artifact.key.encode())
+        for param in sorted(params):
+            h.update(param.encode())
+            h.update(hash_value(params[param]).encode())
+        return h.hexdigest()
+
+    ## running a stage, or loading it if it was run before
+    ## inputs are the upstream artifacts, passed to fn by position
+    ## and params are passed by name
+    def run(self, name, fn, *inputs, **params):
+        key = self.stage_key(name, fn, inputs, params)
+        path = os.path.join(self.cache_path, f'{name}-{key[:20]}.pkl')
+        if self.enabled and os.path.exists(path):
+            if self.verbose:
+                print(f'{name}: loaded from cache')
+            with stage(f'{name}:cache_load'), open(path, 'rb') as f:
+                return Artifact(key, pickle.load(f))
+        if self.verbose:
+            print(f'{name}: computing')
+        value = fn(*[artifact.value for artifact in inputs], **params)
+        if self.enabled:
+            ## writing to a temp file first
+            ## so a crash never leaves a broken cache entry
+            ## (one per process, for the stages that run in parallel)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        return Artifact(key, value)
@@ -0,0 +1,248 @@
+## Stage Profiler
+## named stages of the trading scripts, timed and measured
+## a stage is a `with stage('betas'):` block or a function decorated with @profiled('betas')
+## and every stage records its wall and cpu time, the peak and net memory
+## allocated inside it (tracemalloc), and the shapes of its inputs and output
+## stages can be nested (e.g. the indicators inside the features)
+## it's switched on with the STAGE_PROFILE environment variable
+## STAGE_PROFILE=1 prints a line per stage
+## STAGE_PROFILE=profile.jsonl writes a json record per stage to the file (emptied when the run starts)
+## STAGE_PROFILE=trace.json writes a Chrome trace (chrome://tracing or ui.perfetto.dev)
+## and STAGE_PROFILE_MEMORY=0 skips tracemalloc, which slows the allocations down
+## when it's off, @profiled returns the function itself
+## and stage() returns a shared do-nothing context
+## the stages of worker processes go to the same file, with their own pid
+## e.g.
+## STAGE_PROFILE=trace.json python algorithmicTrading.py
+## python stageProfiler.py profile.jsonl (prints a summary per stage)
+## packages required for this module
+## pandas, numpy
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+profile_target = os.environ.get('STAGE_PROFILE', '').strip()
+enabled = profile_target not in ('', '0')
+trace_memory = os.environ.get('STAGE_PROFILE_MEMORY', '1').strip() != '0'
+
+## a short description of a value, its type and shape (or length)
+def describe(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return {'type': type(value).__name__, 'shape': list(value.shape)}
+    if isinstance(value, (list, tuple)):
+        return {'type': type(value).__name__, 'len': len(value),
+                'items': [describe(v) for v in value[:5]]}
+    if isinstance(value, dict):
+        return {'type': 'dict', 'len': len(value)}
+    return {'type': type(value).__name__}
+
+## the number of rows of a frame, series or array
+def _rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)) and value.ndim > 0:
+        return int(value.shape[0])
+    return None
+
+## writing the records
+## one file for the whole run, emptied once by the main process when it starts
+## and then every process (the main one and the forked workers)
+## only appends to it, so no process can wipe out the records of another
+class _Writer:
+    def __init__(self, target):
+        self.target = target
+        self.chrome = target.endswith('.json')
+        self.fd = None
+        self.owner = os.getpid()
+        self.lock = threading.Lock()
+        if target != '1':
+            self._truncate()
+
+    def _truncate(self):
+        fd = os.open(self.target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        if self.chrome:
+            os.write(fd, b'[\n')
+            atexit.register(self.close)
+        os.close(fd)
+
+    def _open(self):
+        self.fd = os.open(self.target, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def write(self, record):
+        if self.target == '1':
+            indent = '  ' * record['depth']
+            memory = f" peak {record['peak_mb']:.1f}MB net {record['net_mb']:+.1f}MB" if 'peak_mb' in record else ''
+            rows = f" rows {record['rows']}" if record.get('rows') is not None else ''
+            error = f" failed: {record['error']}" if record.get('error') else ''
+            print(f"[profile] {indent}{record['name']}: {record['wall_s']:.3f}s (cpu {record['cpu_s']:.3f}s)"
+                  f"{memory}{rows}{error}", file = sys.stderr, flush = True)
+            return
+        if self.chrome:
+            args = {k: v for k, v in record.items() if k not in ('name', 'start', 'wall_s', 'pid', 'tid')}
+            record = {'name': record['name'], 'cat': 'stage', 'ph': 'X',
+                      'ts': record['start'] * 1e6, 'dur': record['wall_s'] * 1e6,
+                      'pid': record['pid'], 'tid': record['tid'], 'args': args}
+        line = (json.dumps(record, default = str) + (',\n' if self.chrome else '\n')).encode()
+        with self.lock:
+            if self.fd is None:
+                self._open()
+            ## one write per record, so the processes don't interleave
+            os.write(self.fd, line)
+
+    ## closing the json array of the trace, in the process that created it
+    def close(self):
+        if os.getpid() != self.owner:
+            return
+        if self.fd is None:
+            self._open()
+        size = os.fstat(self.fd).st_size
+        ## replacing the last record's comma
+        os.ftruncate(self.fd, max(size - 2, 2))
+        os.write(self.fd, b'\n]\n')
+        os.close(self.fd)
+        self.fd = None
+
+_writer = _Writer(profile_target) if enabled else None
+_local = threading.local()
+
+## a running stage
+class Stage:
+    def __init__(self, name, meta):
+        self.name = name
+        self.meta = meta
+        self.input_shapes = None
+        self.output_shape = None
+        self.rows = None
+        self.child_peak = 0
+
+    ## the inputs and the output are optional, for the shapes
+    def inputs(self, *values, **named):
+        self.input_shapes = [describe(v) for v in values] + [{'name': k, **describe(v)} for k, v in named.items()]
+
+    def output(self, value):
+        self.output_shape = describe(value)
+        self.rows = _rows(value)
+        return value
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            ## the peak of the outer stage so far, before it's reset for this one
+            if stack:
+                stack[-1].child_peak = max(stack[-1].child_peak, peak)
+            tracemalloc.reset_peak()
+            self.memory_start = current
+        self.depth = len(stack)
+        stack.append(self)
+        self.start = time.time()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        stack = _local.stack
+        stack.pop()
+        record = {'name': self.name, 'start': self.start, 'wall_s': wall, 'cpu_s': cpu,
+                  'depth': self.depth, 'parent': stack[-1].name if stack else None,
+                  'pid': os.getpid(), 'tid': threading.get_ident()}
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, self.child_peak)
+            record['peak_mb'] = (peak - self.memory_start) / 1e6
+            record['net_mb'] = (current - self.memory_start) / 1e6
+            if stack:
+                stack[-1].child_peak = max(stack[-1].child_peak, peak)
+        if self.input_shapes is not None:
+            record['inputs'] = self.input_shapes
+        if self.output_shape is not None:
+            record['output'] = self.output_shape
+            record['rows'] = self.rows
+        if exc is not None:
+            record['error'] = repr(exc)
+        record.update(self.meta)
+        _writer.write(record)
+        return False
+
+## the stage when profiling is off
+class _NullStage:
+    def inputs(self, *values, **named):
+        pass
+
+    def output(self, value):
+        return value
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_null_stage = _NullStage()
+
+## a named stage, as a context manager
+## meta is added to the stage's record, e.g. stage('month', month = '2020-01')
+## the block can hand its output to the stage for the shapes:
+## with stage('monthly') as s:
+##     monthly = s.output(aggregate(data))
+def stage(name, **meta):
+    if not enabled:
+        return _null_stage
+    return Stage(name, meta)
+
+## a named stage, as a decorator
+## it records the shapes of the frames and arrays the function takes and returns
+def profiled(name = None, **meta):
+    def decorator(fn):
+        if not enabled:
+            return fn
+        stage_name = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with Stage(stage_name, meta) as s:
+                s.inputs(*[a for a in args if _rows(a) is not None],
+                         **{k: v for k, v in kwargs.items() if _rows(v) is not None})
+                return s.output(fn(*args, **kwargs))
+        return wrapper
+    return decorator
+
+## reading a profile back, either format, as a df with one row per stage
+def read_profile(path):
+    if path.endswith('.json'):
+        with open(path) as f:
+            text = f.read().rstrip()
+        ## a trace that's still being written has no closing bracket
+        if not text.endswith(']'):
+            text = text.rstrip(',') + ']'
+        records = [{'name': e['name'], 'start': e['ts'] / 1e6, 'wall_s': e['dur'] / 1e6,
+                    'pid': e['pid'], 'tid': e['tid'], **e['args']} for e in json.loads(text)]
+    else:
+        with open(path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    return pd.DataFrame(records)
+
+## the total time and memory of every stage, the slowest first
+def summarize(profile):
+    aggregations = {'calls': ('wall_s', 'size'), 'wall_s': ('wall_s', 'sum'), 'max_wall_s': ('wall_s', 'max'),
+                    'cpu_s': ('cpu_s', 'sum')}
+    if 'peak_mb' in profile:
+        aggregations['peak_mb'] = ('peak_mb', 'max')
+    if 'rows' in profile:
+        aggregations['max_rows'] = ('rows', 'max')
+    return profile.groupby('name').agg(**aggregations).sort_values('wall_s', ascending = False)
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        print(path)
+        print(summarize(read_profile(path)).to_string())
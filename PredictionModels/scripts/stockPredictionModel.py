@@ -1,6 +1,15 @@
 import pandas as pd
+import datetime as dt
 ## we'll use Yahoo Finance to get the data
-import yfinance as yf 
+## through the market data source (and the local price store, so reruns don't download it again)
+## or from the offline synthetic market
+from marketData import get_source
+## the stage profiler (off unless STAGE_PROFILE is set)
+from stageProfiler import profiled
+## and the walk forward backtest engine
+from walkForward import cached_walk_forward, threshold_sweep
+## and the multi-horizon features
+from horizonFeatures import feature_names, horizon_features
 ## we also need the sklearn for ML
 ## we'll use random forest for this model
 ## it helps to avoid over-fitting the model
@@ -10,15 +19,16 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import precision_score
 ## then we pass in a symbol for the stock we want to use
 ## this case Apple
-apple = yf.Ticker("AAPL")
-## this is an object
-## we need to then query the historical data
-apple = apple.history(perid = "max")
+## and we want the whole history
+apple = get_source().prices("AAPL", "1980-01-01", dt.date.today() + pd.DateOffset(days = 1)).xs("AAPL", level = "ticker")
 ## this will give us a pandas df
 ## so we can use it like one
-## first, we need to get rid of the extra columns
-del apple["Dividends"]
-del apple["Stock Splits"]
+## the prices should be split/dividend adjusted
+## so we scale open, high, low and close with the adj close factor
+adjust_factor = apple["Adj Close"]/apple["Close"]
+apple[["Open", "High", "Low", "Close"]] = apple[["Open", "High", "Low", "Close"]].mul(adjust_factor, axis = 0)
+## and we need to get rid of the extra column
+del apple["Adj Close"]
 ## then add the tomorrow's value to each row
 apple["Tomorrow"] = apple["Close"].shift(-1)
 ## we also need to add a flag to see if it's up or down
@@ -47,29 +57,28 @@ score = precision_score(test["Target"], predictions)
 print(score)
 
 ## now for back testing
-## first, we need to create a prediction function
-
-def predict(train, test, predictors, model):
-    model.fit(train[predictors], train["Target"])
-    predictions = model.predict(test[predictors])
-    predictions = pd.Series(predictions, index = test.index, name = "Predictions")
-    score = precision_score(test["Target"], predictions)
-    combined = pd.concat([test['Target'], predictions], axis = 1)
-    return combined
-
+## every fold fits the model on the past rows
+## and predicts the next ones, with model.predict
+## or with a threshold on the probability of an up day
 ## then we need to write our back test function
 ## the start is defined to process 10 years of data (10x250)
 ## and step is defined to process one year at a time
-def backtest(data, model, predictors, start = 2500, step = 250):
-    ## we want to loop through our data 
+## the walk forward engine fits the yearly folds in the worker pool
+## on slices of the predictor arrays, instead of copies of the df
+## window = n trains on the last n rows only (a sliding window)
+## and add_trees = k grows the previous fold's forest by k trees fitted on the new year
+## (much faster, but not the same forest as a full refit, and it can't be combined with a window)
+## the probabilities of every run are cached in data/walk_forward_cache
+## so running it again with another threshold doesn't refit anything
+@profiled('backtest')
+def backtest(data, model, predictors, start = 2500, step = 250, threshold = None, **options):
+    ## we want to loop through our data
     ## and make predictions, year-by-year
-    all_predictions = []
-    for i in range(start,data.shape[0], step):
-        train = data.iloc[:i].copy()
-        test = data.iloc[i:i+step].copy()
-        predictions = predict(train, test, predictors, model)
-        all_predictions.append(predictions)
-    return pd.concat(all_predictions)
+    predictions, folds, from_cache = cached_walk_forward(data, model, predictors, start = start, step = step,
+                                                         threshold = threshold, **options)
+    print(f"{len(folds)} folds, fit {folds['fit_s'].sum():.1f}s, predict {folds['predict_s'].sum():.1f}s"
+          + (" (from the cache)" if from_cache else ""))
+    return predictions
 ## now let's test everything
 predictions = backtest(apple, model, predictors)
 score = precision_score(predictions["Target"], predictions["Predictions"])
@@ -80,20 +89,15 @@ print(score)
 ## giving it more period breakdowns to compare the values
 ## dod, wow, mom, etc.
 horizons = [2, 5, 30, 60, 90, 250, 500, 750, 1000]
-new_predictors = []
-## then we need to loop through
-## and calculate the average
-for h in horizons:
-    ## lets get the rolling average for that period
-    ## and then calculate the ratio
-    rolling_average = apple.rolling(h).mean()
-    ratio_column_name = f"Close_Ratio_{h}"
-    apple[ratio_column_name] = apple["Close"]/rolling_average["Close"]
-    ## lets also calculate the trend
-    ## and get the sum of the days that the stock actually went up
-    trend_column_name = f"Trend_{h}"
-    apple[trend_column_name] = apple.shift(1).rolling(h).sum()["Target"]
-    new_predictors.extend([ratio_column_name, trend_column_name])
+## for every horizon
+## we get the rolling average of the close for that period
+## and then calculate the ratio
+## and we also calculate the trend
+## the sum of the days that the stock actually went up
+## all the horizons come from one cumulative sum of the close and the target
+## as float32 columns, which is what the forest trains on anyway
+new_predictors = feature_names(horizons)
+apple[new_predictors] = horizon_features(apple["Close"], apple["Target"], horizons)
 ## now we have more columns in our df
 print(apple.head(10))
 ## there are many missing values
@@ -101,19 +105,14 @@ print(apple.head(10))
 apple.dropna(inplace=True)
 ## now we need to re-create the model
 model = RandomForestClassifier(n_estimators = 500, min_samples_split = 200, random_state = 1)
-## and re-define the predict function
-def predict(train, test, predictors, model):
-    ## training the model the same as before
-    model.fit(train[predictors], train["Target"])
-    ## and this time, we want to get the probability
-    ## getting all the rows but only the second column
-    prediction = model.predict_proba(test[predictors])[:,1]
-    ## now we want to give a higher threshold
-    prediction[prediction >= 0.6] = 1
-    prediction[prediction < 0.6] = 0
-    prediction = pd.Series(prediction, index = test.index, name = "Predictions")
-    combined = pd.concat([test["Target"], prediction], axis = 1)
-    return combined
-predictions = backtest(apple, model, new_predictors)
+## training the model the same as before
+## and this time, we want to use the probability of an up day
+## with a higher threshold
+predictions = backtest(apple, model, new_predictors, threshold = 0.6)
 score = precision_score(predictions["Target"], predictions["Predictions"])
-print(score)
\ No newline at end of file
+print(score)
+## and to see how other thresholds would do
+## we can sweep them over the same probabilities
+## the precision, the recall and the number of days with a signal for every cutoff
+sweep = threshold_sweep(predictions["Target"], predictions["Probability"])
+print(sweep[sweep["signals"] > 0].tail(20))
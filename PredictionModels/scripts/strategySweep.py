@@ -0,0 +1,135 @@
+## Strategy Parameter Sweep
+## runs many variants of the algorithmicTrading.py strategy
+## over a grid of its parameters
+## (liquidity cutoff, return lags, cluster targets, selected cluster, weight bounds)
+## the upstream panel (features, monthly aggregation, returns and betas)
+## only depends on a few of them, so it's computed once
+## for every distinct upstream setting, through the stage cache
+## and the variants that share it fan out over the worker pool
+## the result is one row per variant
+## with its return, Sharpe ratio and drawdown
+## packages required for this module
+## pandas, numpy, and the ones of algorithmicTrading.py
+import itertools
+import numpy as np
+import pandas as pd
+import algorithmicTrading as at
+from stageCache import StageCache
+from workerPool import process_pool
+
+## the parameters of the strategy, and their values in algorithmicTrading.py
+## the number of clusters is the number of target RSI values
+default_grid = {'top_n': [150],
+                'lags': [[1,2,3,6,9,12]],
+                'target_rsi_values': [[30, 45, 55, 70]],
+                'cluster_id': [3],
+                'lower_bound': [None],
+                'upper_bound': [.1],
+                'transaction_cost': [0]}
+## the ones the shared upstream panel depends on
+upstream_params = ['top_n', 'lags']
+
+## every combination of the grid's values
+## missing parameters take the default value
+def expand_grid(grid):
+    grid = {**default_grid, **grid}
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+## the performance of a daily return series
+## compounded the same way as the strategy plot
+def performance(returns, frequency = 252):
+    returns = returns.dropna()
+    cumulative = np.exp(np.log1p(returns).cumsum())
+    drawdown = cumulative/cumulative.cummax()-1
+    volatility = returns.std()*np.sqrt(frequency)
+    return {'total_return': cumulative.iloc[-1]-1 if len(returns) else np.nan,
+            'annual_return': cumulative.iloc[-1]**(frequency/len(returns))-1 if len(returns) else np.nan,
+            'annual_volatility': volatility,
+            'sharpe': returns.mean()*frequency/volatility if volatility > 0 else np.nan,
+            'max_drawdown': drawdown.min() if len(returns) else np.nan,
+            'n_days': len(returns)}
+
+## the upstream panels, one per upstream setting
+## they're handed to every worker once, when the worker starts
+_upstreams = {}
+
+def _init_worker(upstreams):
+    _upstreams.update(upstreams)
+
+## the downstream stages of a single variant, it runs in the workers
+## the clustering and the optimization run in the worker's own process
+## because the variants already keep all the cores busy
+## the clustering still uses the same chains of months as the main script
+## so the default variant gets the same clusters
+def run_variant(upstream_key, params):
+    monthly_data, fresh_data = _upstreams[upstream_key]
+    try:
+        clusters = at.cluster_stocks(monthly_data,
+                                     target_rsi_values = params['target_rsi_values'],
+                                     n_segments = at.default_segments,
+                                     max_workers = 1)
+        stocks_dict = at.select_stocks(clusters, cluster_id = params['cluster_id'])
+        optimized = at.optimize_portfolio(fresh_data,
+                                          stocks_dict,
+                                          lower_bound = params['lower_bound'],
+                                          upper_bound = params['upper_bound'],
+                                          max_workers = 1)
+        portfolio_df = at.backtest_portfolio(fresh_data, optimized,
+                                             transaction_cost = params['transaction_cost'])
+        return {**performance(portfolio_df['Strategy Return']), 'error': None}
+    except Exception as e:
+        return {'error': repr(e)}
+
+## data is the (date, ticker) price df of at.download_prices
+## and factor_data the Fama-French factors of at.download_factors
+## grid is a dict of {parameter: [values]}, see default_grid
+## fresh_prices gets the daily prices for the optimization
+## from the upstream panel (at.download_fresh_prices)
+## it returns one row per variant, with its parameters and performance
+def run_sweep(data, factor_data, grid, max_workers = None, cache = None,
+              fresh_prices = at.download_fresh_prices):
+    if cache is None:
+        cache = StageCache()
+    variants = expand_grid(grid)
+    data = cache.source('prices', data)
+    factor_data = cache.source('factors', factor_data)
+    ## the features don't depend on any of the parameters
+    features = cache.run('features', at.compute_features, data)
+    ## and the rest of the upstream panel is computed
+    ## once for each distinct upstream setting
+    upstreams = {}
+    upstream_keys = []
+    for params in variants:
+        setting = tuple(repr(params[name]) for name in upstream_params)
+        if setting not in upstreams:
+            monthly_data = cache.run('monthly', at.aggregate_monthly, features, top_n = params['top_n'])
+            monthly_data = cache.run('returns', at.add_returns, monthly_data, lags = params['lags'])
+            monthly_data = cache.run('betas', at.add_betas, monthly_data, factor_data)
+            upstreams[setting] = (monthly_data.value, fresh_prices(monthly_data.value))
+        upstream_keys.append(setting)
+
+    if max_workers == 1 or len(variants) == 1:
+        _init_worker(upstreams)
+        results = [run_variant(key, params) for key, params in zip(upstream_keys, variants)]
+    else:
+        with process_pool(max_workers = max_workers, initializer = _init_worker, initargs = (upstreams,)) as pool:
+            results = list(pool.map(run_variant, upstream_keys, variants))
+
+    ## the lists are shown as tuples, so the table can be grouped and sorted
+    rows = [{name: tuple(value) if isinstance(value, list) else value for name, value in params.items()}
+            for params in variants]
+    return pd.DataFrame([{**row, **result} for row, result in zip(rows, results)])
+
+if __name__ == '__main__':
+    ## the same universe and dates as algorithmicTrading.py
+    end_date = '2023-12-20'
+    start_date = pd.to_datetime(end_date) - pd.DateOffset(365*8)
+    data = at.download_prices(at.load_sp500_symbols(), start_date, end_date)
+    factor_data = at.download_factors()
+    ## e.g. the liquidity cutoff, the selected cluster and the max weight
+    sweep_df = run_sweep(data, factor_data, {'top_n': [100, 150],
+                                             'target_rsi_values': [[30, 45, 55, 70], [25, 40, 60, 75]],
+                                             'cluster_id': [2, 3],
+                                             'upper_bound': [.1, .2]})
+    print(sweep_df.sort_values('sharpe', ascending = False).to_string())
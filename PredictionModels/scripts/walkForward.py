@@ -0,0 +1,205 @@
+## Walk-Forward Backtest Engine
+## the yearly walk forward of stockPredictionModel.py:
+## train on everything up to a fold, predict the next step, move on by a step
+## the folds are independent, so they're fitted in the worker pool
+## and each one gets a fresh copy of the model
+## the predictors and the target are turned into arrays once
+## and every fold trains and predicts on slices of them (views, not copies of the df)
+## two options change what a fold trains on:
+## window = n slides a fixed window of the last n rows, instead of the expanding history
+## add_trees = k warm starts the forest: every fold keeps the trees of the previous one
+## and adds k trees fitted on the new rows only (the rows of the previous test step)
+## which makes the folds sequential, so that one runs in the main process
+## (the forest keeps all of its trees, so it can't slide a window: the two don't go together)
+## every fold reports its fit and predict time
+## the up probabilities of a run can be cached on disk (cached_walk_forward)
+## under a hash of the model's parameters, the predictors, the fold options and the data
+## so a decision threshold is tuned with threshold_sweep on the cached probabilities
+## in one pass over them, instead of refitting the forests for every cutoff
+## packages required for this module
+## pandas, numpy, sklearn
+import os
+import json
+import time
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from workerPool import process_pool
+from stageCache import hash_value
+
+default_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'walk_forward_cache')
+
+## the arrays of the workers, handed over once when the pool starts
+_arrays = {}
+
+def _init_worker(X, y):
+    _arrays.update(X = X, y = y)
+
+## the (train start, train end, test start, test end) row positions of every fold
+## the first test step starts at start, and every next one step rows later
+def fold_bounds(n_rows, start, step, window = None):
+    return [(0 if window is None else max(0, i - window), i, i, min(i + step, n_rows))
+            for i in range(start, n_rows, step)]
+
+## the probability of the up class (1) of every row
+## a training set without any up day can't predict one
+def _up_probability(model, proba):
+    classes = list(model.classes_)
+    return proba[:, classes.index(1)] if 1 in classes else np.zeros(len(proba))
+
+## fitting and predicting one fold
+## fit_rows are the rows the model is fitted on (the new rows, for a warm started forest)
+## it returns the predictions of model.predict, the up probabilities, the fitted model and the times
+def _run_fold(model, X, y, fit_rows, test_rows):
+    start = time.perf_counter()
+    model.fit(X[fit_rows], y[fit_rows])
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    proba = model.predict_proba(X[test_rows])
+    predict_time = time.perf_counter() - start
+    ## the same as model.predict, without a second pass over the trees
+    predictions = model.classes_.take(np.argmax(proba, axis = 1))
+    return predictions, _up_probability(model, proba), model, fit_time, predict_time
+
+## a fold in a worker, on the arrays of the pool
+## only the predictions, the number of trees and the times come back (not the forest)
+def _fold_in_worker(model, fit_rows, test_rows):
+    predictions, proba, fitted, fit_time, predict_time = _run_fold(model, _arrays['X'], _arrays['y'], fit_rows, test_rows)
+    return predictions, proba, len(fitted.estimators_), fit_time, predict_time
+
+## the predictions of a threshold on the up probability (1 when it's >= threshold)
+## None keeps the ones of model.predict
+def apply_threshold(combined, threshold):
+    if threshold is None:
+        return combined
+    combined = combined.copy()
+    combined['Predictions'] = np.where(combined['Probability'] >= threshold, 1., 0.)
+    return combined
+
+## the walk forward backtest of model on data
+## start is the first test row, and step the number of rows of every test step
+## window is the length of a sliding training window (None trains on the whole history)
+## add_trees warm starts the forest with that many new trees every fold
+## (and can't be combined with a window)
+## threshold turns the up probability into the prediction (1 when it's >= threshold)
+## and None uses model.predict
+## max_workers = None uses all the cores
+## it returns the Target and the Predictions of every test row (with the up Probability)
+## and a row of stats per fold
+def walk_forward(data, model, predictors, start = 2500, step = 250, window = None, add_trees = None,
+                 threshold = None, max_workers = None, target = 'Target'):
+    if window is not None and add_trees is not None:
+        raise ValueError('a warm started forest (add_trees) keeps its old trees, so it can\'t use a sliding window')
+    X = data[predictors].to_numpy(dtype = np.float64)
+    y = data[target].to_numpy()
+    bounds = fold_bounds(len(data), start, step, window)
+    tasks = [(slice(a, b), slice(c, d)) for a, b, c, d in bounds]
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    results = []
+    if add_trees is not None:
+        ## every fold grows the forest of the previous one
+        forest = clone(model)
+        previous_end = None
+        for (fit_rows, test_rows), (a, b, c, d) in zip(tasks, bounds):
+            if previous_end is not None:
+                forest.set_params(warm_start = True, n_estimators = forest.n_estimators + add_trees)
+                fit_rows = slice(previous_end, b)
+            previous_end = b
+            predictions, proba, forest, fit_time, predict_time = _run_fold(forest, X, y, fit_rows, test_rows)
+            results.append((predictions, proba, fit_rows, len(forest.estimators_), fit_time, predict_time))
+    elif max_workers == 1 or len(tasks) <= 1:
+        for fit_rows, test_rows in tasks:
+            predictions, proba, fitted, fit_time, predict_time = _run_fold(clone(model), X, y, fit_rows, test_rows)
+            results.append((predictions, proba, fit_rows, len(fitted.estimators_), fit_time, predict_time))
+    else:
+        with process_pool(max_workers = max_workers, initializer = _init_worker, initargs = (X, y)) as pool:
+            futures = [pool.submit(_fold_in_worker, clone(model), fit_rows, test_rows) for fit_rows, test_rows in tasks]
+            for (fit_rows, _), future in zip(tasks, futures):
+                predictions, proba, n_trees, fit_time, predict_time = future.result()
+                results.append((predictions, proba, fit_rows, n_trees, fit_time, predict_time))
+    index = data.index[start:]
+    probability = np.concatenate([proba for _, proba, *_ in results]) if results else np.zeros(0)
+    predictions = np.concatenate([p for p, *_ in results]) if results else np.zeros(0)
+    combined = pd.DataFrame({target: data[target].iloc[start:],
+                             'Predictions': predictions,
+                             'Probability': probability}, index = index)
+    combined = apply_threshold(combined, threshold)
+    folds = pd.DataFrame([{'train_start': data.index[fit_rows.start],
+                           'train_end': data.index[fit_rows.stop - 1],
+                           'test_start': data.index[c],
+                           'test_end': data.index[d - 1],
+                           'train_rows': fit_rows.stop - fit_rows.start,
+                           'trees': n_trees,
+                           'fit_s': fit_time,
+                           'predict_s': predict_time}
+                          for (_, _, fit_rows, n_trees, fit_time, predict_time), (_, _, c, d) in zip(results, bounds)],
+                         columns = ['train_start', 'train_end', 'test_start', 'test_end',
+                                    'train_rows', 'trees', 'fit_s', 'predict_s'])
+    return combined, folds
+
+## the cache key is a hash of everything the probabilities depend on
+## the model's class and parameters, the predictors, the fold options
+## and the predictor and target values themselves
+def cache_key(data, model, predictors, target, options):
+    h = hashlib.sha256()
+    h.update(f'{type(model).__module__}.{type(model).__qualname__}'.encode())
+    h.update(hash_value(model.get_params()).encode())
+    h.update(json.dumps([list(predictors), target, options], sort_keys = True).encode())
+    h.update(hash_value(data[list(predictors) + [target]]).encode())
+    return h.hexdigest()
+
+## walk_forward, read from the cache when it was run before on the same data, model and options
+## (the number of workers doesn't change the results, so it isn't part of the key)
+## the threshold is applied to the cached probabilities
+## cache_path = None turns the cache off
+## it returns the predictions, the fold stats (of the run that computed them) and if it came from the cache
+def cached_walk_forward(data, model, predictors, start = 2500, step = 250, window = None, add_trees = None,
+                        threshold = None, max_workers = None, target = 'Target', cache_path = default_cache_path):
+    options = {'start': start, 'step': step, 'window': window, 'add_trees': add_trees}
+    path = None
+    if cache_path is not None:
+        path = os.path.join(cache_path, f'{cache_key(data, model, predictors, target, options)}.pkl')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                combined, folds = pickle.load(f)
+            return apply_threshold(combined, threshold), folds, True
+    combined, folds = walk_forward(data, model, predictors, max_workers = max_workers, target = target, **options)
+    if path is not None:
+        os.makedirs(cache_path, exist_ok = True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((combined, folds), f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    return apply_threshold(combined, threshold), folds, False
+
+## the precision, the recall and the number of signals of every threshold
+## from the targets and the up probabilities, e.g. the Target and Probability of a walk forward
+## a row is a signal when its probability is >= the threshold (like apply_threshold)
+## the rows are sorted by probability once, and then every threshold is a binary search
+## into the running count of the up days
+## a threshold without any signal has a precision of 0, like precision_score
+def threshold_sweep(target, probability, thresholds = None):
+    if thresholds is None:
+        thresholds = np.linspace(0, 1, 101)
+    thresholds = np.asarray(thresholds, dtype = np.float64)
+    target = np.asarray(target)
+    probability = np.asarray(probability, dtype = np.float64)
+    order = np.argsort(probability, kind = 'stable')
+    ranked = probability[order]
+    ## the up days among the rows at or above every position
+    ups_above = np.concatenate([np.cumsum((target[order] == 1)[::-1])[::-1], [0]])
+    first_signal = np.searchsorted(ranked, thresholds, side = 'left')
+    signals = len(ranked) - first_signal
+    true_positives = ups_above[first_signal]
+    positives = ups_above[0]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        precision = np.where(signals > 0, true_positives / signals, 0.)
+        recall = np.where(positives > 0, true_positives / positives, 0.)
+    return pd.DataFrame({'threshold': thresholds,
+                         'signals': signals,
+                         'true_positives': true_positives,
+                         'precision': precision,
+                         'recall': recall})
@@ -0,0 +1,207 @@
+## Parallel, Cached Max Sharpe Optimization
+## the monthly weight optimization of algorithmicTrading.py
+## the expected returns and the covariance of the trailing window
+## are kept as running sums that are updated as the window rolls
+## (adding the new days and removing the old ones)
+## instead of being recalculated from the prices every month
+## the max sharpe solves of the months are independent
+## so they go to a process pool
+## and every result is cached on disk under a hash of its inputs
+## (the stocks, the window, the bounds, the solver and the window's prices,
+##  not the estimates, whose last bits depend on how the running sums got to the window)
+## so a rerun with the same inputs skips the solver
+## and each month's outcome goes into a table
+## (including the months that fell back to equal weights)
+## packages required for this module
+## pandas, numpy, PyPortfolioOpt
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from workerPool import process_pool
+from stageCache import hash_value
+
+default_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'optimization_cache')
+
+## running sums of the daily returns
+## for the whole universe of stocks
+## from them we can read the mean and the covariance
+## of any subset of the stocks over the current window
+## the same way pypfopt's mean_historical_return and sample_cov do
+## (pairwise complete observations, like DataFrame.cov)
+class RollingMoments:
+    def __init__(self, returns):
+        self.dates = returns.index.values
+        self.tickers = returns.columns
+        values = returns.to_numpy(dtype = np.float64)
+        self.mask = ~np.isnan(values)
+        self.values = np.where(self.mask, values, 0.)
+        self.log_values = np.where(self.mask, np.log1p(self.values), 0.)
+        self.lo = self.hi = 0
+        self._reset()
+
+    def _reset(self):
+        n = len(self.tickers)
+        self.sum_log = np.zeros(n)
+        self.sum_x = np.zeros((n, n))
+        self.sum_xy = np.zeros((n, n))
+        self.nobs = np.zeros((n, n))
+
+    def _update(self, lo, hi, sign):
+        if hi <= lo:
+            return
+        x = self.values[lo:hi]
+        m = self.mask[lo:hi].astype(np.float64)
+        self.sum_log += sign * self.log_values[lo:hi].sum(axis = 0)
+        ## sum_x[i, j] is the sum of stock i's returns on the days stock j has one too
+        self.sum_x += sign * (x.T @ m)
+        self.sum_xy += sign * (x.T @ x)
+        self.nobs += sign * (m.T @ m)
+
+    ## moving the window to the rows [lo, hi)
+    def move(self, lo, hi):
+        if lo >= self.hi or hi <= self.lo:
+            ## no overlap, so we start over
+            self._reset()
+            self._update(lo, hi, 1)
+        else:
+            self._update(self.lo, lo, -1)
+            self._update(lo, self.lo, 1)
+            self._update(hi, self.hi, -1)
+            self._update(self.hi, hi, 1)
+        self.lo, self.hi = lo, hi
+
+    ## the window between two dates (both included)
+    ## the first day has no return inside the window
+    ## the same as pct_change on the window's prices
+    def set_window(self, start, end):
+        lo = np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start)), side = 'left')
+        hi = np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end)), side = 'right')
+        self.move(min(lo + 1, hi), hi)
+
+    ## annualized mean (compounded) and covariance for the stocks
+    def estimates(self, tickers, frequency = 252):
+        idx = self.tickers.get_indexer(tickers)
+        nobs = self.nobs[np.ix_(idx, idx)]
+        count = np.diag(nobs)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            mu = np.exp(self.sum_log[idx] * frequency / count) - 1
+            sum_x = self.sum_x[np.ix_(idx, idx)]
+            cov = (self.sum_xy[np.ix_(idx, idx)] - sum_x * sum_x.T / nobs) / (nobs - 1)
+        return (pd.Series(mu, index = tickers),
+                pd.DataFrame(cov * frequency, index = tickers, columns = tickers))
+
+## the solve of a single month, it runs in the workers
+## so it has to be a plain module level function
+## it returns the weights and the error (if max sharpe failed)
+def solve_max_sharpe(mu, cov, weight_bounds, solver = 'SCS'):
+    from pypfopt.efficient_frontier import EfficientFrontier
+    from pypfopt.risk_models import fix_nonpositive_semidefinite
+    try:
+        ef = EfficientFrontier(expected_returns = mu,
+                               cov_matrix = fix_nonpositive_semidefinite(cov),
+                               weight_bounds = weight_bounds,
+                               solver = solver)
+        ef.max_sharpe()
+        return dict(ef.clean_weights()), None
+    except Exception as e:
+        return None, repr(e)
+
+## the cache key is a hash of everything the solve depends on
+## the stock set, the window, the bounds, the solver and the annualization
+## and the prices of the stocks in the window, which the estimates are computed from
+def cache_key(tickers, window, weight_bounds, solver, frequency, prices):
+    h = hashlib.sha256()
+    h.update(json.dumps([sorted(tickers), [str(w) for w in window], list(weight_bounds), solver, frequency]).encode())
+    h.update(hash_value(prices.loc[window[0]:window[1], sorted(tickers)]).encode())
+    return h.hexdigest()
+
+def _read_cache(cache_path, key):
+    if cache_path is None:
+        return None
+    path = os.path.join(cache_path, f'{key}.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _write_cache(cache_path, key, result):
+    if cache_path is None:
+        return
+    os.makedirs(cache_path, exist_ok = True)
+    path = os.path.join(cache_path, f'{key}.json')
+    ## the workers of a sweep can write the same key at the same time
+    ## so every process writes its own temp file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(result, f)
+    os.replace(tmp_path, path)
+
+## prices is the date x ticker adj close df
+## stocks_by_month is the {month start: [tickers]} dict
+## the window is the `window_months` before the month start
+## the lower bound defaults to half of the equal weight
+## it returns the {month start: weights} dict
+## and the per-month outcome table
+def optimize_months(prices, stocks_by_month, window_months = 12, lower_bound = None, upper_bound = .1,
+                    frequency = 252, solver = 'SCS', max_workers = None, cache_path = default_cache_path):
+    returns = prices.pct_change(fill_method = None)
+    moments = RollingMoments(returns)
+    tasks = {}
+    outcomes = {}
+    ## the months go in date order, so the window only rolls forward
+    for month in sorted(stocks_by_month, key = pd.Timestamp):
+        stocks = list(stocks_by_month[month])
+        window = ((pd.Timestamp(month) - pd.DateOffset(months = window_months)).strftime('%Y-%m-%d'),
+                  (pd.Timestamp(month) - pd.DateOffset(days = 1)).strftime('%Y-%m-%d'))
+        bounds = (round(1/len(stocks)*.5, 3) if lower_bound is None else lower_bound, upper_bound)
+        outcomes[month] = {'n_stocks': len(stocks),
+                           'window_start': window[0],
+                           'window_end': window[1],
+                           'lower_bound': bounds[0],
+                           'upper_bound': bounds[1]}
+        missing = [s for s in stocks if s not in moments.tickers]
+        if missing:
+            outcomes[month].update({'status': 'skipped', 'from_cache': False,
+                                    'error': f'no prices for {missing}'})
+            continue
+        moments.set_window(*window)
+        mu, cov = moments.estimates(stocks, frequency = frequency)
+        key = cache_key(stocks, window, bounds, solver, frequency, prices)
+        tasks[month] = (key, (mu, cov, bounds, solver))
+
+    ## checking the cache first
+    results = {}
+    for month, (key, args) in tasks.items():
+        cached = _read_cache(cache_path, key)
+        if cached is not None:
+            results[month] = (cached['weights'], cached['error'], True)
+    ## and then solving the rest in the pool
+    to_solve = [month for month in tasks if month not in results]
+    if to_solve:
+        if max_workers == 1:
+            solved = [solve_max_sharpe(*tasks[month][1]) for month in to_solve]
+        else:
+            with process_pool(max_workers = max_workers) as pool:
+                solved = list(pool.map(solve_max_sharpe, *zip(*[tasks[month][1] for month in to_solve])))
+        for month, (weights, error) in zip(to_solve, solved):
+            _write_cache(cache_path, tasks[month][0], {'weights': weights, 'error': error})
+            results[month] = (weights, error, False)
+
+    ## if max sharpe fails for a month
+    ## we use the equally-weighed weights
+    allocations = {}
+    for month, (weights, error, from_cache) in results.items():
+        if weights is None:
+            stocks = list(stocks_by_month[month])
+            weights = {s: 1/len(stocks) for s in stocks}
+            status = 'equal_weight'
+        else:
+            status = 'max_sharpe'
+        allocations[month] = weights
+        outcomes[month].update({'status': status, 'from_cache': from_cache, 'error': error})
+    outcome_df = pd.DataFrame.from_dict(outcomes, orient = 'index')
+    outcome_df.index = pd.to_datetime(outcome_df.index)
+    outcome_df.index.name = 'month'
+    return allocations, outcome_df.sort_index()
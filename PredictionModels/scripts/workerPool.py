@@ -0,0 +1,22 @@
+## Worker Pool
+## the process pool the scripts share for their parallel stages
+## the scripts run top to bottom without a __main__ guard
+## so we fork the workers where we can
+## (spawned workers would import and re-run the calling script)
+## packages required for this module
+## none, only the standard library
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+## initializer runs once in every worker with initargs
+## (e.g. to hand the workers a large shared input once, instead of with every task)
+def process_pool(max_workers = None, max_tasks_per_child = None, initializer = None, initargs = ()):
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = None
+    return ProcessPoolExecutor(max_workers = max_workers,
+                               mp_context = context,
+                               max_tasks_per_child = max_tasks_per_child,
+                               initializer = initializer,
+                               initargs = initargs)
@@ -0,0 +1,6 @@
+## the scripts import each other by their module names
+## so the tests run with the scripts folder on the path
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
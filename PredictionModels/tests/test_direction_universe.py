@@ -0,0 +1,31 @@
+## the universe predictions of directionUniverse.py
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from directionUniverse import build_universe, train_pooled, predict_universe
+from horizonFeatures import feature_names
+
+horizons = [2, 5, 30]
+
+## three tickers, CCC stops trading 10 days before the others
+def _prices():
+    dates = pd.bdate_range('2012-01-02', periods = 400)
+    rng = np.random.default_rng(2)
+    frames = []
+    for ticker, n in [('AAA', 400), ('BBB', 400), ('CCC', 390)]:
+        close = 20 * np.exp(np.cumsum(.01 * rng.standard_normal(n)))
+        index = pd.MultiIndex.from_product([dates[:n], [ticker]], names = ['date', 'ticker'])
+        frames.append(pd.DataFrame({'Close': close, 'Adj Close': close}, index = index))
+    return pd.concat(frames).sort_index()
+
+def test_stale_tickers_are_not_ranked():
+    universe = build_universe(_prices(), horizons = horizons, start = '2012-01-01')
+    predictors = feature_names(horizons)
+    model = train_pooled(universe, RandomForestClassifier(n_estimators = 5, random_state = 1), predictors)
+    table = predict_universe(universe, model, predictors)
+    assert sorted(table['ticker']) == ['AAA', 'BBB']
+    assert (table['date'] == universe['date'].max()).all()
+    assert table['rank'].tolist() == [1, 2]
+    ## an earlier day still has all three
+    earlier = predict_universe(universe, model, predictors, date = universe['date'].max() - pd.Timedelta(days = 30))
+    assert sorted(earlier['ticker']) == ['AAA', 'BBB', 'CCC']
@@ -0,0 +1,19 @@
+## the rolling GARCH forecaster of garchForecaster.py
+## the warm starts and the refit schedule restart in every segment
+## so the forecasts shouldn't depend on the number of workers
+import numpy as np
+import pandas as pd
+from garchForecaster import rolling_garch
+
+def test_forecasts_do_not_depend_on_the_workers():
+    rng = np.random.default_rng(11)
+    returns = pd.Series(rng.standard_normal(140) * .01, index = pd.bdate_range('2020-01-01', periods = 140))
+    returns.iloc[0] = np.nan
+    options = {'window': 100, 'p': 1, 'q': 1, 'refit_every': 3, 'warm_start': True}
+    serial, serial_stats = rolling_garch(returns, max_workers = 1, **options)
+    parallel, parallel_stats = rolling_garch(returns, max_workers = 2, **options)
+    pd.testing.assert_series_equal(serial, parallel)
+    pd.testing.assert_frame_equal(serial_stats, parallel_stats)
+    assert serial.notna().sum() == 40
+    ## default_segments (8) segments of 5 windows: refits on their 1st and 4th
+    assert serial_stats['refit'].sum() == 16
@@ -0,0 +1,80 @@
+## the incremental daily update of incrementalUpdate.py
+## against the batch pipeline of algorithmicTrading.py on the same history
+import numpy as np
+import pandas as pd
+import pytest
+import algorithmicTrading as at
+from marketData import SyntheticSource
+from incrementalUpdate import IncrementalStrategy, last_cols
+
+## 3 years of synthetic prices of a few tickers (some of them listed later)
+@pytest.fixture(scope = 'module')
+def prices():
+    data = SyntheticSource(seed = 4).prices([f'SYN{i:05d}' for i in range(12)], '2018-01-01', '2021-01-01')
+    data.columns = data.columns.str.lower()
+    return data
+
+## the same history, added a few days at a time
+@pytest.fixture(scope = 'module')
+def incremental(prices):
+    strategy = IncrementalStrategy()
+    dates = prices.index.get_level_values('date').unique()
+    for start in range(0, len(dates), 37):
+        strategy.update(prices[prices.index.get_level_values('date').isin(dates[start:start + 37])])
+    return strategy
+
+def test_slices_match_one_update(prices, incremental):
+    whole = IncrementalStrategy.from_prices(prices)
+    pd.testing.assert_frame_equal(incremental.monthly_data(top_n = 8), whole.monthly_data(top_n = 8))
+
+def test_matches_compute_features(prices, incremental):
+    expected = at.aggregate_monthly(at.compute_features(prices), top_n = 8)
+    result = incremental.monthly_data(top_n = 8)[expected.columns]
+    pd.testing.assert_index_equal(result.index, expected.index)
+    exact = [c for c in expected.columns if c not in ('atr', 'macd')]
+    pd.testing.assert_frame_equal(result[exact], expected[exact])
+    ## the ATR and MACD are normalized with a running mean and std instead of the two-pass ones
+    np.testing.assert_allclose(result[['atr', 'macd']].to_numpy(), expected[['atr', 'macd']].to_numpy(), rtol = 1e-4, atol = 1e-5)
+
+def test_days_already_in_the_state_are_skipped(prices, incremental):
+    before = incremental.monthly_data(top_n = 8)
+    incremental.update(prices.iloc[-100:])
+    pd.testing.assert_frame_equal(incremental.monthly_data(top_n = 8), before)
+
+## monthly returns and factors of a few tickers with a long history
+def _monthly_returns(n_months = 48, n_tickers = 6):
+    rng = np.random.default_rng(9)
+    months = pd.date_range('2015-01-31', periods = n_months, freq = 'M')
+    factors = pd.DataFrame(rng.normal(0, .04, (n_months, 5)), index = pd.Index(months, name = 'date'),
+                           columns = ['Mkt-RF', 'SMB', 'HML', 'RMW', 'CMA'])
+    tickers = [f'T{i}' for i in range(n_tickers)]
+    index = pd.MultiIndex.from_product([months, tickers], names = ['date', 'ticker'])
+    loadings = rng.uniform(.5, 1.5, (n_tickers, 5))
+    returns = (factors.to_numpy()[:, None, :] * loadings[None]).sum(axis = 2) + rng.normal(0, .02, (n_months, n_tickers))
+    monthly = pd.DataFrame({'adj close': 1., 'return_1m': returns.ravel()}, index = index)
+    return monthly, factors, tickers
+
+def _strategy(tickers):
+    strategy = IncrementalStrategy()
+    strategy._add_tickers(tickers)
+    return strategy
+
+def test_betas_match_the_batch_regression():
+    monthly, factors, tickers = _monthly_returns()
+    expected = at.add_betas(monthly, factors, window = 24)
+    result = _strategy(tickers).add_betas(monthly, factors, window = 24)
+    ## every ticker has more than a full window, so the windows are the same from the 25th month on
+    ## (the shifted betas of the 26th)
+    late = expected.index.get_level_values('date') >= expected.index.get_level_values('date').unique()[25]
+    np.testing.assert_allclose(result[late][factors.columns].to_numpy(), expected[late][factors.columns].to_numpy(), rtol = 1e-8)
+
+def test_betas_are_persisted_between_runs(tmp_path):
+    monthly, factors, tickers = _monthly_returns()
+    whole = _strategy(tickers).add_betas(monthly, factors, window = 24)
+    strategy = _strategy(tickers)
+    ## the factors of the last months aren't out yet on the first run
+    strategy.add_betas(monthly[monthly.index.get_level_values('date') <= '2017-06-30'], factors.loc[:'2017-03-31'], window = 24)
+    assert strategy.beta_month == pd.Timestamp('2017-03-31')
+    strategy.save(str(tmp_path / 'state.pkl'))
+    strategy = IncrementalStrategy.load(str(tmp_path / 'state.pkl'))
+    pd.testing.assert_frame_equal(strategy.add_betas(monthly, factors, window = 24), whole)
@@ -0,0 +1,107 @@
+## the vectorized indicators of indicatorEngine.py
+## against the per-ticker groupby version they replace
+## the reference follows pandas_ta's (0.3.14b) definitions with plain pandas
+## so it runs without pandas_ta (parity_report does the same check with pandas_ta itself)
+## the values should be the same bit for bit, NaNs included
+import numpy as np
+import pandas as pd
+import pytest
+import indicatorEngine as ie
+
+## the pandas_ta recursions, for one ticker
+def _rma(x, length):
+    return x.ewm(alpha = 1 / length, min_periods = length).mean()
+
+def _rsi(close, length):
+    negative = close.diff()
+    positive = negative.copy()
+    positive[positive < 0] = 0
+    negative[negative > 0] = 0
+    positive_avg = _rma(positive, length)
+    negative_avg = _rma(negative, length)
+    return 100 * positive_avg / (positive_avg + negative_avg.abs())
+
+def _bbands(close, length, std = 2.0):
+    mid = close.rolling(length, min_periods = length).mean()
+    deviations = std * close.rolling(length, min_periods = length).var(ddof = 0).apply(np.sqrt)
+    return mid - deviations, mid, mid + deviations
+
+def _atr(high, low, close, length):
+    high_low_range = high - low
+    if (high_low_range == 0).any():
+        high_low_range = high_low_range + np.finfo(float).eps
+    prev_close = close.shift(1)
+    true_range = pd.concat([high_low_range, high - prev_close, prev_close - low], axis = 1).abs().max(axis = 1)
+    true_range.iloc[:1] = np.nan
+    return _rma(true_range, length)
+
+## pandas_ta gives nothing (NaN) for a series shorter than the length
+def _ema(close, length):
+    if len(close) < length:
+        return pd.Series(np.nan, index = close.index)
+    close = close.copy()
+    sma_nth = close[0:length].mean()
+    close[:length - 1] = np.nan
+    close.iloc[length - 1] = sma_nth
+    return close.ewm(span = length, adjust = False).mean()
+
+def _zscore(x):
+    return x.sub(x.mean()).div(x.std())
+
+def _reference(stock_data):
+    adj_close = stock_data['adj close']
+    bb_low, bb_mid, bb_high = _bbands(np.log1p(adj_close), 20)
+    return pd.DataFrame({'rsi': _rsi(adj_close, 20),
+                         'bb_low': bb_low,
+                         'bb_mid': bb_mid,
+                         'bb_high': bb_high,
+                         'atr': _zscore(_atr(stock_data['high'], stock_data['low'], stock_data['close'], 14)),
+                         'macd': _zscore(_ema(adj_close, 12) - _ema(adj_close, 26))}, index = stock_data.index)
+
+## a long (date, ticker) price df with tickers of different lengths
+## a long one, one listed later, one with less history than the longest window
+## one shorter than every window, and one whose first closes are missing
+def _prices():
+    dates = pd.bdate_range('2020-01-01', periods = 120)
+    rng = np.random.default_rng(7)
+    frames = []
+    for ticker, first, n in [('AAA', 0, 120), ('BBB', 40, 80), ('CCC', 100, 20), ('DDD', 115, 5), ('EEE', 10, 110)]:
+        close = 50 * np.exp(np.cumsum(.02 * rng.standard_normal(n)))
+        frame = pd.DataFrame({'close': close,
+                              'high': close * (1 + .01 * rng.random(n)),
+                              'low': close * (1 - .01 * rng.random(n)),
+                              'adj close': close * .97},
+                             index = pd.MultiIndex.from_product([dates[first:first + n], [ticker]], names = ['date', 'ticker']))
+        if ticker == 'EEE':
+            frame.iloc[:7, frame.columns.get_loc('adj close')] = np.nan
+            ## and a day without a range
+            frame.iloc[30, frame.columns.get_loc('high')] = frame['low'].iloc[30]
+        frames.append(frame)
+    return pd.concat(frames).sort_index()
+
+@pytest.fixture(scope = 'module')
+def indicators():
+    data = _prices()
+    expected = data.groupby(level = 'ticker', group_keys = False).apply(_reference).reindex(data.index)
+    return ie.compute_indicators(data), expected
+
+@pytest.mark.parametrize('column', ['rsi', 'bb_low', 'bb_mid', 'bb_high', 'atr', 'macd'])
+def test_matches_the_groupby_reference(indicators, column):
+    result, expected = indicators
+    np.testing.assert_array_equal(result[column].to_numpy(), expected[column].to_numpy())
+
+def test_short_history_is_missing(indicators):
+    result, _ = indicators
+    assert result.xs('DDD', level = 'ticker').isna().all().all()
+    assert result.xs('CCC', level = 'ticker')['rsi'].isna().all()
+    assert result.xs('CCC', level = 'ticker')['bb_mid'].notna().sum() == 1
+
+def test_kernels_on_a_matrix_match_pandas():
+    rng = np.random.default_rng(3)
+    x = rng.standard_normal((60, 4))
+    x[:5, 1] = np.nan
+    x[20:23, 2] = np.nan
+    frame = pd.DataFrame(x)
+    np.testing.assert_allclose(ie.rolling_mean(x, 10), frame.rolling(10).mean().to_numpy(), rtol = 1e-12, atol = 1e-14)
+    np.testing.assert_allclose(ie.rolling_var(x, 10, ddof = 0), frame.rolling(10).var(ddof = 0).to_numpy(), rtol = 1e-12, atol = 1e-14)
+    np.testing.assert_allclose(ie.rma(x, 14), frame.ewm(alpha = 1 / 14, min_periods = 14).mean().to_numpy(), rtol = 1e-12, atol = 1e-14)
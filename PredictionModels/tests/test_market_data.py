@@ -0,0 +1,21 @@
+## the synthetic source of marketData.py
+## a ticker's prices should only depend on the seed and the ticker, not on the date range
+import numpy as np
+import pandas as pd
+import pytest
+from marketData import DataSource, SyntheticSource
+
+def test_prices_do_not_depend_on_the_end_date():
+    short = SyntheticSource(seed = 3).prices(['AAPL', 'MSFT'], '2023-01-01', '2023-12-20')
+    long = SyntheticSource(seed = 3).prices(['AAPL', 'MSFT'], '2023-01-01', '2025-06-30')
+    pd.testing.assert_frame_equal(short, long.loc[short.index])
+
+def test_market_returns_are_extended_not_redrawn():
+    source = SyntheticSource(seed = 3)
+    first = source._market_returns(100).copy()
+    np.testing.assert_array_equal(source._market_returns(1000)[:100], first)
+    np.testing.assert_array_equal(SyntheticSource(seed = 3)._market_returns(1000), source._market_returns(1000))
+
+def test_data_source_is_abstract():
+    with pytest.raises(TypeError):
+        DataSource()
@@ -0,0 +1,21 @@
+## the warm started monthly clustering of monthlyClustering.py
+## the labels shouldn't depend on the number of workers
+import numpy as np
+import pandas as pd
+from monthlyClustering import cluster_months
+
+def _features():
+    dates = pd.date_range('2015-01-31', periods = 24, freq = 'M')
+    tickers = [f'T{i}' for i in range(40)]
+    rng = np.random.default_rng(1)
+    index = pd.MultiIndex.from_product([dates, tickers], names = ['date', 'ticker'])
+    return pd.DataFrame({'rsi': rng.uniform(20, 80, len(index)),
+                         'atr': rng.normal(0, 1, len(index))}, index = index)
+
+def test_labels_do_not_depend_on_the_workers():
+    data = _features()
+    init = np.array([[30, 0], [45, 0], [55, 0], [70, 0]], dtype = np.float64)
+    serial, serial_stats = cluster_months(data, init, max_workers = 1)
+    parallel, parallel_stats = cluster_months(data, init, max_workers = 2)
+    pd.testing.assert_frame_equal(serial, parallel)
+    pd.testing.assert_series_equal(serial_stats['init'], parallel_stats['init'])
@@ -0,0 +1,65 @@
+## the bar by bar indicators of onlineIndicators.py
+## against the batch indicators of indicatorEngine.py on the same closes
+import numpy as np
+import pandas as pd
+import pytest
+import indicatorEngine
+from onlineIndicators import OnlineRSI, OnlineBBands, replay
+from signalRules import SignalRules
+
+## a random walk of 5-min closes, with a flat stretch (no gains nor losses)
+def _closes(n_bars = 500, n = 1, seed = 18):
+    rng = np.random.default_rng(seed)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0, .002, (n_bars, n)), axis = 0))
+    closes[200:215] = closes[199]
+    return closes
+
+def _replay(indicator, closes):
+    return np.array([indicator.update(row) for row in closes])
+
+@pytest.mark.parametrize('length', [2, 14, 20])
+def test_rsi_matches_the_batch(length):
+    closes = _closes()
+    online = _replay(OnlineRSI(length), closes)
+    batch = indicatorEngine.rsi(closes, length = length)
+    ## the warm-up is NaN in both
+    assert np.isnan(online[:length]).all()
+    np.testing.assert_array_equal(online, batch)
+
+@pytest.mark.parametrize('length', [5, 20])
+def test_bbands_match_the_batch(length):
+    closes = _closes()
+    online = _replay(OnlineBBands(length), closes)
+    batch = indicatorEngine.bbands(closes, length = length)
+    for online_band, batch_band in zip(np.moveaxis(online, 1, 0), batch):
+        assert np.isnan(online_band[:length - 1]).all()
+        np.testing.assert_array_equal(online_band, batch_band)
+
+def test_many_symbols_at_once():
+    closes = _closes(n = 4)
+    np.testing.assert_array_equal(_replay(OnlineRSI(20, n = 4), closes), indicatorEngine.rsi(closes, length = 20))
+    lower, mid, upper = indicatorEngine.bbands(closes, length = 20)
+    online = _replay(OnlineBBands(20, n = 4), closes)
+    np.testing.assert_array_equal(online[:, 0], lower)
+    np.testing.assert_array_equal(online[:, 2], upper)
+
+## the signals and the position of the day of the replay
+## against the rules of intradayTrading.py on the batch indicators
+def test_the_replay_matches_the_batch_signals():
+    closes = _closes(n_bars = 78 * 6)[:, 0]
+    index = pd.date_range('2021-03-01 09:30', periods = 78, freq = '5min')
+    index = index.append([index + pd.Timedelta(days = d) for d in range(1, 6)])
+    rng = np.random.default_rng(3)
+    final_df = pd.DataFrame({'close': closes,
+                             'signal_daily': np.repeat(rng.choice([-1., 1., np.nan], 6), 78)}, index = index)
+    online = replay(final_df)
+    batch = final_df.copy()
+    batch['rsi'] = indicatorEngine.rsi(closes[:, None], length = 20)[:, 0]
+    lower, _, upper = indicatorEngine.bbands(closes[:, None], length = 20)
+    batch['lband'], batch['uband'] = lower[:, 0], upper[:, 0]
+    batch['signal_intraday'] = SignalRules([('rsi > 70 and close > uband', 1),
+                                            ('rsi < 30 and close < lband', -1)])(batch)
+    batch['return_sign'] = SignalRules([('signal_daily == 1 and signal_intraday == 1', -1),
+                                        ('signal_daily == -1 and signal_intraday == -1', 1)])(batch)
+    batch['return'] = batch.groupby(batch.index.normalize())['return_sign'].ffill()
+    pd.testing.assert_frame_equal(online, batch[online.columns], check_dtype = False)
@@ -0,0 +1,60 @@
+## the coverage of the local price store of priceStore.py
+import datetime as dt
+import numpy as np
+import pandas as pd
+from priceStore import PriceStore, price_fields
+
+## a fetcher that makes up a row per business day and remembers its calls
+class FakeFetch:
+    def __init__(self, close = 1.):
+        self.calls = []
+        self.close = close
+
+    def __call__(self, tickers, start, end):
+        self.calls.append((list(tickers), start, end))
+        days = pd.bdate_range(start, end - pd.Timedelta(days = 1))
+        index = pd.MultiIndex.from_product([days, tickers], names = ['date', 'ticker'])
+        return pd.DataFrame(self.close, index = index, columns = price_fields)
+
+def test_only_the_missing_ranges_are_fetched(tmp_path):
+    fetch = FakeFetch()
+    store = PriceStore(store_path = str(tmp_path), fetch = fetch)
+    store.refresh(['A', 'B'], '2020-01-01', '2020-03-01')
+    store.refresh(['A', 'B'], '2020-02-01', '2020-04-01')
+    assert [(t, s.strftime('%Y-%m-%d'), e.strftime('%Y-%m-%d')) for t, s, e in fetch.calls] == \
+        [(['A', 'B'], '2020-01-01', '2020-03-01'), (['A', 'B'], '2020-03-01', '2020-04-01')]
+    data = store.load(['A', 'B'], '2020-01-01', '2020-04-01')
+    assert len(data) == 2 * len(pd.bdate_range('2020-01-01', '2020-03-31'))
+
+def test_today_is_fetched_again(tmp_path):
+    today = pd.Timestamp(dt.date.today())
+    start = today - pd.Timedelta(days = 10)
+    end = today + pd.Timedelta(days = 5)
+    first = FakeFetch(close = 1.)
+    PriceStore(store_path = str(tmp_path), fetch = first).refresh(['A'], start, end)
+    store = PriceStore(store_path = str(tmp_path), fetch = FakeFetch(close = 2.))
+    assert store.coverage['A'] == [[start, today]]
+    store.refresh(['A'], start, end)
+    assert store.fetch.calls == [(['A'], today, today + pd.Timedelta(days = 1))]
+    if today.dayofweek < 5:
+        ## the partial bar was replaced by the new one
+        np.testing.assert_array_equal(store.load(['A'], today, end)['Close'].to_numpy(), [2.])
+
+def test_a_failed_download_is_fetched_again(tmp_path):
+    store = PriceStore(store_path = str(tmp_path), fetch = lambda tickers, start, end: pd.DataFrame(columns = price_fields))
+    store.refresh(['A', 'B'], '2020-01-01', '2020-03-01')
+    assert store.coverage == {}
+    store.fetch = FakeFetch()
+    store.refresh(['A', 'B'], '2020-01-01', '2020-03-01')
+    assert len(store.fetch.calls) == 1
+    assert store.coverage['A'] == [[pd.Timestamp('2020-01-01'), pd.Timestamp('2020-03-01')]]
+
+def test_a_ticker_missing_from_an_old_batch_is_covered(tmp_path):
+    fetch = FakeFetch()
+    store = PriceStore(store_path = str(tmp_path), fetch = lambda tickers, start, end: fetch(['A'], start, end))
+    store.refresh(['A', 'B'], '2020-01-01', '2020-03-01')
+    assert store.coverage['B'] == [[pd.Timestamp('2020-01-01'), pd.Timestamp('2020-03-01')]]
+    ## but not when the range is recent, the rows may still come
+    today = pd.Timestamp(dt.date.today())
+    store.refresh(['A', 'B'], today - pd.Timedelta(days = 3), today)
+    assert store.coverage['B'] == [[pd.Timestamp('2020-01-01'), pd.Timestamp('2020-03-01')]]
@@ -0,0 +1,44 @@
+## the monthly liquidity filter of algorithmicTrading.py
+## (and of incrementalUpdate.py, which calls the same select_liquid)
+## against the long df version it replaced
+import numpy as np
+import pandas as pd
+from panelData import Panel
+from algorithmicTrading import select_liquid
+
+## 6 tickers over 3 years of months, T0 is the most liquid one until it's delisted
+def _monthly():
+    dates = pd.date_range('2017-01-31', periods = 36, freq = 'M')
+    tickers = [f'T{i}' for i in range(6)]
+    rng = np.random.default_rng(0)
+    adj_close = rng.uniform(10, 100, (len(dates), len(tickers)))
+    dollar_volume = np.array([1000., 10., 20., 30., 40., 50.]) * rng.uniform(.9, 1.1, (len(dates), len(tickers)))
+    ## T0 stops trading after 2018-12 and T5 only starts in 2018-06
+    adj_close[dates > '2018-12-31', 0] = np.nan
+    dollar_volume[dates > '2018-12-31', 0] = np.nan
+    adj_close[dates < '2018-06-30', 5] = np.nan
+    dollar_volume[dates < '2018-06-30', 5] = np.nan
+    values = np.stack([adj_close, dollar_volume]).astype(np.float32)
+    return Panel(values, ['adj close', 'dollar_volume'], dates, tickers)
+
+## the groupby version of the original script
+def _reference(monthly, top_n):
+    df = pd.concat({field: monthly.to_wide(field).stack() for field in monthly.fields}, axis = 1).dropna()
+    df['dollar_volume_5_yr'] = df['dollar_volume'].unstack('ticker').rolling(5*12, min_periods = 12).mean().stack()
+    df['dollar_volume_ranking'] = df.groupby(level = 0)['dollar_volume_5_yr'].rank(ascending = False)
+    return df[df['dollar_volume_ranking'] <= top_n][['adj close']]
+
+def test_delisted_ticker_is_not_ranked():
+    monthly = _monthly()
+    selected = select_liquid(monthly, ['adj close'], top_n = 3)
+    after = selected.loc['2019-06-30']
+    assert 'T0' not in after.index
+    assert not selected['adj close'].isna().any()
+    assert sorted(after.index) == ['T3', 'T4', 'T5']
+
+def test_matches_groupby_ranking():
+    monthly = _monthly()
+    selected = select_liquid(monthly, ['adj close'], top_n = 3)
+    reference = _reference(monthly, 3)
+    pd.testing.assert_index_equal(selected.index, reference.index.set_names(['date', 'ticker']), exact = False)
+    np.testing.assert_array_equal(selected['adj close'].to_numpy(), reference['adj close'].to_numpy())
@@ -0,0 +1,88 @@
+## the stage keys of stageCache.py
+## a stage should be recomputed when its code, or the code it calls, changes
+## and not when another part of its script (e.g. a parameter of __main__) does
+import stageCache
+from stageCache import module_fingerprint
+
+def _write(path, text):
+    path.write_text(text)
+    return str(path)
+
+def test_module_fingerprint_follows_the_project_imports(tmp_path, monkeypatch):
+    monkeypatch.setattr(stageCache, 'project_path', str(tmp_path))
+    _write(tmp_path / 'kernel.py', 'def f(x):\n    return x + 1\n')
+    _write(tmp_path / 'helpers.py', 'import numpy as np\nfrom kernel import f\n')
+    stage = _write(tmp_path / 'stage.py', 'def run(x):\n    from helpers import f\n    return f(x)\n')
+    before = module_fingerprint(stage)
+    assert module_fingerprint(stage) == before
+    ## a module two imports away
+    _write(tmp_path / 'kernel.py', 'def f(x):\n    return x + 2\n')
+    assert module_fingerprint(stage) != before
+
+def test_unrelated_modules_do_not_change_the_fingerprint(tmp_path, monkeypatch):
+    monkeypatch.setattr(stageCache, 'project_path', str(tmp_path))
+    _write(tmp_path / 'kernel.py', 'def f(x):\n    return x + 1\n')
+    stage = _write(tmp_path / 'stage.py', 'from kernel import f\n')
+    before = module_fingerprint(stage)
+    _write(tmp_path / 'other.py', 'x = 1\n')
+    assert module_fingerprint(stage) == before
+
+## a script with two stages and its parameters in the __main__ block, like algorithmicTrading.py
+script = '''from kernel import f
+
+def helper(x):
+    return f(x)
+
+def features(x):
+    return helper(x) * 2
+
+def selection(x, cluster_id = 3):
+    return x + cluster_id
+
+if __name__ == '__main__':
+    cluster_id = CLUSTER_ID
+'''
+
+def _load(path, name):
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_a_main_parameter_keeps_the_upstream_stages(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(stageCache, 'project_path', str(tmp_path))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    _write(tmp_path / 'kernel.py', 'def f(x):\n    return x + 1\n')
+    cache = stageCache.StageCache(cache_path = str(tmp_path / 'cache'))
+    path = _write(tmp_path / 'pipeline.py', script.replace('CLUSTER_ID', '3'))
+    first = _load(path, 'pipeline')
+    features = cache.run('features', first.features, cache.source('x', 1))
+    cache.run('selection', first.selection, features, cluster_id = 3)
+    ## the script's parameter changes
+    _write(tmp_path / 'pipeline.py', script.replace('CLUSTER_ID', '2'))
+    second = _load(path, 'pipeline')
+    capsys.readouterr()
+    features = cache.run('features', second.features, cache.source('x', 1))
+    selection = cache.run('selection', second.selection, features, cluster_id = 2)
+    assert capsys.readouterr().out.splitlines() == ['features: loaded from cache', 'selection: computing']
+    assert selection.value == 6
+
+def test_a_helper_change_reruns_the_stage(tmp_path, monkeypatch):
+    monkeypatch.setattr(stageCache, 'project_path', str(tmp_path))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    _write(tmp_path / 'kernel.py', 'def f(x):\n    return x + 1\n')
+    path = _write(tmp_path / 'pipeline.py', script.replace('CLUSTER_ID', '3'))
+    first = stageCache.function_fingerprint(_load(path, 'pipeline').features)
+    ## a helper of the same file
+    _write(tmp_path / 'pipeline.py', script.replace('CLUSTER_ID', '3').replace('return f(x)', 'return f(x) + 1'))
+    assert stageCache.function_fingerprint(_load(path, 'pipeline').features) != first
+    ## and a module it imports
+    _write(tmp_path / 'kernel.py', 'def f(x):\n    return x + 2\n')
+    assert stageCache.function_fingerprint(_load(path, 'pipeline').features) != first
+
+def test_the_pipeline_stages_leave_out_the_script():
+    import algorithmicTrading as at
+    sources, modules = stageCache._stage_sources(at.aggregate_monthly)
+    assert sorted(sources) == ['aggregate_monthly', 'select_liquid']
+    assert at.__file__ not in modules
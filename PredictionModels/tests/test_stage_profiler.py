@@ -0,0 +1,21 @@
+## the profile file of stageProfiler.py
+## the records of the forked workers shouldn't wipe out each other's
+import json
+from stageProfiler import _Writer
+from workerPool import process_pool
+
+_writers = {}
+
+def _write(i):
+    _writers['writer'].write({'name': 'child', 'i': i, 'start': 0., 'wall_s': 0., 'pid': 0, 'tid': 0})
+    return i
+
+def test_forked_workers_append(tmp_path):
+    path = tmp_path / 'profile.jsonl'
+    path.write_text('an older run\n')
+    _writers['writer'] = _Writer(str(path))
+    with process_pool(max_workers = 2) as pool:
+        list(pool.map(_write, range(8)))
+    _write(8)
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert sorted(r['i'] for r in records) == list(range(9))
@@ -0,0 +1,33 @@
+## the walk forward engine of walkForward.py
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from walkForward import walk_forward
+
+def _data(n = 400):
+    rng = np.random.default_rng(5)
+    data = pd.DataFrame({'a': rng.standard_normal(n), 'b': rng.standard_normal(n)},
+                        index = pd.bdate_range('2015-01-01', periods = n))
+    data['Target'] = (data['a'] + .5 * rng.standard_normal(n) > 0).astype(int)
+    return data
+
+def test_folds_do_not_depend_on_the_workers():
+    data = _data()
+    model = RandomForestClassifier(n_estimators = 10, random_state = 1)
+    serial, serial_folds = walk_forward(data, model, ['a', 'b'], start = 200, step = 50, window = 100, max_workers = 1)
+    parallel, _ = walk_forward(data, model, ['a', 'b'], start = 200, step = 50, window = 100, max_workers = 2)
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert (serial_folds['train_rows'] == 100).all()
+
+def test_add_trees_fits_the_new_rows_only():
+    data = _data()
+    model = RandomForestClassifier(n_estimators = 10, random_state = 1)
+    _, folds = walk_forward(data, model, ['a', 'b'], start = 200, step = 50, add_trees = 5)
+    assert folds['train_rows'].tolist() == [200, 50, 50, 50]
+    assert folds['trees'].tolist() == [10, 15, 20, 25]
+
+def test_add_trees_with_a_window_raises():
+    with pytest.raises(ValueError):
+        walk_forward(_data(), RandomForestClassifier(n_estimators = 10), ['a', 'b'], start = 200, step = 50,
+                     window = 100, add_trees = 5)
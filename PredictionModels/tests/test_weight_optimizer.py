@@ -0,0 +1,35 @@
+## the cached monthly optimization of weightOptimizer.py
+import numpy as np
+import pandas as pd
+from weightOptimizer import optimize_months
+
+def _prices():
+    rng = np.random.default_rng(6)
+    dates = pd.bdate_range('2019-01-01', '2021-12-31')
+    tickers = [f'T{i}' for i in range(8)]
+    returns = rng.normal(.0005, .015, (len(dates), len(tickers)))
+    return pd.DataFrame(100 * np.exp(np.cumsum(returns, axis = 0)), index = dates, columns = tickers)
+
+## the estimates of a month have different last bits when the running sums
+## come from the previous month's window instead of a fresh one
+## but the month is still read from the cache
+def test_the_cache_does_not_depend_on_the_rolling_path(tmp_path):
+    prices = _prices()
+    stocks = {'2021-01-01': ['T0', 'T1', 'T2', 'T3', 'T4', 'T5'],
+              '2021-02-01': ['T0', 'T1', 'T2', 'T3', 'T4', 'T6'],
+              '2021-03-01': ['T1', 'T2', 'T3', 'T4', 'T5', 'T7']}
+    rolled, rolled_outcomes = optimize_months(prices, stocks, max_workers = 1, cache_path = str(tmp_path))
+    assert not rolled_outcomes['from_cache'].any()
+    ## the last month on its own, from a fresh window
+    alone, alone_outcomes = optimize_months(prices, {'2021-03-01': stocks['2021-03-01']}, max_workers = 1,
+                                            cache_path = str(tmp_path))
+    assert alone_outcomes['from_cache'].all()
+    assert alone['2021-03-01'] == rolled['2021-03-01']
+
+def test_other_prices_are_solved_again(tmp_path):
+    prices = _prices()
+    stocks = {'2021-03-01': ['T1', 'T2', 'T3', 'T4', 'T5', 'T7']}
+    optimize_months(prices, stocks, max_workers = 1, cache_path = str(tmp_path))
+    prices.loc['2021-02-10', 'T3'] *= 1.05
+    _, outcomes = optimize_months(prices, stocks, max_workers = 1, cache_path = str(tmp_path))
+    assert not outcomes['from_cache'].any()